@@ -1,13 +1,17 @@
-import aiohttp
 import asyncio
 import logging
-import json
-from tqdm import tqdm
 from datetime import datetime
 import os
 import random
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from qwenapi import (AsyncQwenCaller as BaseQwenCaller, ConnectionSettings, RequestStats, add_cache_arguments,
+                     add_concurrency_arguments, add_connection_arguments, add_output_arguments, add_pack_arguments,
+                     connection_settings_from_args, estimate_tokens, format_pack_items, iter_questions)
+from json_response import parse_json_response
+from response_cache import ResponseCache
+from result_writer import CheckpointWriter
 # 现代角色库（可自由扩展）
 MODERN_ROLES = [
     # 教育场景
@@ -109,34 +113,13 @@ def setup_logging(log_dir="./logs", log_level=logging.INFO, show_logs=True):
 
 logger = setup_logging()
 
-async def analyze_feedback(feedback_content):
-    """
-    Analyze a single feedback entry using LLM
-    """
-    try:
-        # Clean up the response if it contains code block formatting
-        clean_response = feedback_content
-        if clean_response.startswith('```json'):
-            clean_response = clean_response[7:]  # Remove ```json prefix
-        if clean_response.startswith('```'):
-            clean_response = clean_response[3:]  # Remove ``` prefix
-        if clean_response.endswith('```'):
-            clean_response = clean_response[:-3]  # Remove ``` suffix
-        if clean_response.startswith('```python'):
-            clean_response = clean_response[7:]  # Remove ```json prefix
-        if clean_response.startswith('```'):
-            clean_response = clean_response[3:]  # Remove ``` prefix
-        if clean_response.endswith('```'):
-            clean_response = clean_response[:-3]  # Remove ``` suffix
-        # Parse the cleaned JSON
-        # logger.info(f"clean_response: {clean_response}")
-        result = json.loads(clean_response)
-        # logger.info(f"result: {result}")
-
-        return result
-    except Exception as e:
-        clean_response = json.dumps(clean_response, ensure_ascii=False)
-        return json.loads(clean_response)
+# 判定结果的 JSON Schema
+EMPEROR_SCHEMA = {
+    "type": "object",
+    "properties": {"is_emperor": {"type": "string", "enum": ["是", "不是"]}},
+    "required": ["is_emperor"],
+    "additionalProperties": False,
+}
 async def generate_role_prompt(question):
     """生成带随机角色的prompt"""
     selected_role = random.choice(MODERN_ROLES)
@@ -156,142 +139,130 @@ async def generate_role_prompt(question):
     "is_emperor":""//是或者不是
  }}
 """.strip()
-class AsyncQwenCaller:
-    def __init__(self, max_concurrent=5, max_retries=3):
-        self.max_concurrent = max_concurrent
-        self.max_retries = max_retries
-        self.url = "http://localhost:8001/v1/chat/completions"
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer YOUR_TOKEN"
-        }
-        self._running_tasks = set()
-        self.processed_count = 0
-        self.total_count = 0
-        self.progress_bar = None
-        self.datas = []
-
-    async def __aenter__(self):
-        timeout = aiohttp.ClientTimeout(total=600, connect=10)
-        self.session = aiohttp.ClientSession(timeout=timeout)
-        return self
-
-    async def __aexit__(self, exc_type, exc, tb):
-        await self.session.close()
-
-    async def _call_api(self, question: dict, retry_count=0) -> dict:
-        """实际调用API的异步方法，带重试机制"""
-        try:
-            data = {
-                "model": "Qwen2.5",
-                "messages": [
-                    {"role": "user", "content":await generate_role_prompt(question)}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 4096 * 4
-            }
-
-            async with self.session.post(self.url, headers=self.headers, json=data) as response:
-                response_json = await response.json()
-                response_data = response_json["choices"][0]["message"].get("content")
-                # logger.info(f"回答: {response_data}")
-                # logger.info("-" * 50)
-
-                # question["answer_7b"] = response_data
-                return response_data
-
-        except Exception as e:
-            if retry_count < self.max_retries:
-                wait_time = 2 ** retry_count  # 指数退避
-                # logger.warning(f"请求失败，{wait_time}秒后重试... (错误: {str(e)})")
-                await asyncio.sleep(wait_time)
-                return await self._call_api(question, retry_count + 1)
-            # logger.error(f"处理问题 '{question['question']}' 时发生错误: {str(e)}")
-            return question
-
-    async def _execute_call(self, question: dict, task_id: int):
-        """实际执行调用的内部方法"""
-        try:
-            result = await self._call_api(question)
-            result = await analyze_feedback(result)
-            self.datas.append(result)
-            if self.progress_bar:
-                self.progress_bar.update(1)
-                self.processed_count += 1
-        except Exception as e:
-            # logger.error(f"任务 {task_id} 执行失败: {str(e)}")
-            if self.progress_bar:
-                self.progress_bar.update(1)
-                self.processed_count += 1
-
-    async def process_question(self, question: dict, task_id: int):
-        """处理单个问题"""
-        while len(self._running_tasks) >= self.max_concurrent:
-            done, _ = await asyncio.wait(
-                self._running_tasks,
-                return_when=asyncio.FIRST_COMPLETED
-            )
-            self._running_tasks -= done
-
-        task = asyncio.create_task(self._execute_call(question, task_id))
-        self._running_tasks.add(task)
-        task.add_done_callback(self._running_tasks.discard)
-
-    def set_progress_bar(self, total):
-        """设置进度条"""
-        self.total_count = total
-        self.progress_bar = tqdm(total=total, desc="处理问题", unit="个")
-
-    def close_progress(self):
-        """关闭进度条"""
-        if self.progress_bar:
-            self.progress_bar.close()
-
-
-async def main(input_file: str, output_dir: str, max_concurrent: int = 5, batch_size: int = 100):
-    for j in range(batch_size):
-        questions=[]
-        with open(input_file, "r", encoding="utf-8") as f:
-            data=json.load(f)
-            for i in data:
-                questions.append(i)
-        # for line in f:
-        #     try:
-        #         question = json.loads(line)
-        #         questions.append(question)
-        #     except json.JSONDecodeError:
-        #         logger.warning(f"跳过无效的JSON行: {line[:50]}...")
-
-        # logger.info(f"共读取 {len(questions)} 条问题记录")
-
-        # 异步处理问题
-        async with AsyncQwenCaller(max_concurrent=max_concurrent) as caller:
-            caller.set_progress_bar(len(questions))
-
-            tasks = []
-            for i, question in enumerate(questions):
-                task = caller.process_question(question, i + 1)
-                tasks.append(task)
-
-            # 等待所有任务完成
-            await asyncio.gather(*tasks, return_exceptions=True)
-
-            # 等待剩余的任务完成
-            if caller._running_tasks:
-                await asyncio.wait(caller._running_tasks)
+async def generate_pack_prompt(questions):
+    """生成多条输入一起判定的prompt，要求按 id 返回json数组"""
+    items = [{"id": i, "input": question["input"]} for i, question in enumerate(questions)]
+    return f"""
+## 角色
+- 你是一个资深的语言大师，精通各行各业的语言
+## 任务
+- 你来逐条判断以下输入的是不是皇上说的话，是的话返回是，不是则不是
+- 以下是输入的内容，每条带有 id
+{format_pack_items(items)}
 
-            caller.close_progress()
+## 输出格式
+- 标准json数组，每条输入对应一个元素，id 与输入一致
+- 不要输出其他任何东西
+[{{"id": 0, "is_emperor": ""}}]
+""".strip()
+class AsyncQwenCaller(BaseQwenCaller):
+    """皇上台词判定的调用器，并发控制、重试等复用 qwenapi.AsyncQwenCaller"""
+
+    log_responses = False
+
+    async def build_prompt(self, question: dict) -> str:
+        """生成带随机角色的prompt"""
+        return await generate_role_prompt(question)
+
+    async def parse_response(self, response):
+        """解析模型返回的内容，无法解析时抛出 ResponseParseError"""
+        return parse_json_response(response)
+
+    async def build_pack_prompt(self, questions):
+        """生成打包判定的prompt"""
+        return await generate_pack_prompt(questions)
 
-            # 写入结果
-            batch_output = Path(output_dir) / f"batch_{j+1}.json"
+    def validate_pack_item(self, item):
+        """打包响应中的单条结果必须给出是或不是"""
+        return item.get("is_emperor") in ("是", "不是")
+
+    def response_schema(self):
+        """判定结果只有 is_emperor 一个字段"""
+        return EMPEROR_SCHEMA
+
+    def output_tokens(self, question):
+        """判定结果很短，与输入长度无关"""
+        return 24
+
+    def record_tokens(self, question):
+        """输入内容加上很短的判定结果"""
+        return estimate_tokens(question.get("input", "")) + self.output_tokens(question)
+
+    @property
+    def datas(self):
+        """兼容旧代码的结果列表"""
+        return self.results
+
+
+async def main(input_file: str, output_dir: str, max_concurrent: int = 5, batch_size: int = 100,
+               min_concurrent: int = 1, target_latency: Optional[float] = None, adaptive: bool = True,
+               cache_path: Optional[str] = None, cache_max_entries: Optional[int] = None,
+               cache_max_age: Optional[float] = None, bypass_cache: bool = False, resume: bool = False,
+               connection: Optional[ConnectionSettings] = None, pack_size: int = 1,
+               pack_token_budget: Optional[int] = None, structured_output: Optional[str] = None,
+               tight_max_tokens: bool = False, request_stats: Optional[RequestStats] = None):
+    """
+    对输入数据进行 batch_size 轮采样，第 j 轮结果写入 batch_{j}.json
+
+    输入只解析一次，所有轮次共用一个会话和 worker 池，轮次之间流水线衔接；
+    pack_size 大于 1 时同一轮的多条输入打包在一个请求中判定；request_stats 用于压测时收集请求级统计
+    """
+    questions = list(iter_questions(input_file))
+    logger.info(f"共读取 {len(questions)} 条问题记录，采样 {batch_size} 轮")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 每个batch都是一次重新采样，默认不使用缓存；指定 cache_path 时以批次号作为缓存命名空间，
+    # 崩溃重跑时同一批次复用已有响应，不同批次之间互不影响
+    cache = None
+    if cache_path:
+        cache = ResponseCache(cache_path, max_entries=cache_max_entries, max_age=cache_max_age)
+
+    def open_writer(j: int) -> CheckpointWriter:
+        return CheckpointWriter(str(Path(output_dir) / f"batch_{j+1}.json"), resume=resume)
+
+    # 无法解析的响应单独保存，namespace 字段为所属批次
+    reject_writer = CheckpointWriter(str(Path(output_dir) / "rejects.jsonl"), resume=resume)
+
+    try:
+        async with AsyncQwenCaller(max_concurrent=max_concurrent, min_concurrent=min_concurrent,
+                                   target_latency=target_latency, adaptive=adaptive,
+                                   cache=cache, bypass_cache=bypass_cache, connection=connection,
+                                   pack_size=pack_size, pack_token_budget=pack_token_budget,
+                                   reject_writer=reject_writer, structured_output=structured_output,
+                                   tight_max_tokens=tight_max_tokens, request_stats=request_stats) as caller:
+            caller.set_progress_bar(len(questions) * batch_size)
+            await caller.run_passes(questions, batch_size, open_writer)
+            caller.close_progress()
+    finally:
+        reject_writer.close()
+        if cache is not None:
+            cache.close()
 
-            with open(batch_output, "w", encoding="utf-8") as f:
-                for data in caller.datas:
-                    f.write(json.dumps(data, ensure_ascii=False) + "\n")
+    logger.info(f"所有批次处理完成，共生成 {batch_size} 个batch文件")
 
-        logger.info(f"所有批次处理完成，共生成 {batch_size} 个batch文件")
 if __name__ == "__main__":
-   
-    input_file = f"input/train_data.json"
-    output_file = f"output3"
-    asyncio.run(main(input_file, output_file, max_concurrent=64,batch_size=100))
+    import argparse
+
+    parser = argparse.ArgumentParser(description='对训练数据进行多次采样判定')
+    parser.add_argument('input_file', nargs='?', default="input/train_data.json", help='输入文件路径')
+    parser.add_argument('output_dir', nargs='?', default="output3", help='batch 文件输出目录')
+    parser.add_argument('--max-concurrent', type=int, default=64, help='最大并发请求数（自适应模式下为窗口上限）')
+    add_concurrency_arguments(parser)
+    parser.add_argument('--batch-size', type=int, default=100, help='采样批次数')
+    parser.add_argument('--resume', action='store_true', help='在已有 batch 文件基础上续跑，跳过已完成的记录')
+    # 每轮都是重新采样，默认不使用缓存；指定 --cache-db 后崩溃重跑时同一轮复用已有响应
+    add_cache_arguments(parser, default_path='')
+    add_pack_arguments(parser)
+    add_output_arguments(parser)
+    add_connection_arguments(parser)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.input_file, args.output_dir, max_concurrent=args.max_concurrent,
+                     min_concurrent=args.min_concurrent, target_latency=args.target_latency,
+                     adaptive=not args.fixed_concurrency,
+                     batch_size=args.batch_size, resume=args.resume, cache_path=args.cache_db or None,
+                     cache_max_entries=args.cache_max_entries, cache_max_age=args.cache_max_age,
+                     bypass_cache=args.no_cache,
+                     connection=connection_settings_from_args(args),
+                     pack_size=args.pack_size, pack_token_budget=args.pack_token_budget,
+                     structured_output=args.structured, tight_max_tokens=args.tight_max_tokens))
@@ -0,0 +1,258 @@
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# 识别函数：输入 float32 波形，返回管道的识别结果列表（每项带有 sentence_info）
+Recognizer = Callable[[np.ndarray], List[Dict]]
+# 声纹模型：输入若干段 float32 波形，返回每段一行的嵌入矩阵（与 speaker_index.Embedder 相同）
+Embedder = Callable[[List[np.ndarray]], np.ndarray]
+
+def find_split_points(audio: np.ndarray, sample_rate: int, window_seconds: float, search_seconds: float = 10.0,
+                      frame_ms: int = 20, smooth_frames: int = 10) -> List[int]:
+    """
+    把长音频切成不超过 window_seconds 的窗口，切点选在每个窗口末尾 search_seconds 内能量最低的位置（静音处）
+
+    只计算搜索区间内的帧能量，不为整集音频生成浮点副本
+
+    Args:
+        audio: 波形（int16 或 float32）
+        sample_rate: 采样率
+        window_seconds: 窗口最大时长（秒）
+        search_seconds: 在窗口末尾多长范围内寻找静音（秒）
+        frame_ms: 能量帧长（毫秒）
+        smooth_frames: 平滑的帧数，避免切在两个字之间的短暂停顿
+
+    Returns:
+        List[int]: 切点的采样下标，首尾分别为 0 和 len(audio)
+    """
+    total = len(audio)
+    window = int(window_seconds * sample_rate)
+    search = min(int(search_seconds * sample_rate), window // 2)
+    frame = max(1, sample_rate * frame_ms // 1000)
+    points = [0]
+    while total - points[-1] > window:
+        region_end = points[-1] + window
+        region_start = region_end - search
+        frames = (region_end - region_start) // frame
+        if frames <= smooth_frames:
+            points.append(region_end)
+            continue
+        region = audio[region_start:region_start + frames * frame].astype(np.float32).reshape(frames, frame)
+        energy = np.square(region).mean(axis=1)
+        smoothed = np.convolve(energy, np.ones(smooth_frames, dtype=np.float32), mode="valid")
+        quietest = int(np.argmin(smoothed))
+        points.append(region_start + (quietest + smooth_frames // 2) * frame)
+    points.append(total)
+    return points
+
+def overlap_ms(a: Dict, b: Dict, low: int, high: int) -> int:
+    """两句在 [low, high) 内重叠的毫秒数"""
+    return max(0, min(a['end'], b['end'], high) - max(a['start'], b['start'], low))
+
+class SpeakerReconciler:
+    """
+    把每个窗口各自编号的说话人（spk）映射为整集统一的编号
+
+    相邻窗口有重叠区间时，前一窗口（已映射为全局编号）与后一窗口在重叠区间内同时说话的时长作为证据，
+    按时长从大到小一对一匹配。只靠重叠区间时，在重叠区间内没有说话的人每个窗口都会得到新的编号，
+    因此提供 embed 时为每个全局说话人累积声纹，重叠区间匹配不上的局部说话人再与之前出现过的
+    所有说话人比较余弦相似度，达到阈值的一对一匹配；仍然没有匹配的分配新的全局编号。
+    """
+
+    def __init__(self, embed: Optional[Embedder] = None, sample_rate: int = 16000, threshold: float = 0.6,
+                 max_seconds: float = 30.0, min_segment_seconds: float = 1.0):
+        """
+        Args:
+            embed: 声纹嵌入函数，为空时只按重叠区间匹配
+            sample_rate: 采样率
+            threshold: 按声纹匹配的余弦相似度阈值
+            max_seconds: 每个窗口中每个说话人最多使用的语音时长（秒）
+            min_segment_seconds: 短于该时长的句子不用于计算声纹
+        """
+        self.next_id = 0
+        self.embed = embed
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.max_seconds = max_seconds
+        self.min_segment_seconds = min_segment_seconds
+        # 全局 spk -> 各窗口声纹按时长加权的累加
+        self.profiles: Dict[int, np.ndarray] = {}
+
+    def speaker_embeddings(self, current: List[Dict], audio: np.ndarray, offset_ms: int) -> Dict[int, np.ndarray]:
+        """
+        当前窗口中每个局部说话人的声纹：取最长的若干句，按时长加权累加各句归一化后的嵌入
+
+        Args:
+            current: 当前窗口的全部句子（全局时间、局部 spk）
+            audio: 当前窗口的 float32 波形
+            offset_ms: 波形起点的整集时间（毫秒）
+
+        Returns:
+            Dict[int, np.ndarray]: 局部 spk -> 未归一化的嵌入，没有足够长的句子时不出现
+        """
+        from speaker_index import normalize_rows
+
+        by_speaker: Dict[int, List[Tuple[int, int]]] = {}
+        for sentence in current:
+            if (sentence['end'] - sentence['start']) / 1000 >= self.min_segment_seconds:
+                by_speaker.setdefault(sentence['spk'], []).append((sentence['start'], sentence['end']))
+        embeddings = {}
+        for local, segments in by_speaker.items():
+            chosen, total = [], 0.0
+            for start_ms, end_ms in sorted(segments, key=lambda s: s[0] - s[1]):
+                if total >= self.max_seconds:
+                    break
+                chosen.append((start_ms, end_ms))
+                total += (end_ms - start_ms) / 1000
+            rate = self.sample_rate
+            waveforms = [audio[(start - offset_ms) * rate // 1000:(end - offset_ms) * rate // 1000]
+                         for start, end in chosen]
+            weights = np.array([end - start for start, end in chosen], dtype=np.float32)
+            embeddings[local] = (normalize_rows(self.embed(waveforms)) * weights[:, None]).sum(axis=0)
+        return embeddings
+
+    def assign(self, previous: List[Dict], current: List[Dict], low: int, high: int,
+               audio: Optional[np.ndarray] = None, offset_ms: int = 0) -> Dict[int, int]:
+        """
+        计算当前窗口的说话人映射
+
+        Args:
+            previous: 前一窗口的全部句子（全局时间、全局 spk）
+            current: 当前窗口的全部句子（全局时间、局部 spk）
+            low: 重叠区间起点（毫秒）
+            high: 重叠区间终点（毫秒）
+            audio: 当前窗口的 float32 波形，提供时按声纹匹配之前出现过的说话人
+            offset_ms: 波形起点的整集时间（毫秒）
+
+        Returns:
+            Dict[int, int]: 局部 spk -> 全局 spk
+        """
+        weights: Dict[Tuple[int, int], int] = {}
+        if high > low:
+            for b in current:
+                if b['end'] <= low or b['start'] >= high:
+                    continue
+                for a in previous:
+                    shared = overlap_ms(a, b, low, high)
+                    if shared:
+                        key = (b['spk'], a['spk'])
+                        weights[key] = weights.get(key, 0) + shared
+        mapping: Dict[int, int] = {}
+        used = set()
+        for (local, global_id), _ in sorted(weights.items(), key=lambda item: -item[1]):
+            if local not in mapping and global_id not in used:
+                mapping[local] = global_id
+                used.add(global_id)
+        embeddings = self.speaker_embeddings(current, audio, offset_ms) if self.embed and audio is not None else {}
+        candidates = [g for g in self.profiles if g not in used]
+        unmatched = [local for local in embeddings if local not in mapping]
+        if candidates and unmatched:
+            from speaker_index import normalize_rows
+
+            similarity = (normalize_rows(np.stack([embeddings[local] for local in unmatched]))
+                          @ normalize_rows(np.stack([self.profiles[g] for g in candidates])).T)
+            for flat in np.argsort(-similarity, axis=None):
+                r, c = divmod(int(flat), len(candidates))
+                if similarity[r, c] < self.threshold:
+                    break
+                if unmatched[r] not in mapping and candidates[c] not in used:
+                    mapping[unmatched[r]] = candidates[c]
+                    used.add(candidates[c])
+        for sentence in current:
+            if sentence['spk'] not in mapping:
+                mapping[sentence['spk']] = self.next_id
+                self.next_id += 1
+        for local, embedding in embeddings.items():
+            global_id = mapping[local]
+            self.profiles[global_id] = self.profiles.get(global_id, 0) + embedding
+        return mapping
+
+def shift_sentence(sentence: Dict, offset_ms: int) -> Dict:
+    """
+    把窗口内的相对时间换算为整集时间
+
+    Args:
+        sentence: 管道输出的 sentence_info 条目
+        offset_ms: 窗口起点（毫秒）
+
+    Returns:
+        Dict: 新的句子，start / end / timestamp 都加上偏移
+    """
+    shifted = dict(sentence, start=int(sentence['start']) + offset_ms, end=int(sentence['end']) + offset_ms)
+    if isinstance(sentence.get('timestamp'), list):
+        shifted['timestamp'] = [[int(s) + offset_ms, int(e) + offset_ms] for s, e in sentence['timestamp']]
+    return shifted
+
+def iter_chunked_asr(recognize: Recognizer, audio: np.ndarray, sample_rate: int, window_seconds: float = 600.0,
+                     overlap_seconds: float = 10.0, search_seconds: float = 10.0,
+                     embed: Optional[Embedder] = None) -> Iterator[List[Dict]]:
+    """
+    按静音切分长音频并逐窗口识别，每识别完一个窗口就产出该窗口拼接好的句子
+
+    每个窗口实际送入模型的音频向两侧各多取 overlap_seconds，只保留中点落在窗口本身范围内的句子，
+    重叠部分用于对齐相邻窗口的说话人编号；提供 embed 时还按声纹匹配更早窗口中出现过的说话人，
+    否则在重叠区间内没有说话的人会在每个窗口得到新的编号。
+
+    Args:
+        recognize: 识别函数
+        audio: 整集波形（int16 或 float32）
+        sample_rate: 采样率
+        window_seconds: 窗口最大时长（秒）
+        overlap_seconds: 相邻窗口的重叠时长（秒）
+        search_seconds: 在窗口末尾多长范围内寻找静音（秒）
+        embed: 声纹嵌入函数，为空时只按重叠区间对齐说话人
+
+    Yields:
+        List[Dict]: 一个窗口内的 sentence_info，时间为整集时间，spk 为整集统一编号
+    """
+    points = find_split_points(audio, sample_rate, window_seconds, search_seconds)
+    overlap = int(overlap_seconds * sample_rate)
+    reconciler = SpeakerReconciler(embed, sample_rate)
+    previous: List[Dict] = []
+    previous_end_ms = 0
+    scale = 1.0 / 32768.0 if audio.dtype == np.int16 else 1.0
+    for core_start, core_end in zip(points[:-1], points[1:]):
+        audio_start = max(0, core_start - overlap)
+        audio_end = min(len(audio), core_end + overlap)
+        # 只为当前窗口生成 float32 副本
+        chunk = audio[audio_start:audio_end].astype(np.float32) * scale
+        offset_ms = audio_start * 1000 // sample_rate
+        sentences = [shift_sentence(sentence, offset_ms)
+                     for result in recognize(chunk) for sentence in result.get('sentence_info', [])]
+        mapping = reconciler.assign(previous, sentences, offset_ms, previous_end_ms, chunk, offset_ms)
+        for sentence in sentences:
+            sentence['spk'] = mapping[sentence['spk']]
+        previous, previous_end_ms = sentences, audio_end * 1000 // sample_rate
+
+        low, high = core_start * 1000 // sample_rate, core_end * 1000 // sample_rate
+        yield [s for s in sentences if low <= (s['start'] + s['end']) // 2 < high]
+
+def chunked_result(recognize: Recognizer, audio: np.ndarray, sample_rate: int, key: str,
+                   window_seconds: float = 600.0, overlap_seconds: float = 10.0,
+                   search_seconds: float = 10.0, on_chunk: Optional[Callable[[List[Dict]], None]] = None,
+                   embed: Optional[Embedder] = None) -> Dict:
+    """
+    分窗口识别整集音频，拼接为 to_json.parse_asr_data 可以直接读取的结构化结果
+
+    Args:
+        recognize: 识别函数
+        audio: 整集波形
+        sample_rate: 采样率
+        key: 结果的 key
+        window_seconds: 窗口最大时长（秒）
+        overlap_seconds: 相邻窗口的重叠时长（秒）
+        search_seconds: 在窗口末尾多长范围内寻找静音（秒）
+        on_chunk: 每个窗口完成后的回调，参数为该窗口的句子，用于流式交给下游
+        embed: 声纹嵌入函数，用于对齐不在重叠区间内说话的说话人
+
+    Returns:
+        Dict: {"results": [{"key", "text", "sentence_info"}]}
+    """
+    sentence_info: List[Dict] = []
+    for sentences in iter_chunked_asr(recognize, audio, sample_rate, window_seconds, overlap_seconds, search_seconds,
+                                      embed):
+        if on_chunk is not None:
+            on_chunk(sentences)
+        sentence_info.extend(sentences)
+    text = "".join(sentence['text'] for sentence in sentence_info)
+    return {"results": [{"key": key, "text": text, "sentence_info": sentence_info}]}
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from json_response import ResponseParseError
+from mock_qwen_server import start_server
+from qwenapi import AsyncQwenCaller, ConnectionSettings
+
+def setup_logging(log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    return logging.getLogger(__name__)
+
+async def measure(settings: ConnectionSettings, requests: int, concurrency: int) -> Dict:
+    """
+    用固定并发向服务端发送请求，测量吞吐
+
+    Args:
+        settings: 连接配置
+        requests: 请求总数
+        concurrency: 并发数
+
+    Returns:
+        Dict: requests / errors / seconds / rps
+    """
+    caller = AsyncQwenCaller(max_concurrent=concurrency, max_retries=0, adaptive=False, connection=settings)
+    caller.log_responses = False
+    caller.max_tokens = 64
+    remaining = requests
+    errors = 0
+
+    async def ping(prompt: str) -> bool:
+        # 只比较传输开销，达到 max_tokens 被截断的响应也算完成
+        try:
+            return await caller._post_with_retry(prompt) is not None
+        except ResponseParseError:
+            return True
+
+    async def worker() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            if not await ping("ping"):
+                errors += 1
+
+    async with caller:
+        # 预热：建立连接
+        await asyncio.gather(*(ping("warmup") for _ in range(concurrency)))
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start_time
+    return {"requests": requests, "errors": errors, "seconds": elapsed, "rps": requests / elapsed}
+
+def build_variants(url: str, unix_socket: Optional[str], concurrency: int) -> List[Tuple[str, ConnectionSettings]]:
+    """
+    生成需要对比的连接配置
+
+    Args:
+        url: 桩服务地址
+        unix_socket: 桩服务的 unix socket 路径
+        concurrency: 并发数
+
+    Returns:
+        List[Tuple[str, ConnectionSettings]]: (名称, 配置)
+    """
+    variants = [
+        ("keep-alive (默认)", ConnectionSettings(url=url)),
+        ("关闭 keep-alive", ConnectionSettings(url=url, keepalive=False)),
+        ("关闭压缩", ConnectionSettings(url=url, auto_decompress=False)),
+        (f"连接池={max(1, concurrency // 4)}", ConnectionSettings(url=url, connector_limit=max(1, concurrency // 4))),
+    ]
+    if unix_socket:
+        variants.append(("unix socket", ConnectionSettings(url=url, unix_socket=unix_socket)))
+    return variants
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='测量不同连接配置下 AsyncQwenCaller 的客户端开销')
+    parser.add_argument('--requests', type=int, default=5000, help='每种配置的请求数')
+    parser.add_argument('--concurrency', type=int, default=64, help='并发数')
+    parser.add_argument('--port', type=int, default=8765, help='桩服务端口')
+    parser.add_argument('--latency', type=float, default=0.0, help='桩服务每个请求的延迟（秒）')
+    parser.add_argument('--external', action='store_true', help='使用已经启动的服务而不是自动启动桩服务')
+    parser.add_argument('--unix-socket', default=None, help='外部服务的 unix socket 路径')
+    args = parser.parse_args()
+
+    logger = setup_logging()
+    url = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+    unix_socket = args.unix_socket
+    server = None
+    if not args.external:
+        if unix_socket is None and hasattr(socket, "AF_UNIX"):
+            unix_socket = os.path.join(tempfile.mkdtemp(), "qwen_stub.sock")
+        extra_args = ["--latency", str(args.latency), "--gzip"]
+        if unix_socket:
+            extra_args += ["--unix-socket", unix_socket]
+        server = start_server(args.port, extra_args)
+
+    try:
+        for name, settings in build_variants(url, unix_socket, args.concurrency):
+            result = asyncio.run(measure(settings, args.requests, args.concurrency))
+            logger.info(f"{name:<20} {result['rps']:>10.1f} req/s  耗时 {result['seconds']:.2f}s  失败 {result['errors']}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
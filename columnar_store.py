@@ -0,0 +1,472 @@
+import json
+import os
+import shutil
+import argparse
+import logging
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from sentence import MergedTurn, Sentence, json_default
+from sentence_table import TEXT_SEPARATOR, merge_bounds
+
+# 列式存储目录的后缀，与同名的 JSON 文件并列，如 parsed_asr_result1.cols/
+STORE_SUFFIX = ".cols"
+STORE_FORMAT = "asp-columnar"
+STORE_VERSION = 1
+
+SEPARATOR_BYTES = TEXT_SEPARATOR.encode("utf-8")
+
+# 每种存储包含的数组文件（另有 meta.json）
+SENTENCE_ARRAYS = ("item_offsets", "item_text_offsets", "item_text", "speaker_ids", "start_ms", "end_ms",
+                   "text_offsets", "text", "speaker_rows", "speaker_offsets")
+TURN_ARRAYS = ("turn_bounds", "item_turns")
+
+def store_path(json_path: str) -> str:
+    """
+    JSON 输出文件对应的列式存储目录
+
+    Args:
+        json_path: JSON 文件路径
+
+    Returns:
+        str: 存储目录路径
+    """
+    return os.path.splitext(json_path)[0] + STORE_SUFFIX
+
+def is_store(path: str) -> bool:
+    """路径是否为列式存储目录"""
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+def episode_path(json_path: str) -> str:
+    """
+    选择一集的输入：列式存储与 JSON 都存在时取较新的一个
+
+    Args:
+        json_path: JSON 文件路径
+
+    Returns:
+        str: JSON 文件路径或存储目录路径
+    """
+    path = store_path(json_path)
+    if not is_store(path):
+        return json_path
+    if os.path.exists(json_path) and os.path.getmtime(json_path) > os.path.getmtime(os.path.join(path, "meta.json")):
+        return json_path
+    return path
+
+def store_files(path: str) -> List[str]:
+    """
+    存储目录中的所有文件，用于清单（manifest.py）计算指纹
+
+    Args:
+        path: 存储目录，不存在时按默认布局给出文件名
+
+    Returns:
+        List[str]: 文件路径，meta.json 在第一个
+    """
+    names = list(SENTENCE_ARRAYS)
+    meta_file = os.path.join(path, "meta.json")
+    if os.path.exists(meta_file):
+        with open(meta_file, "r", encoding="utf-8") as f:
+            if json.load(f).get("kind") == "merged":
+                names.extend(TURN_ARRAYS)
+    return [meta_file] + [os.path.join(path, name + ".npy") for name in names]
+
+def encode_texts(texts: Sequence[str], separator: bytes = b"") -> Dict[str, np.ndarray]:
+    """
+    把文本编码为 UTF-8 字节区和偏移数组，第 i 段为 arena[offsets[i]:offsets[i + 1] - len(separator)]
+
+    Args:
+        texts: 文本
+        separator: 每段之后附加的分隔符
+
+    Returns:
+        Dict[str, np.ndarray]: {"arena": uint8 数组, "offsets": int64 数组}
+    """
+    encoded = [text.encode("utf-8") + separator for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return {"arena": np.frombuffer(b"".join(encoded), dtype=np.uint8), "offsets": offsets}
+
+def speaker_postings(speaker_ids: np.ndarray, speaker_count: int) -> Dict[str, np.ndarray]:
+    """
+    按说话人排列的句子下标，第 s 个说话人的句子为 rows[offsets[s]:offsets[s + 1]]（升序）
+
+    Args:
+        speaker_ids: 每句的说话人编号
+        speaker_count: 说话人数
+
+    Returns:
+        Dict[str, np.ndarray]: {"speaker_rows", "speaker_offsets"}
+    """
+    offsets = np.zeros(speaker_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(speaker_ids, minlength=speaker_count), out=offsets[1:])
+    return {"speaker_rows": np.argsort(speaker_ids, kind="stable").astype(np.int64), "speaker_offsets": offsets}
+
+def write_arrays(path: str, meta: Dict, arrays: Dict[str, np.ndarray]) -> None:
+    """
+    写入存储目录：先写入临时目录，完成后再替换旧目录
+
+    Args:
+        path: 存储目录
+        meta: 元数据
+        arrays: 数组名 -> 数组
+    """
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + ".npy"), np.ascontiguousarray(array))
+    # meta.json 最后写入，目录中有它才被视为完整的存储
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(dict(meta, format=STORE_FORMAT, version=STORE_VERSION), f, ensure_ascii=False)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+def write_store(path: str, items: Sequence[Dict]) -> None:
+    """
+    把 to_json 或 merge_speaker 的结果写为列式存储
+
+    Args:
+        path: 存储目录
+        items: 包含 key / text 以及 sentences（Sentence 列表）或 merged_sentences（MergedTurn 列表）的条目
+    """
+    merged = any("merged_sentences" in item for item in items)
+    speaker_index: Dict[str, int] = {}
+    speaker_ids: List[int] = []
+    starts: List[int] = []
+    ends: List[int] = []
+    texts: List[str] = []
+    item_offsets = [0]
+    turn_bounds = [0]
+    item_turns = [0]
+    for item in items:
+        if merged:
+            sentences = []
+            for turn in item.get("merged_sentences", []):
+                sentences.extend(turn.segments())
+                turn_bounds.append(len(texts) + len(sentences))
+            item_turns.append(len(turn_bounds) - 1)
+        else:
+            sentences = item.get("sentences", [])
+        for sentence in sentences:
+            speaker_ids.append(speaker_index.setdefault(sentence.speaker, len(speaker_index)))
+            starts.append(sentence.start_ms)
+            ends.append(sentence.end_ms)
+            texts.append(sentence.text)
+        item_offsets.append(len(texts))
+
+    sentence_text = encode_texts(texts, SEPARATOR_BYTES)
+    item_text = encode_texts([item.get("text", "") for item in items])
+    speaker_array = np.array(speaker_ids, dtype=np.int32)
+    arrays = {
+        "item_offsets": np.array(item_offsets, dtype=np.int64),
+        "item_text_offsets": item_text["offsets"],
+        "item_text": item_text["arena"],
+        "speaker_ids": speaker_array,
+        "start_ms": np.array(starts, dtype=np.int64),
+        "end_ms": np.array(ends, dtype=np.int64),
+        "text_offsets": sentence_text["offsets"],
+        "text": sentence_text["arena"],
+    }
+    arrays.update(speaker_postings(speaker_array, len(speaker_index)))
+    if merged:
+        arrays["turn_bounds"] = np.array(turn_bounds, dtype=np.int64)
+        arrays["item_turns"] = np.array(item_turns, dtype=np.int64)
+    meta = {
+        "kind": "merged" if merged else "parsed",
+        "keys": [item.get("key", "") for item in items],
+        "speakers": list(speaker_index),
+    }
+    write_arrays(path, meta, arrays)
+
+class ItemView:
+    """
+    存储中一个条目的句子，各列为存储数组的切片（不复制）
+
+    有 speaker_ids / start_ms / end_ms 三列和长度，可以直接交给 sentence_table.group_bounds。
+    """
+
+    __slots__ = ("store", "index", "first", "last", "speaker_ids", "start_ms", "end_ms")
+
+    def __init__(self, store: "EpisodeStore", index: int):
+        self.store = store
+        self.index = index
+        self.first = int(store.item_offsets[index])
+        self.last = int(store.item_offsets[index + 1])
+        self.speaker_ids = store.speaker_ids[self.first:self.last]
+        self.start_ms = store.start_ms[self.first:self.last]
+        self.end_ms = store.end_ms[self.first:self.last]
+
+    def __len__(self) -> int:
+        return self.last - self.first
+
+class EpisodeStore:
+    """
+    一集的列式存储（只读），数组按 mmap 映射，只有访问到的部分才会从磁盘读入
+
+    句子文本为 UTF-8 字节区，每句后跟一个分隔符，因此合并后一轮发言的文本就是字节区中的一个切片。
+    句子下标在整集的所有条目中连续编号，MergedTurn 直接引用这些下标。
+    """
+
+    def __init__(self, path: str):
+        """
+        打开存储目录
+
+        Args:
+            path: 存储目录
+
+        Raises:
+            ValueError: 目录不是本格式的存储
+        """
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != STORE_FORMAT or meta.get("version") != STORE_VERSION:
+            raise ValueError(f"不支持的存储格式: {path}")
+        self.path = path
+        self.kind: str = meta["kind"]
+        self.keys: List[str] = meta["keys"]
+        self.speakers: List[str] = meta["speakers"]
+        self._speaker_index = {speaker: i for i, speaker in enumerate(self.speakers)}
+        names = SENTENCE_ARRAYS + (TURN_ARRAYS if self.kind == "merged" else ())
+        for name in names:
+            setattr(self, name, np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+
+    def __len__(self) -> int:
+        """句子数"""
+        return len(self.speaker_ids)
+
+    def __getitem__(self, i: int) -> Sentence:
+        """第 i 句，访问时才解码文本"""
+        return Sentence(self.speakers[self.speaker_ids[i]], self.text_span(i, i + 1),
+                        int(self.start_ms[i]), int(self.end_ms[i]))
+
+    def text_span(self, first: int, last: int) -> str:
+        """
+        第 first 到 last - 1 句用分隔符连接后的文本
+
+        Args:
+            first: 起始句下标
+            last: 结束句下标（不含）
+
+        Returns:
+            str: 文本
+        """
+        if last <= first:
+            return ""
+        return self.text[self.text_offsets[first]:self.text_offsets[last] - len(SEPARATOR_BYTES)].tobytes().decode("utf-8")
+
+    def item(self, index: int) -> ItemView:
+        """第 index 个条目的句子视图"""
+        return ItemView(self, index)
+
+    def item_text_of(self, index: int) -> str:
+        """第 index 个条目的完整文本"""
+        return self.item_text[self.item_text_offsets[index]:self.item_text_offsets[index + 1]].tobytes().decode("utf-8")
+
+    def rows_of(self, speaker: str, item: Optional[int] = None) -> np.ndarray:
+        """
+        某个说话人的所有句子下标（升序），返回存储数组的切片
+
+        Args:
+            speaker: 说话人标签
+            item: 只取该条目中的句子
+
+        Returns:
+            np.ndarray: 句子下标
+        """
+        s = self._speaker_index.get(speaker)
+        if s is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = self.speaker_rows[self.speaker_offsets[s]:self.speaker_offsets[s + 1]]
+        if item is not None:
+            low, high = np.searchsorted(rows, self.item_offsets[item:item + 2])
+            rows = rows[low:high]
+        return rows
+
+    def sentences(self, item: int, speaker: Optional[str] = None) -> List[Sentence]:
+        """
+        条目中的句子
+
+        Args:
+            item: 条目下标
+            speaker: 只取该说话人的句子
+
+        Returns:
+            List[Sentence]: 句子
+        """
+        if speaker is None:
+            rows = range(int(self.item_offsets[item]), int(self.item_offsets[item + 1]))
+        else:
+            rows = self.rows_of(speaker, item).tolist()
+        return [self[i] for i in rows]
+
+    def turns(self, item: int, speaker: Optional[str] = None) -> List[MergedTurn]:
+        """
+        条目中合并后的发言（仅 merged 存储）
+
+        Args:
+            item: 条目下标
+            speaker: 只取该说话人的发言
+
+        Returns:
+            List[MergedTurn]: 发言，句子下标指向本存储
+        """
+        bounds = self.turn_bounds[self.item_turns[item]:self.item_turns[item + 1] + 1]
+        groups = range(len(bounds) - 1)
+        if speaker is not None:
+            s = self._speaker_index.get(speaker, -1)
+            groups = np.flatnonzero(self.speaker_ids[bounds[:-1]] == s).tolist()
+        bounds = bounds.tolist()
+        return [MergedTurn(self, bounds[g], bounds[g + 1], self.text_span(bounds[g], bounds[g + 1])) for g in groups]
+
+    def turn_dicts(self, item: int) -> Iterator[Dict]:
+        """
+        逐个产出条目中合并后的发言，只包含 speaker / text / start_ms / end_ms（不展开 segments）
+
+        Args:
+            item: 条目下标
+
+        Yields:
+            Dict: 发言
+        """
+        bounds = self.turn_bounds[self.item_turns[item]:self.item_turns[item + 1] + 1].tolist()
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            yield {
+                'speaker': self.speakers[self.speaker_ids[first]],
+                'text': self.text_span(first, last),
+                'start_ms': int(self.start_ms[first]),
+                'end_ms': int(self.end_ms[last - 1])
+            }
+
+    def to_items(self, speaker: Optional[str] = None) -> List[Dict]:
+        """
+        还原为 to_json / merge_speaker 的结果结构，可以直接交给它们的 save_results
+
+        Args:
+            speaker: 只保留该说话人的句子或发言
+
+        Returns:
+            List[Dict]: 条目
+        """
+        items = []
+        for index, key in enumerate(self.keys):
+            item = {'key': key, 'text': self.item_text_of(index)}
+            if self.kind == "merged":
+                item['merged_sentences'] = self.turns(index, speaker)
+            else:
+                item['sentences'] = self.sentences(index, speaker)
+            items.append(item)
+        return items
+
+def merge_item_bounds(parsed: EpisodeStore, index: int, time_threshold: int = 2000, policies: Sequence = ()) -> np.ndarray:
+    """
+    条目的合并分组边界（整集的句子下标）
+
+    Args:
+        parsed: 解析结果的存储
+        index: 条目下标
+        time_threshold: 时间间隔阈值（毫秒）
+        policies: 合并策略（见 sentence_table.MERGE_POLICIES）
+
+    Returns:
+        np.ndarray: 分组边界
+    """
+    view = parsed.item(index)
+    return merge_bounds(view, time_threshold, policies) + view.first
+
+def merge_items(parsed: EpisodeStore, time_threshold: int = 2000, policies: Sequence = ()) -> List[Dict]:
+    """
+    合并解析结果的存储，返回 merge_speaker 的结果结构，MergedTurn 直接引用存储中的句子
+
+    Args:
+        parsed: 解析结果的存储
+        time_threshold: 时间间隔阈值（毫秒）
+        policies: 合并策略
+
+    Returns:
+        List[Dict]: 包含 key / text / merged_sentences 的条目
+    """
+    items = []
+    for index, key in enumerate(parsed.keys):
+        bounds = merge_item_bounds(parsed, index, time_threshold, policies).tolist()
+        turns = [MergedTurn(parsed, a, b, parsed.text_span(a, b)) for a, b in zip(bounds[:-1], bounds[1:])]
+        items.append({'key': key, 'text': parsed.item_text_of(index), 'merged_sentences': turns})
+    return items
+
+def merge_store(parsed: EpisodeStore, path: str, time_threshold: int = 2000, policies: Sequence = ()) -> None:
+    """
+    由解析结果的存储直接生成合并结果的存储：句子各列原样写出，只向量化计算每轮发言的边界，不解码文本
+
+    Args:
+        parsed: 解析结果的存储
+        path: 输出存储目录
+        time_threshold: 时间间隔阈值（毫秒）
+        policies: 合并策略
+    """
+    turn_bounds = [np.zeros(1, dtype=np.int64)]
+    item_turns = [0]
+    for index in range(len(parsed.keys)):
+        turn_bounds.append(merge_item_bounds(parsed, index, time_threshold, policies)[1:])
+        item_turns.append(item_turns[-1] + len(turn_bounds[-1]))
+    arrays = {name: getattr(parsed, name) for name in SENTENCE_ARRAYS}
+    arrays["turn_bounds"] = np.concatenate(turn_bounds)
+    arrays["item_turns"] = np.array(item_turns, dtype=np.int64)
+    write_arrays(path, {"kind": "merged", "keys": parsed.keys, "speakers": parsed.speakers}, arrays)
+
+def load_items(path: str) -> List[Dict]:
+    """
+    读取一集的结果，path 可以是 JSON 文件，也可以是列式存储目录
+
+    Args:
+        path: 文件或目录路径
+
+    Returns:
+        List[Dict]: JSON 为原始字典；存储为 to_items 的结果（Sentence / MergedTurn 对象）
+    """
+    if is_store(path):
+        return EpisodeStore(path).to_items()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='把列式存储导出为 JSON 或文本报告')
+    parser.add_argument('store', type=str,
+                      help='存储目录，如 data/merge_results/merged_asr_result1.cols')
+    parser.add_argument('--json', type=str, default=None,
+                      help='导出的JSON文件，格式与 to_json.py / merge_speaker.py 的输出相同')
+    parser.add_argument('--text-report', type=str, default=None,
+                      help='导出的文本报告文件')
+    parser.add_argument('--speaker', type=str, default=None,
+                      help='只导出该说话人的句子或发言')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = EpisodeStore(args.store)
+    items = store.to_items(args.speaker)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False, indent=2, default=json_default)
+        logging.info(f"已导出JSON: {args.json}")
+    if args.text_report:
+        if store.kind == "merged":
+            from merge_speaker import write_text_report
+        else:
+            from to_json import write_text_report
+        write_text_report(items, args.text_report)
+        logging.info(f"已导出文本报告: {args.text_report}")
+    if not args.json and not args.text_report:
+        logging.info(f"{args.store}: {store.kind}，{len(store.keys)} 个条目，{len(store)} 句，{len(store.speakers)} 个说话人")
+
+if __name__ == "__main__":
+    main()
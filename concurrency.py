@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+class ServerOverloadedError(Exception):
+    """服务端返回 429/503 等过载信号"""
+
+class AdaptiveConcurrencyLimiter:
+    """
+    基于 AIMD 的自适应并发窗口
+
+    - 响应时间低于目标时加性增大窗口（未出现过拥塞前按慢启动每次 +1）
+    - 响应时间超过目标、HTTP 429/503 或超时时乘性减小窗口
+    - 同一个拥塞周期（约一个平均响应时间）内只减小一次，避免同一批慢请求把窗口压到底
+    - 等待槽位的请求按先来先得的顺序获得槽位
+    """
+
+    def __init__(self, max_limit: int = 64, min_limit: int = 1, initial: Optional[int] = None,
+                 target_latency: Optional[float] = None, latency_tolerance: float = 2.0,
+                 decrease_factor: float = 0.7, adaptive: bool = True):
+        """
+        初始化并发窗口
+
+        Args:
+            max_limit: 窗口上限
+            min_limit: 窗口下限
+            initial: 初始窗口，默认取 min(max_limit, 8)
+            target_latency: 目标响应时间（秒），为空时取长期平均响应时间 * latency_tolerance
+            latency_tolerance: 未指定目标时允许的短期响应时间相对长期平均的倍数
+            decrease_factor: 乘性减小系数
+            adaptive: 为 False 时窗口固定为 max_limit
+        """
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.adaptive = adaptive
+        if not adaptive:
+            initial = max_limit
+        elif initial is None:
+            initial = min(max_limit, 8)
+        self.limit = float(max(self.min_limit, min(initial, max_limit)))
+        self.target_latency = target_latency
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self.smoothed_latency: Optional[float] = None
+        self.success_count = 0
+        self.overload_count = 0
+        self.timeout_count = 0
+        self.error_count = 0
+        self._slow_start = adaptive
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def window(self) -> int:
+        """当前允许的在途请求数"""
+        return int(self.limit)
+
+    async def acquire(self) -> None:
+        """等待直到在途请求数小于窗口，多个等待者按先来先得的顺序获得槽位"""
+        if self.in_flight < self.window and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已经分配到槽位后才被取消，归还槽位
+                self.in_flight -= 1
+                self._wake_waiters()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def _wake_waiters(self) -> None:
+        """把空出的槽位按顺序分配给等待者"""
+        while self._waiters and self.in_flight < self.window:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def release(self, outcome: str, latency: Optional[float] = None) -> None:
+        """
+        归还一个并发槽位并根据结果调整窗口
+
+        Args:
+            outcome: ok / overload / timeout / error
+            latency: 本次请求耗时（秒）
+        """
+        self.in_flight -= 1
+        if outcome == "ok":
+            self.success_count += 1
+            self._on_success(latency)
+        elif outcome == "overload":
+            self.overload_count += 1
+            self._decrease("服务端过载")
+        elif outcome == "timeout":
+            self.timeout_count += 1
+            self._decrease("请求超时")
+        else:
+            self.error_count += 1
+        self._wake_waiters()
+
+    def slot(self) -> "_LimiterSlot":
+        """
+        获取一个并发槽位的异步上下文管理器，退出时自动根据异常类型上报结果
+
+        Returns:
+            _LimiterSlot: 槽位
+        """
+        return _LimiterSlot(self)
+
+    def _target(self) -> Optional[float]:
+        """当前的目标响应时间"""
+        if self.target_latency is not None:
+            return self.target_latency
+        if self.baseline_latency is None:
+            return None
+        return self.baseline_latency * self.latency_tolerance
+
+    def _on_success(self, latency: Optional[float]) -> None:
+        """成功响应：更新响应时间统计，并按是否超过目标增大或减小窗口"""
+        if latency is None:
+            return
+        # 短期平均反映当前负载，长期平均作为基线；两者都用指数滑动平均，
+        # 避免单次偶然的快/慢响应影响窗口，也能适应提示词长度变化带来的整体延迟变化
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+            self.baseline_latency = latency
+        else:
+            self.smoothed_latency = 0.8 * self.smoothed_latency + 0.2 * latency
+            self.baseline_latency = 0.98 * self.baseline_latency + 0.02 * latency
+
+        if not self.adaptive:
+            return
+        target = self._target()
+        if target is not None and self.smoothed_latency > target:
+            self._decrease("响应时间超过目标")
+        elif self._slow_start:
+            self.limit = min(self.max_limit, self.limit + 1)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self, reason: str) -> None:
+        """乘性减小窗口，同一拥塞周期内只减一次"""
+        if not self.adaptive:
+            return
+        now = time.monotonic()
+        period = self.smoothed_latency or 1.0
+        if now - self._last_decrease < period:
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        old_window = self.window
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        if self.window != old_window:
+            logger.info(f"{reason}，并发窗口 {old_window} -> {self.window}")
+
+    def summary(self) -> str:
+        """返回便于写入日志的统计信息"""
+        latency = f"{self.smoothed_latency:.2f}s" if self.smoothed_latency is not None else "-"
+        return (f"并发窗口: {self.window}, 平均响应时间: {latency}, 成功: {self.success_count}, "
+                f"过载: {self.overload_count}, 超时: {self.timeout_count}, 其他错误: {self.error_count}")
+
+class _LimiterSlot:
+    """AdaptiveConcurrencyLimiter.slot() 返回的上下文管理器"""
+
+    def __init__(self, limiter: AdaptiveConcurrencyLimiter):
+        self.limiter = limiter
+        self.start_time = 0.0
+
+    async def __aenter__(self) -> "_LimiterSlot":
+        await self.limiter.acquire()
+        self.start_time = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        latency = time.monotonic() - self.start_time
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, ServerOverloadedError):
+            outcome = "overload"
+        elif issubclass(exc_type, asyncio.TimeoutError):
+            outcome = "timeout"
+        else:
+            outcome = "error"
+        self.limiter.release(outcome, latency)
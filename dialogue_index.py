@@ -0,0 +1,381 @@
+import json
+import os
+import sys
+import argparse
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from manifest import DEFAULT_MANIFEST, Manifest
+
+def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_dir: 日志目录
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, "dialogue_index.log")
+
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+class DialogueIndex:
+    """
+    所有集合并后发言的倒排索引
+
+    发言按列保存（集数、key、说话人、文本、起止时间，以及同一条目中上一句不同说话人的发言编号），
+    另外维护 字符 -> 发言编号 的倒排表。
+    中文没有天然的分词边界，所以按字符建索引：查询关键词时取各字符倒排表的交集，再确认整个关键词确实出现，
+    因此任意新的关键词都可以直接查询，不需要重新扫描文件。
+    """
+
+    def __init__(self):
+        self.episodes: List[int] = []
+        self.keys: List[str] = []
+        self.speakers: List[str] = []
+        self.texts: List[str] = []
+        self.start_ms: List[int] = []
+        self.end_ms: List[int] = []
+        # 同一条目中上一句不同说话人的发言编号，没有时为 -1
+        self.previous: List[int] = []
+        self.char_postings: Dict[str, List[int]] = {}
+        self._labels: Dict[str, str] = {}
+        # 建立索引时的输入范围和各输入文件的指纹，用于判断索引是否过期
+        self.sources: Dict = {}
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def add_turns(self, episode: int, key: str, turns: Iterable[Dict]) -> None:
+        """
+        添加一个条目中按时间顺序排列的合并发言
+
+        Args:
+            episode: 集数
+            key: 条目 key
+            turns: merge_speaker 输出的发言（包含 speaker / text / start_ms / end_ms）
+        """
+        item_start = len(self.texts)
+        for turn in turns:
+            turn_id = len(self.texts)
+            speaker = self._labels.setdefault(turn['speaker'], turn['speaker'])
+            text = turn['text']
+            if turn_id == item_start:
+                previous = -1
+            elif self.speakers[turn_id - 1] != speaker:
+                previous = turn_id - 1
+            else:
+                # 上一句是同一说话人（间隔过长没有合并），沿用它的上一句
+                previous = self.previous[turn_id - 1]
+            self.episodes.append(episode)
+            self.keys.append(key)
+            self.speakers.append(speaker)
+            self.texts.append(text)
+            self.start_ms.append(turn['start_ms'])
+            self.end_ms.append(turn['end_ms'])
+            self.previous.append(previous)
+            self._index_turn(turn_id)
+
+    def _index_turn(self, turn_id: int) -> None:
+        """把一句发言加入倒排表"""
+        for char in set(self.texts[turn_id]):
+            self.char_postings.setdefault(char, []).append(turn_id)
+
+    def add_episode(self, episode: int, items: Iterable[Dict]) -> None:
+        """
+        添加 merge_speaker 输出的一集（所有条目，而不只是第一个）
+
+        Args:
+            episode: 集数
+            items: 包含 key / merged_sentences 的条目
+        """
+        for item in items:
+            self.add_turns(episode, item.get('key', ''), item.get('merged_sentences', []))
+
+    def find(self, keyword: str) -> List[int]:
+        """
+        查找包含关键词的发言
+
+        Args:
+            keyword: 关键词
+
+        Returns:
+            List[int]: 按顺序排列的发言编号
+        """
+        if not keyword:
+            return []
+        postings = []
+        for char in set(keyword):
+            posting = self.char_postings.get(char)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        if len(keyword) == 1:
+            return sorted(candidates)
+        return sorted(i for i in candidates if keyword in self.texts[i])
+
+    def query(self, keywords: Sequence[str], speakers: Optional[Sequence[str]] = None) -> Iterator[Dict]:
+        """
+        一次查询多个触发关键词，产出 (上一句不同说话人的发言, 触发发言) 对话对
+
+        Args:
+            keywords: 触发关键词，命中任意一个即可
+            speakers: 只保留这些说话人说出的触发发言，None 表示不限
+
+        Yields:
+            pair: 带有 episode / key / keywords 和双方说话人、时间的对话对，orther / huang 字段与 find_huang.py 一致
+        """
+        matches: Dict[int, List[str]] = {}
+        for keyword in dict.fromkeys(keywords):
+            for turn_id in self.find(keyword):
+                matches.setdefault(turn_id, []).append(keyword)
+        allowed = set(speakers) if speakers else None
+        for turn_id in sorted(matches):
+            previous = self.previous[turn_id]
+            if previous < 0:
+                continue
+            if allowed is not None and self.speakers[turn_id] not in allowed:
+                continue
+            yield self._pair(turn_id, previous, matches[turn_id])
+
+    def speaker_pairs(self, episode_speakers: Dict[int, Set[str]]) -> Iterator[Dict]:
+        """
+        不按关键词，产出指定说话人的所有发言与其上一句不同说话人的发言组成的对话对
+
+        Args:
+            episode_speakers: 集数 -> 该集中的说话人标签（如 speaker_index.py 查出的某个角色）
+
+        Yields:
+            pair: 与 query 相同格式的对话对，keywords 为空
+        """
+        for turn_id, previous in enumerate(self.previous):
+            if previous >= 0 and self.speakers[turn_id] in episode_speakers.get(self.episodes[turn_id], ()):
+                yield self._pair(turn_id, previous, [])
+
+    def _pair(self, turn_id: int, previous: int, keywords: List[str]) -> Dict:
+        """由触发发言和上一句生成对话对"""
+        return {
+            'episode': self.episodes[turn_id],
+            'key': self.keys[turn_id],
+            'keywords': keywords,
+            'orther': self.texts[previous],
+            'huang': self.texts[turn_id],
+            'orther_speaker': self.speakers[previous],
+            'huang_speaker': self.speakers[turn_id],
+            'orther_start_ms': self.start_ms[previous],
+            'orther_end_ms': self.end_ms[previous],
+            'huang_start_ms': self.start_ms[turn_id],
+            'huang_end_ms': self.end_ms[turn_id]
+        }
+
+    def save(self, index_file: str) -> None:
+        """
+        保存发言列，倒排表在加载时从内存中的文本重建
+
+        Args:
+            index_file: 索引文件路径
+        """
+        index_dir = os.path.dirname(index_file)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        columns = {
+            'episodes': self.episodes,
+            'keys': self.keys,
+            'speakers': self.speakers,
+            'texts': self.texts,
+            'start_ms': self.start_ms,
+            'end_ms': self.end_ms,
+            'previous': self.previous,
+            'sources': self.sources
+        }
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(columns, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, index_file: str) -> "DialogueIndex":
+        """
+        加载 save 保存的索引
+
+        Args:
+            index_file: 索引文件路径
+
+        Returns:
+            DialogueIndex: 索引
+        """
+        with open(index_file, 'r', encoding='utf-8') as f:
+            columns = json.load(f)
+        index = cls()
+        index.episodes = columns['episodes']
+        index.keys = columns['keys']
+        index.speakers = [index._labels.setdefault(speaker, speaker) for speaker in columns['speakers']]
+        index.texts = columns['texts']
+        index.start_ms = columns['start_ms']
+        index.end_ms = columns['end_ms']
+        index.previous = columns['previous']
+        index.sources = columns.get('sources', {})
+        for turn_id in range(len(index.texts)):
+            index._index_turn(turn_id)
+        return index
+
+def build_index(input_prefix: str, start: int, end: int, logger: logging.Logger) -> DialogueIndex:
+    """
+    读取 merge_speaker 输出的各集文件（JSON 或列式存储）建立索引，每个文件只读一次
+
+    Args:
+        input_prefix: 输入文件前缀
+        start: 起始集数
+        end: 结束集数
+        logger: 日志记录器
+
+    Returns:
+        DialogueIndex: 索引
+    """
+    from columnar_store import EpisodeStore, episode_path, is_store
+
+    index = DialogueIndex()
+    for i in range(start, end + 1):
+        input_file = episode_path(f"{input_prefix}{i}.json")
+        if is_store(input_file):
+            # 列式存储只解码每轮发言的文本，不展开 segments
+            store = EpisodeStore(input_file)
+            for item, key in enumerate(store.keys):
+                index.add_turns(i, key, store.turn_dicts(item))
+            continue
+        try:
+            with open(input_file, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"读取文件失败 {input_file}: {e}")
+            continue
+        index.add_episode(i, items)
+    return index
+
+def index_sources(input_prefix: str, start: int, end: int, manifest: Manifest) -> Dict:
+    """
+    索引的输入范围和各输入文件的指纹（列式存储按目录中的每个文件计算）
+
+    Args:
+        input_prefix: 输入文件前缀
+        start: 起始集数
+        end: 结束集数
+        manifest: 用于计算并缓存文件指纹的清单
+
+    Returns:
+        Dict: 与 DialogueIndex.sources 比较的描述，不存在的文件指纹为 None
+    """
+    from columnar_store import episode_path, is_store, store_files
+
+    files = {}
+    for i in range(start, end + 1):
+        input_file = episode_path(f"{input_prefix}{i}.json")
+        for path in (store_files(input_file) if is_store(input_file) else [input_file]):
+            files[os.path.normpath(path)] = manifest.fingerprint(path)
+    return {'input_prefix': input_prefix, 'start': start, 'end': end, 'files': files}
+
+def load_or_build_index(index_file: str, input_prefix: str, start: int, end: int, logger: logging.Logger,
+                        rebuild: bool = False, manifest_path: str = DEFAULT_MANIFEST) -> DialogueIndex:
+    """
+    加载已有索引；索引不存在、输入范围不同或有输入文件变化时重新建立并保存
+
+    Args:
+        index_file: 索引文件路径
+        input_prefix: 输入文件前缀
+        start: 起始集数
+        end: 结束集数
+        logger: 日志记录器
+        rebuild: 忽略已有索引，总是重新建立
+        manifest_path: 缓存文件指纹的清单文件
+
+    Returns:
+        DialogueIndex: 索引
+    """
+    manifest = Manifest(manifest_path)
+    sources = index_sources(input_prefix, start, end, manifest)
+    manifest.save()
+    if os.path.exists(index_file) and not rebuild:
+        index = DialogueIndex.load(index_file)
+        if index.sources == sources:
+            logger.info(f"已加载索引 {index_file}: {len(index)} 句发言")
+            return index
+        logger.info(f"索引 {index_file} 的输入范围或输入文件有变化，重新建立")
+    index = build_index(input_prefix, start, end, logger)
+    index.sources = sources
+    index.save(index_file)
+    logger.info(f"已建立索引 {index_file}: {len(index)} 句发言")
+    return index
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='为合并后的对话建立倒排索引，按关键词和说话人提取对话对')
+    parser.add_argument('--input-prefix', '-i', type=str, default="data/merge_results/merged_asr_result",
+                      help='merge_speaker.py 输出的JSON文件前缀 (默认: data/merge_results/merged_asr_result)')
+    parser.add_argument('--start', '-s', type=int, default=1,
+                      help='起始文件编号 (默认: 1)')
+    parser.add_argument('--end', '-e', type=int, default=46,
+                      help='结束文件编号 (默认: 46)')
+    parser.add_argument('--index', type=str, default="data/dialogue_index/dialogue_index.json",
+                      help='索引文件，存在且输入没有变化时直接加载 (默认: data/dialogue_index/dialogue_index.json)')
+    parser.add_argument('--rebuild', action='store_true',
+                      help='忽略已有索引，重新读取所有文件')
+    parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST,
+                      help=f'缓存输入文件指纹的清单文件 (默认: {DEFAULT_MANIFEST})')
+    parser.add_argument('--keyword', '-k', type=str, action='append', default=None,
+                      help='触发关键词，可重复指定 (默认: 朕)')
+    parser.add_argument('--speaker', type=str, action='append', default=None,
+                      help='只保留该说话人的触发发言，可重复指定')
+    parser.add_argument('--output', '-o', type=str, default="data/conversion_result/dialogue_pairs.jsonl",
+                      help='输出的JSONL文件，为 - 时写到标准输出 (默认: data/conversion_result/dialogue_pairs.jsonl)')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logger = setup_logging()
+
+    index = load_or_build_index(args.index, args.input_prefix, args.start, args.end, logger, args.rebuild,
+                                args.manifest)
+
+    keywords = args.keyword or ["朕"]
+    pairs = index.query(keywords, args.speaker)
+    pair_count = 0
+    if args.output == '-':
+        for pair in pairs:
+            sys.stdout.write(json.dumps(pair, ensure_ascii=False) + "\n")
+            pair_count += 1
+    else:
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as out:
+            for pair in pairs:
+                out.write(json.dumps(pair, ensure_ascii=False) + "\n")
+                pair_count += 1
+    logger.info(f"关键词 {keywords} 共提取 {pair_count} 条对话对")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,396 @@
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
 import json
-if __name__ == '__main__':
-    audio_in = '/mnt/g/download/02.4K.H265.AAC-YYDS.mp4'
-    output_dir = "/mnt/g/download/results2"
-    inference_pipeline = pipeline(
+import os
+import argparse
+import logging
+import multiprocessing
+import queue
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from asr_chunking import chunked_result
+
+# paraformer 模型要求 16kHz 单声道输入
+SAMPLE_RATE = 16000
+# ffmpeg 输出 16 位有符号整数 PCM
+BYTES_PER_SAMPLE = 2
+# 等待 PCM 消息的超时（秒），超时后检查解码进程是否异常退出
+POLL_SECONDS = 5.0
+
+def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_dir: 日志目录
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, "ext_data.log")
+
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def to_serializable(obj):
+    """json.dump 的 default 回调，把 numpy 标量/数组转换为内置类型"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+def decode_command(audio_file: str, sample_rate: int = SAMPLE_RATE) -> List[str]:
+    """
+    只解复用并解码音轨的 ffmpeg 命令，视频流直接丢弃（-vn），不做 4K H.265 解码
+
+    Args:
+        audio_file: 音视频文件路径
+        sample_rate: 输出采样率
+
+    Returns:
+        List[str]: 命令行
+    """
+    return ["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "1", "-i", audio_file,
+            "-vn", "-sn", "-dn", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-"]
+
+def decode_worker(task_queue, pcm_queue, sample_rate: int, chunk_bytes: int) -> None:
+    """
+    解码进程：依次取出任务，把 PCM 分块放入有界队列，队列满时阻塞，从而限制预读的数据量
+
+    放入队列的消息：
+        ("chunk", episode, bytes)
+        ("end", episode, audio_file, decode_seconds, error)  error 为 None 表示成功
+        ("done",)  该进程已处理完所有任务
+
+    Args:
+        task_queue: (episode, audio_file) 任务队列，None 表示结束
+        pcm_queue: PCM 消息队列
+        sample_rate: 输出采样率
+        chunk_bytes: 每块的字节数
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        episode, audio_file = task
+        start_time = time.perf_counter()
+        error = None
+        try:
+            # stderr 写入临时文件而不是管道：只读 stdout 时，ffmpeg 写满 stderr 管道会阻塞，两边互相等待
+            with tempfile.TemporaryFile() as stderr_file:
+                process = subprocess.Popen(decode_command(audio_file, sample_rate),
+                                           stdout=subprocess.PIPE, stderr=stderr_file)
+                while True:
+                    chunk = process.stdout.read(chunk_bytes)
+                    if not chunk:
+                        break
+                    pcm_queue.put(("chunk", episode, chunk))
+                if process.wait() != 0:
+                    stderr_file.seek(0)
+                    stderr = stderr_file.read().decode('utf-8', errors='replace').strip()
+                    error = f"ffmpeg 退出码 {process.returncode}: {stderr[-500:]}"
+        except OSError as e:
+            error = f"无法启动 ffmpeg: {e}"
+        pcm_queue.put(("end", episode, audio_file, time.perf_counter() - start_time, error))
+    pcm_queue.put(("done",))
+
+def pcm_to_array(chunks: List[bytes]) -> np.ndarray:
+    """
+    把 16 位 PCM 块拼接并转换为 [-1, 1) 的 float32 波形
+
+    Args:
+        chunks: PCM 块
+
+    Returns:
+        np.ndarray: 波形
+    """
+    return np.frombuffer(b"".join(chunks), dtype=np.int16).astype(np.float32) / 32768.0
+
+def build_pipeline(output_dir: str, device: str = "cpu"):
+    """
+    加载一次ASR管道，之后所有集共用
+
+    Args:
+        output_dir: 模型输出目录
+        device: 推理设备，默认只用CPU
+
+    Returns:
+        ASR管道
+    """
+    # 只在消费进程中导入，解码进程（spawn 启动）不需要加载 torch 和 modelscope
+    from modelscope.pipelines import pipeline
+    from modelscope.utils.constant import Tasks
+
+    return pipeline(
         task=Tasks.auto_speech_recognition,
         model='iic/speech_paraformer-large-vad-punc-spk_asr_nat-zh-cn',
         model_revision='v2.0.4',
         vad_model='iic/speech_fsmn_vad_zh-cn-16k-common-pytorch', vad_model_revision="v2.0.4",
         punc_model='iic/punc_ct-transformer_cn-en-common-vocab471067-large', punc_model_revision="v2.0.4",
         output_dir=output_dir,
+        device=device,
     )
-    for i in range(10,49):
-        audio_in = f'/mnt/g/download/mv/{str(i).zfill(2)}.4K.H265.AAC-YYDS.mp4'
-        print(audio_in)
-        rec_result = inference_pipeline(audio_in, batch_size_s=300, batch_size_token_threshold_s=40)
-        print(rec_result)
-        json_output_path = f"{output_dir}/asr_result{i}.json"
-        with open(json_output_path, 'w', encoding='utf-8') as f:
-            if isinstance(rec_result, dict):
-                print("rec_result",rec_result)
-                json.dump(rec_result, f, ensure_ascii=False, indent=2)
-            elif isinstance(rec_result, str):
-                # 如果结果是纯文本，将其转换为简单的字典格式
-                json.dump({"text": rec_result}, f, ensure_ascii=False, indent=2)
-            else:
-                json.dump({"text": str(rec_result)}, f, ensure_ascii=False, indent=2)
-        
-        print(f"识别结果已保存到: {json_output_path}")
\ No newline at end of file
+
+def save_result(rec_result, json_output_path: str) -> None:
+    """
+    保存识别结果（不缩进，避免为整集逐字时间戳生成大量空白）
+
+    Args:
+        rec_result: 管道返回的识别结果
+        json_output_path: 输出文件路径
+    """
+    tmp_path = json_output_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        if isinstance(rec_result, dict):
+            json.dump(rec_result, f, ensure_ascii=False, default=to_serializable)
+        elif isinstance(rec_result, str):
+            # 如果结果是纯文本，将其转换为简单的字典格式
+            json.dump({"text": rec_result}, f, ensure_ascii=False)
+        else:
+            # 识别结果列表直接保存为结构化JSON，to_json.py 不再需要解析 repr 文本
+            json.dump({"results": list(rec_result)}, f, ensure_ascii=False, default=to_serializable)
+    os.replace(tmp_path, json_output_path)
+
+def write_partial(sentences: List[Dict], partial_path: str) -> None:
+    """
+    把一个识别窗口的句子追加到 JSONL 文件，下游可以边识别边读取
+
+    Args:
+        sentences: 窗口内的 sentence_info
+        partial_path: 输出文件路径
+    """
+    with open(partial_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"sentence_info": sentences}, ensure_ascii=False, default=to_serializable) + "\n")
+
+def run_extraction(tasks: List[Tuple[int, str]], output_dir: str, logger: logging.Logger, decoders: int = 2,
+                   queue_chunks: int = 64, chunk_seconds: float = 30.0, device: str = "cpu",
+                   batch_size_s: int = 300, batch_size_token_threshold_s: int = 40,
+                   window_seconds: float = 0.0, overlap_seconds: float = 10.0,
+                   stream_windows: bool = False, link_speakers: bool = False) -> Tuple[int, int]:
+    """
+    解码进程池提前解码后续各集的音频，单个ASR管道从有界队列中依次消费
+
+    一集的识别要等到该集解码完成（收到 "end"）才开始，之前收到的块都缓存在内存中。
+    每个解码进程同时只解码一集，因此缓存最多是 decoders 集的完整 int16 音频，
+    再加上队列中的 queue_chunks 块；有界队列限制的只是超出这部分的预读。
+    一小时的音频约 115MB，内存紧张时应减少 decoders。
+
+    解码进程异常退出（如被 OOM 终止）时不会发出 "done"，等待消息超时后会检查进程状态，
+    它未完成的集记为失败，不会一直等待。
+
+    Args:
+        tasks: (集数, 音视频文件路径)
+        output_dir: 输出目录
+        logger: 日志记录器
+        decoders: 解码进程数
+        queue_chunks: PCM 队列最多缓存的块数
+        chunk_seconds: 每块音频的时长（秒）
+        device: 推理设备
+        batch_size_s: 管道的 batch_size_s 参数
+        batch_size_token_threshold_s: 管道的 batch_size_token_threshold_s 参数
+        window_seconds: 大于 0 时按静音把每集切成不超过该时长的窗口分别识别，限制模型的内存峰值
+        overlap_seconds: 相邻窗口的重叠时长（秒），用于对齐说话人编号
+        stream_windows: 分窗口识别时，每完成一个窗口就追加到 asr_result{i}.partial.jsonl
+        link_speakers: 分窗口识别时加载声纹模型，按声纹对齐不在重叠区间内说话的说话人
+
+    Returns:
+        (success_count, failure_count): 成功和失败的集数
+    """
+    context = multiprocessing.get_context("spawn")
+    task_queue = context.Queue()
+    pcm_queue = context.Queue(maxsize=queue_chunks)
+    for task in tasks:
+        task_queue.put(task)
+    decoders = max(1, min(decoders, len(tasks)))
+    for _ in range(decoders):
+        task_queue.put(None)
+    chunk_bytes = int(chunk_seconds * SAMPLE_RATE) * BYTES_PER_SAMPLE
+    workers = [context.Process(target=decode_worker, args=(task_queue, pcm_queue, SAMPLE_RATE, chunk_bytes), daemon=True)
+               for _ in range(decoders)]
+    for worker in workers:
+        worker.start()
+
+    # 解码进程已经开始工作，加载模型的时间与第一集的解码重叠
+    inference_pipeline = build_pipeline(output_dir, device)
+    embed = None
+    if link_speakers and window_seconds > 0:
+        from speaker_index import load_embedder
+        embed = load_embedder(device)
+
+    metrics_path = os.path.join(output_dir, "metrics.jsonl")
+    pending: Dict[int, List[bytes]] = {}
+    success_count = failure_count = 0
+    total_audio = total_asr = 0.0
+    batch_start = time.perf_counter()
+    running = decoders
+    crashed = set()
+    finished = set()
+    with open(metrics_path, 'a', encoding='utf-8') as metrics_file:
+        while running:
+            try:
+                message = pcm_queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                for worker in workers:
+                    if worker.pid not in crashed and not worker.is_alive() and worker.exitcode != 0:
+                        crashed.add(worker.pid)
+                        running -= 1
+                        logger.error(f"解码进程 {worker.pid} 异常退出，退出码 {worker.exitcode}")
+                continue
+            if message[0] == "chunk":
+                pending.setdefault(message[1], []).append(message[2])
+                continue
+            if message[0] == "done":
+                running -= 1
+                continue
+            _, episode, audio_file, decode_seconds, error = message
+            finished.add(episode)
+            chunks = pending.pop(episode, [])
+            if error or not chunks:
+                logger.error(f"第 {episode} 集解码失败 {audio_file}: {error or '没有音频数据'}")
+                failure_count += 1
+                continue
+
+            def recognize(waveform: np.ndarray):
+                return inference_pipeline(waveform, fs=SAMPLE_RATE, batch_size_s=batch_size_s,
+                                          batch_size_token_threshold_s=batch_size_token_threshold_s)
+
+            json_output_path = os.path.join(output_dir, f"asr_result{episode}.json")
+            asr_start = time.perf_counter()
+            try:
+                if window_seconds > 0:
+                    # 整集保持 int16，只为当前窗口生成 float32 副本
+                    audio = np.frombuffer(b"".join(chunks), dtype=np.int16)
+                    del chunks
+                    on_chunk = None
+                    if stream_windows:
+                        partial_path = os.path.join(output_dir, f"asr_result{episode}.partial.jsonl")
+                        open(partial_path, 'w').close()
+                        on_chunk = lambda sentences: write_partial(sentences, partial_path)
+                    key = os.path.splitext(os.path.basename(audio_file))[0]
+                    rec_result = chunked_result(recognize, audio, SAMPLE_RATE, key, window_seconds,
+                                                overlap_seconds, on_chunk=on_chunk, embed=embed)
+                else:
+                    audio = pcm_to_array(chunks)
+                    del chunks
+                    rec_result = recognize(audio)
+                audio_seconds = len(audio) / SAMPLE_RATE
+                save_result(rec_result, json_output_path)
+            except Exception as e:
+                logger.error(f"第 {episode} 集识别失败 {audio_file}: {e}")
+                failure_count += 1
+                continue
+            asr_seconds = time.perf_counter() - asr_start
+            success_count += 1
+            total_audio += audio_seconds
+            total_asr += asr_seconds
+
+            metrics = {
+                "episode": episode,
+                "audio_file": audio_file,
+                "audio_seconds": round(audio_seconds, 2),
+                "decode_seconds": round(decode_seconds, 2),
+                "asr_seconds": round(asr_seconds, 2),
+                "rtf": round(asr_seconds / audio_seconds, 4) if audio_seconds else None,
+            }
+            metrics_file.write(json.dumps(metrics, ensure_ascii=False) + "\n")
+            metrics_file.flush()
+            logger.info(f"第 {episode} 集完成: 音频 {audio_seconds:.0f}s, 解码 {decode_seconds:.1f}s, "
+                        f"识别 {asr_seconds:.1f}s, RTF {metrics['rtf']} -> {json_output_path}")
+
+    for episode, audio_file in tasks:
+        if episode not in finished:
+            logger.error(f"第 {episode} 集未完成解码 {audio_file}")
+            failure_count += 1
+
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - batch_start
+    if total_audio:
+        logger.info(f"共识别音频 {total_audio:.0f}s, 识别耗时 {total_asr:.0f}s (RTF {total_asr / total_audio:.4f}), "
+                    f"总耗时 {wall:.0f}s (端到端 RTF {wall / total_audio:.4f})")
+    return success_count, failure_count
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='从视频中提取音频并进行语音识别，解码与识别流水线并行')
+    parser.add_argument('--input', '-i', type=str, default="/mnt/g/download/mv",
+                      help='视频文件目录 (默认: /mnt/g/download/mv)')
+    parser.add_argument('--output', '-o', type=str, default="/mnt/g/download/results2",
+                      help='识别结果保存目录 (默认: /mnt/g/download/results2)')
+    parser.add_argument('--pattern', type=str, default="{episode:02d}.4K.H265.AAC-YYDS.mp4",
+                      help='视频文件名模板，{episode} 为集数 (默认: {episode:02d}.4K.H265.AAC-YYDS.mp4)')
+    parser.add_argument('--start', '-s', type=int, default=10,
+                      help='起始集数 (默认: 10)')
+    parser.add_argument('--end', '-e', type=int, default=48,
+                      help='结束集数 (默认: 48)')
+    parser.add_argument('--decoders', type=int, default=2,
+                      help='并行解码音频的进程数 (默认: 2)')
+    parser.add_argument('--queue-chunks', type=int, default=64,
+                      help='PCM 队列最多缓存的块数；正在解码的各集另外完整缓存在内存中，'
+                           '峰值约为 decoders 集的音频 (默认: 64)')
+    parser.add_argument('--chunk-seconds', type=float, default=30.0,
+                      help='每个 PCM 块的音频时长，秒 (默认: 30)')
+    parser.add_argument('--device', type=str, default="cpu",
+                      help='推理设备 (默认: cpu)')
+    parser.add_argument('--batch-size-s', type=int, default=300,
+                      help='管道的 batch_size_s 参数 (默认: 300)')
+    parser.add_argument('--window-seconds', type=float, default=0.0,
+                      help='按静音把每集切成不超过该时长的窗口分别识别，0 表示整集一次识别。'
+                           '说话人只按重叠区间对齐，在重叠区间内没有说话的人每个窗口会得到新的编号，'
+                           '需要时加 --link-speakers (默认: 0)')
+    parser.add_argument('--overlap-seconds', type=float, default=10.0,
+                      help='相邻窗口的重叠时长，用于对齐说话人编号 (默认: 10)')
+    parser.add_argument('--stream-windows', action='store_true',
+                      help='每完成一个窗口就追加到 asr_result{i}.partial.jsonl')
+    parser.add_argument('--link-speakers', action='store_true',
+                      help='分窗口识别时加载声纹模型（CAM++），按声纹把说话人与之前窗口中出现过的说话人对齐')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logger = setup_logging()
+    os.makedirs(args.output, exist_ok=True)
+
+    tasks = []
+    for i in range(args.start, args.end + 1):
+        audio_file = os.path.join(args.input, args.pattern.format(episode=i))
+        if not os.path.exists(audio_file):
+            logger.error(f"找不到文件: {audio_file}")
+            continue
+        tasks.append((i, audio_file))
+    if not tasks:
+        return
+
+    logger.info(f"使用 {args.decoders} 个解码进程处理 {len(tasks)} 集")
+    success_count, failure_count = run_extraction(tasks, args.output, logger, decoders=args.decoders,
+                                                  queue_chunks=args.queue_chunks, chunk_seconds=args.chunk_seconds,
+                                                  device=args.device, batch_size_s=args.batch_size_s,
+                                                  window_seconds=args.window_seconds,
+                                                  overlap_seconds=args.overlap_seconds,
+                                                  stream_windows=args.stream_windows,
+                                                  link_speakers=args.link_speakers)
+    logger.info(f"处理完成 - 成功: {success_count}, 失败: {failure_count}")
+    if failure_count > 0:
+        logger.error(f"有{failure_count}个文件处理失败")
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,69 @@
 import json
+import argparse
+import logging
+from typing import Dict, Iterable, Iterator, List
 
-for i in range(1,47):
-    with open(f"data/merge_results/merged_asr_result{i}.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-        datas=data[0]["merged_sentences"]
-    datajson=[]
-    for j,item in enumerate(datas):
-        if "朕" in item["text"]:
-            print(item["text"])
-            print(j)
-            conversion={"orther":datas[j-1]["text"],"huang":item["text"]}
-            datajson.append(conversion)
-
-    with open(f"data/conversion_result/conversion_result{i}.json", "w", encoding="utf-8") as f:
-        json.dump(datajson, f, ensure_ascii=False, indent=2)
+from manifest import DEFAULT_MANIFEST, Manifest
 
+def extract_pairs(turns: Iterable[Dict], keyword: str = "朕") -> Iterator[Dict]:
+    """
+    从合并后的对话中提取包含关键词的句子及其上一句，组成对话对
+
+    只保留上一句，因此可以直接消费生成器，不需要把整集对话读入内存
+
+    Args:
+        turns: 合并后的句子（可以是生成器）
+        keyword: 触发关键词
+
+    Yields:
+        conversion: {"orther": 上一句, "huang": 包含关键词的句子}
+    """
+    previous = None
+    for turn in turns:
+        if previous is not None and keyword in turn["text"]:
+            yield {"orther": previous["text"], "huang": turn["text"]}
+        previous = turn
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='从合并后的对话中提取包含“朕”的句子及其上一句')
+    parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST,
+                      help=f'记录输入指纹的清单文件，输入和参数没有变化的集会被跳过 (默认: {DEFAULT_MANIFEST})')
+    parser.add_argument('--force', action='store_true',
+                      help='忽略清单，重新处理所有文件')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    manifest = Manifest(args.manifest)
+    params = {"keyword": "朕"}
+    skipped = 0
+    try:
+        for i in range(1, 47):
+            input_file = f"data/merge_results/merged_asr_result{i}.json"
+            output_file = f"data/conversion_result/conversion_result{i}.json"
+            # 合并结果没有变化的集直接跳过
+            if not args.force and manifest.is_fresh("find_huang", [output_file], [input_file], params):
+                skipped += 1
+                continue
+            with open(input_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                datas = data[0]["merged_sentences"]
+            datajson: List[Dict] = list(extract_pairs(datas, params["keyword"]))
+
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(datajson, f, ensure_ascii=False, indent=2)
+            manifest.record("find_huang", [output_file], [input_file], params)
+    finally:
+        manifest.save()
+    logging.info(f"处理完成 - 跳过 {skipped} 个未变化的文件")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import re
+from typing import Dict, List, Optional, Type, Union
+
+# 失败原因代码 -> 说明
+PARSE_FAILURE_REASONS = {
+    "empty": "响应为空",
+    "no_json": "响应中没有JSON",
+    "truncated": "JSON不完整，响应可能被截断",
+    "invalid": "JSON语法错误",
+    "unexpected_type": "JSON类型不符合预期",
+    "schema_mismatch": "JSON不符合输出schema",
+}
+
+# JSON Schema 类型 -> Python 类型
+_SCHEMA_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+# 值结束时最后一个字符的可能取值：字符串、对象、数组、数字、true/false/null
+_VALUE_END = set('"}]0123456789el')
+
+# 字符串内除结尾引号和原始换行以外的内容
+_STRING_BODY = re.compile(r'(?:[^"\\\n]|\\.)*', re.DOTALL)
+
+class ResponseParseError(ValueError):
+    """模型响应无法解析为JSON，reason 为 PARSE_FAILURE_REASONS 中的代码"""
+
+    def __init__(self, reason: str, detail: str = ""):
+        message = PARSE_FAILURE_REASONS.get(reason, reason)
+        super().__init__(f"{message}: {detail}" if detail else message)
+        self.reason = reason
+
+def extract_json_text(text: str, opener: str = "{") -> str:
+    """
+    单遍扫描找到第一个以 opener 开头的JSON值，并顺带修正模型常见的格式问题
+
+    - 忽略前面的说明文字和 ``` 代码块标记
+    - 去掉字符串外的 // 和 /* */ 注释（提示词模板里就带有 // 注释，模型经常照抄）
+    - 去掉 } 或 ] 前多余的逗号
+    - 补上换行分隔的字段之间缺失的逗号
+    - 把字符串内的原始换行转义为 \\n
+
+    Args:
+        text: 模型返回的内容
+        opener: 起始字符，{ 或 [
+
+    Returns:
+        str: 可以交给 json.loads 的文本
+
+    Raises:
+        ResponseParseError: 找不到JSON或JSON不完整
+    """
+    start = text.find(opener)
+    if start < 0:
+        raise ResponseParseError("no_json", repr(text[:50]))
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    pending_comma = False
+    last = ""
+    i, n = start, len(text)
+    while i < n:
+        if in_string:
+            # 一次跳过字符串中的普通字符和转义序列
+            end = _STRING_BODY.match(text, i).end()
+            out.append(text[i:end])
+            i = end
+            if i >= n:
+                break
+            if text[i] == '"':
+                in_string = False
+                last = '"'
+                out.append('"')
+            else:
+                out.append("\\n")
+            i += 1
+            continue
+        ch = text[i]
+        if ch == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        if ch == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            continue
+        if ch in " \t\r\n":
+            out.append(ch)
+        elif ch == ",":
+            pending_comma = True
+        elif ch in "}]":
+            # 丢弃结尾多余的逗号
+            pending_comma = False
+            if not stack or (stack[-1] == "{") != (ch == "}"):
+                raise ResponseParseError("invalid", f"第 {i} 个字符处括号不匹配")
+            stack.pop()
+            out.append(ch)
+            last = ch
+            if not stack:
+                return "".join(out)
+        else:
+            if pending_comma:
+                out.append(",")
+                pending_comma = False
+            elif stack and ch in '"{[' and last in _VALUE_END:
+                out.append(",")
+            if ch == '"':
+                in_string = True
+            elif ch in "{[":
+                stack.append(ch)
+            out.append(ch)
+            last = ch
+        i += 1
+    raise ResponseParseError("truncated", f"缺少 {len(stack)} 个闭合括号")
+
+def parse_json_response(text: str, expect: Type = dict) -> Union[dict, list]:
+    """
+    解析模型响应中的第一个JSON对象（expect=list 时为第一个JSON数组）
+
+    Args:
+        text: 模型返回的内容
+        expect: 期望的类型，dict 或 list
+
+    Returns:
+        Union[dict, list]: 解析结果
+
+    Raises:
+        ResponseParseError: 无法解析，reason 说明原因
+    """
+    if not text or not text.strip():
+        raise ResponseParseError("empty")
+    json_text = extract_json_text(text, "[" if expect is list else "{")
+    try:
+        value = json.loads(json_text)
+    except json.JSONDecodeError as e:
+        raise ResponseParseError("invalid", e.msg) from None
+    if not isinstance(value, expect):
+        raise ResponseParseError("unexpected_type", type(value).__name__)
+    return value
+
+def validate_schema(value, schema: Dict, path: str = "$") -> Optional[str]:
+    """
+    按 JSON Schema 的常用子集校验数据：type、enum、properties、required、additionalProperties、items
+
+    Args:
+        value: 待校验的数据
+        schema: JSON Schema
+        path: 当前位置，用于错误信息
+
+    Returns:
+        Optional[str]: 第一个不符合的位置和原因，符合时为 None
+    """
+    expected = schema.get("type")
+    if expected is not None:
+        python_type = _SCHEMA_TYPES[expected]
+        # bool 是 int 的子类，需要单独排除
+        if not isinstance(value, python_type) or (isinstance(value, bool) and expected in ("integer", "number")):
+            return f"{path} 应为 {expected}"
+    if "enum" in schema and value not in schema["enum"]:
+        return f"{path} 的取值 {value!r} 不在 {schema['enum']} 中"
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", ()):
+            if key not in value:
+                return f"{path} 缺少字段 {key}"
+        for key, item in value.items():
+            if key in properties:
+                error = validate_schema(item, properties[key], f"{path}.{key}")
+                if error:
+                    return error
+            elif schema.get("additionalProperties") is False:
+                return f"{path} 有多余的字段 {key}"
+    if isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            error = validate_schema(item, schema["items"], f"{path}[{i}]")
+            if error:
+                return error
+    return None
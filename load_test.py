@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import qwenapi
+from mock_qwen_server import add_behavior_arguments, behavior_arguments, start_server
+from qwenapi import ConnectionSettings, RequestStats, add_output_arguments
+
+def setup_logging(log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    return logging.getLogger(__name__)
+
+def write_dialogue_input(path: str, records: int) -> None:
+    """
+    生成 qwenapi.process_file 的输入（find_huang/pipeline 输出格式的JSONL）
+
+    Args:
+        path: 输出路径
+        records: 记录数
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(records):
+            record = {"episode": i % 46 + 1, "key": f"asr_{i}",
+                      "orther": f"启禀皇上，第{i}件奏折已经送到了。", "huang": f"朕知道了，第{i}件先放着吧。"}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def write_emperor_input(path: str, records: int) -> None:
+    """
+    生成 api.main 的输入（JSON数组）
+
+    Args:
+        path: 输出路径
+        records: 记录数
+    """
+    questions = [{"input": f"朕知道了，第{i}件先放着吧。", "output": ""} for i in range(records)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(questions, f, ensure_ascii=False)
+
+def count_unparsed(rejects_file: Path) -> int:
+    """
+    统计无法解析的响应数
+
+    Args:
+        rejects_file: 拒绝文件
+
+    Returns:
+        int: 记录数
+    """
+    if not rejects_file.exists():
+        return 0
+    with open(rejects_file, "r", encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+def report(name: str, stats: RequestStats, records: int, elapsed: float, cpu: float, unparsed: int) -> None:
+    """
+    输出一次压测的结果
+
+    Args:
+        name: 被测入口
+        stats: 请求级统计
+        records: 处理的记录数
+        elapsed: 墙钟耗时（秒）
+        cpu: 客户端进程 CPU 时间（秒）
+        unparsed: 无法解析的记录数
+    """
+    def ms(p: float) -> str:
+        value = stats.percentile(p)
+        return f"{value * 1000:.1f}ms" if value is not None else "-"
+
+    requests = len(stats.latencies)
+    logging.info(f"[{name}] 记录 {records}, 请求 {requests}, 耗时 {elapsed:.2f}s, "
+                 f"吞吐 {requests / elapsed:.1f} req/s ({records / elapsed:.1f} 条/s)")
+    logging.info(f"[{name}] 延迟 p50 {ms(50)}, p95 {ms(95)}, p99 {ms(99)}")
+    logging.info(f"[{name}] 重试 {stats.retries}, 重试耗尽 {stats.failures}, 状态码 {dict(sorted(stats.status_counts.items()))}, "
+                 f"无法解析 {unparsed}")
+    logging.info(f"[{name}] 客户端CPU {cpu:.2f}s ({cpu / elapsed:.0%})")
+
+async def run_process_file(args, workdir: Path, connection: ConnectionSettings) -> None:
+    """
+    压测 qwenapi.process_file
+
+    Args:
+        args: 命令行参数
+        workdir: 临时文件目录
+        connection: 连接配置
+    """
+    input_file = workdir / "dialogue.jsonl"
+    output_file = workdir / "process_file" / "result.jsonl"
+    write_dialogue_input(str(input_file), args.records)
+    stats = RequestStats()
+    start_time, start_cpu = time.perf_counter(), time.process_time()
+    await qwenapi.process_file(str(input_file), str(output_file), args.max_concurrent,
+                               adaptive=not args.fixed_concurrency, connection=connection,
+                               pack_size=args.pack_size, pack_token_budget=args.pack_token_budget,
+                               structured_output=args.structured, tight_max_tokens=args.tight_max_tokens,
+                               request_stats=stats)
+    elapsed, cpu = time.perf_counter() - start_time, time.process_time() - start_cpu
+    rejects_file = Path(qwenapi.default_rejects_file(str(output_file)))
+    report("process_file", stats, args.records, elapsed, cpu, count_unparsed(rejects_file))
+
+async def run_api_main(args, workdir: Path, connection: ConnectionSettings) -> None:
+    """
+    压测 api.main（多轮采样）
+
+    Args:
+        args: 命令行参数
+        workdir: 临时文件目录
+        connection: 连接配置
+    """
+    import api
+
+    input_file = workdir / "train_data.json"
+    output_dir = workdir / "api"
+    write_emperor_input(str(input_file), args.records)
+    stats = RequestStats()
+    start_time, start_cpu = time.perf_counter(), time.process_time()
+    await api.main(str(input_file), str(output_dir), max_concurrent=args.max_concurrent, batch_size=args.passes,
+                   adaptive=not args.fixed_concurrency, connection=connection,
+                   pack_size=args.pack_size, pack_token_budget=args.pack_token_budget,
+                   structured_output=args.structured, tight_max_tokens=args.tight_max_tokens,
+                   request_stats=stats)
+    elapsed, cpu = time.perf_counter() - start_time, time.process_time() - start_cpu
+    report("api.main", stats, args.records * args.passes, elapsed, cpu, count_unparsed(output_dir / "rejects.jsonl"))
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='用本地桩服务压测 qwenapi.process_file 和 api.main')
+    parser.add_argument('--target', choices=['process_file', 'api', 'all'], default='all', help='被测入口')
+    parser.add_argument('--records', type=int, default=1000, help='输入记录数')
+    parser.add_argument('--passes', type=int, default=3, help='api.main 的采样轮数')
+    parser.add_argument('--max-concurrent', type=int, default=64, help='最大并发请求数')
+    parser.add_argument('--fixed-concurrency', action='store_true', help='关闭自适应并发')
+    parser.add_argument('--pack-size', type=int, default=1, help='每个请求打包的记录数')
+    parser.add_argument('--pack-token-budget', type=int, default=None, help='每个打包请求的估计token上限')
+    parser.add_argument('--port', type=int, default=8765, help='桩服务端口')
+    parser.add_argument('--external', action='store_true', help='使用已经启动的服务而不是自动启动桩服务')
+    parser.add_argument('--workdir', default=None, help='输入输出文件目录，默认使用临时目录')
+    add_output_arguments(parser)
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    setup_logging()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="qwen_load_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    connection = ConnectionSettings(url=f"http://127.0.0.1:{args.port}/v1/chat/completions")
+    server = None if args.external else start_server(args.port, behavior_arguments(args))
+    try:
+        if args.target in ('process_file', 'all'):
+            asyncio.run(run_process_file(args, workdir, connection))
+        if args.target in ('api', 'all'):
+            asyncio.run(run_api_main(args, workdir, connection))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    logging.info(f"输入输出文件保存在: {workdir}")
+
+if __name__ == "__main__":
+    main()
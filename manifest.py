@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Sequence
+
+DEFAULT_MANIFEST = "data/manifest.json"
+
+def hash_params(params: Dict) -> str:
+    """
+    阶段参数的指纹
+
+    Args:
+        params: 会影响输出的参数
+
+    Returns:
+        str: sha256 十六进制串
+    """
+    text = json.dumps(params, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class Manifest:
+    """
+    记录每个输出文件由哪些输入（内容哈希）和哪些参数生成，用于跳过没有变化的工作
+
+    输入文件的哈希按 (大小, 修改时间) 缓存，文件没有被改动时不重新读取。
+    上游阶段重新生成了内容相同的文件时哈希不变，下游仍然会跳过；内容变化时只有依赖它的下游文件会重做。
+    """
+
+    def __init__(self, path: str = DEFAULT_MANIFEST):
+        """
+        加载清单，文件不存在时为空
+
+        Args:
+            path: 清单文件路径
+        """
+        self.path = path
+        self.files: Dict[str, Dict] = {}
+        self.outputs: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.outputs = data.get("outputs", {})
+
+    def fingerprint(self, file_path: str) -> Optional[str]:
+        """
+        文件内容的 sha256
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            Optional[str]: 哈希，文件不存在时为 None
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        key = os.path.normpath(file_path)
+        cached = self.files.get(key)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+        self.files[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        return sha256
+
+    def _entry(self, stage: str, inputs: Sequence[str], params: Dict) -> Optional[Dict]:
+        """按当前输入内容和参数生成的清单条目，有输入不存在时为 None"""
+        hashes = {}
+        for input_file in inputs:
+            sha256 = self.fingerprint(input_file)
+            if sha256 is None:
+                return None
+            hashes[os.path.normpath(input_file)] = sha256
+        return {"stage": stage, "inputs": hashes, "params": hash_params(params)}
+
+    def is_fresh(self, stage: str, outputs: Sequence[str], inputs: Sequence[str], params: Dict) -> bool:
+        """
+        输出是否已经由相同的输入内容和参数生成过
+
+        Args:
+            stage: 阶段名
+            outputs: 输出文件，第一个作为清单中的键
+            inputs: 输入文件
+            params: 会影响输出的参数
+
+        Returns:
+            bool: 所有输出都存在、输出内容没有被改动且输入和参数都没有变化时为 True
+        """
+        recorded = self.outputs.get(os.path.normpath(outputs[0]))
+        if recorded is None:
+            return False
+        for output_file in outputs:
+            if self.fingerprint(output_file) != recorded.get("outputs", {}).get(os.path.normpath(output_file)):
+                return False
+        entry = self._entry(stage, inputs, params)
+        return entry is not None and all(recorded.get(k) == v for k, v in entry.items())
+
+    def record(self, stage: str, outputs: Sequence[str], inputs: Sequence[str], params: Dict) -> None:
+        """
+        记录输出由哪些输入和参数生成，需要调用 save 写入磁盘
+
+        Args:
+            stage: 阶段名
+            outputs: 输出文件，第一个作为清单中的键
+            inputs: 输入文件
+            params: 会影响输出的参数
+        """
+        entry = self._entry(stage, inputs, params)
+        if entry is None:
+            return
+        entry["outputs"] = {os.path.normpath(f): self.fingerprint(f) for f in outputs}
+        self.outputs[os.path.normpath(outputs[0])] = entry
+
+    def save(self) -> None:
+        """原子地写入清单文件"""
+        manifest_dir = os.path.dirname(self.path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "outputs": self.outputs}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
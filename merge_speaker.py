@@ -1,9 +1,15 @@
 import json
 import os
+import argparse
 import logging
-from typing import Dict, List, Optional
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 from pathlib import Path
 
+from manifest import DEFAULT_MANIFEST, Manifest
+from sentence import MergedTurn, Sentence, json_default
+
 def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
     """
     设置日志配置
@@ -28,18 +34,17 @@ def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> log
     )
     return logging.getLogger(__name__)
 
-def merge_sentences(sentences: List[Dict], time_threshold: int = 2000) -> List[Dict]:
+def iter_merge_sentences(sentences: Iterable[Dict], time_threshold: int = 2000) -> Iterator[Dict]:
     """
-    合并连续的相同说话人的句子
+    逐组合并连续的相同说话人的句子，每合并完一组就产出一组
     
     Args:
-        sentences: 原始句子列表
+        sentences: 原始句子（可以是生成器）
         time_threshold: 时间间隔阈值（毫秒）
     
-    Returns:
-        merged_sentences: 合并后的句子列表
+    Yields:
+        current_group: 合并后的句子组
     """
-    merged_sentences = []
     current_group = None
     
     for sentence in sentences:
@@ -49,7 +54,7 @@ def merge_sentences(sentences: List[Dict], time_threshold: int = 2000) -> List[D
             sentence['start_ms'] - current_group['end_ms'] > time_threshold):
             
             if current_group is not None:
-                merged_sentences.append(current_group)
+                yield current_group
             
             current_group = {
                 'speaker': sentence['speaker'],
@@ -74,42 +79,161 @@ def merge_sentences(sentences: List[Dict], time_threshold: int = 2000) -> List[D
     
     # 添加最后一组
     if current_group is not None:
-        merged_sentences.append(current_group)
+        yield current_group
+
+def merge_sentences(sentences: List[Dict], time_threshold: int = 2000) -> List[Dict]:
+    """
+    合并连续的相同说话人的句子
+    
+    Args:
+        sentences: 原始句子列表
+        time_threshold: 时间间隔阈值（毫秒）
     
-    return merged_sentences
+    Returns:
+        merged_sentences: 合并后的句子列表
+    """
+    return list(iter_merge_sentences(sentences, time_threshold))
 
-def save_results(merged_results: List[Dict], output_file: str) -> None:
+def text_output_path(output_file: str) -> str:
     """
-    保存合并结果
+    JSON 结果对应的文本格式输出路径
     
     Args:
-        merged_results: 合并后的结果
-        output_file: 输出文件路径
+        output_file: JSON输出文件路径
+    
+    Returns:
+        str: 文本文件路径
     """
-    # 保存JSON格式
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(merged_results, f, ensure_ascii=False, indent=2)
+    return output_file.rsplit('.', 1)[0] + '.txt'
+
+def input_path(json_path: str) -> str:
+    """
+    一集的输入：to_json.py 的列式存储比 JSON 新时读取存储目录
+    
+    Args:
+        json_path: JSON输入文件路径
+    
+    Returns:
+        str: JSON文件路径或存储目录路径
+    """
+    from columnar_store import episode_path
+    
+    return episode_path(json_path)
+
+def input_files(input_file: str) -> List[str]:
+    """
+    输入对应的所有文件，用于清单记录
+    
+    Args:
+        input_file: JSON文件路径或存储目录路径
     
-    # 保存文本格式
-    text_output = output_file.rsplit('.', 1)[0] + '.txt'
+    Returns:
+        List[str]: 文件路径
+    """
+    if os.path.isdir(input_file):
+        from columnar_store import store_files
+        return store_files(input_file)
+    return [input_file]
+
+def write_text_report(merged_results: List[Dict], text_output: str) -> None:
+    """
+    写出文本格式的报告
+    
+    Args:
+        merged_results: 合并后的结果，merged_sentences 为 MergedTurn 列表
+        text_output: 文本文件路径
+    """
     with open(text_output, 'w', encoding='utf-8') as f:
         for item in merged_results:
             f.write(f"\n=== 文件: {item['key']} ===\n\n")
             
-            for sentence in item['merged_sentences']:
-                f.write(f"说话人: {sentence['speaker']}\n")
-                f.write(f"时间段: {sentence['start_ms']}-{sentence['end_ms']}ms\n")
-                f.write(f"内容: {sentence['text']}\n\n")
+            for turn in item['merged_sentences']:
+                f.write(f"说话人: {turn.speaker}\n")
+                f.write(f"时间段: {turn.start_ms}-{turn.end_ms}ms\n")
+                f.write(f"内容: {turn.text}\n\n")
             f.write("-" * 80 + "\n")
 
-def process_file(input_file: str, output_file: str, logger: logging.Logger) -> bool:
+def output_files(output_file: str, output_format: str = "json", text_report: bool = False) -> List[str]:
+    """
+    一集的所有输出文件，用于清单记录
+    
+    Args:
+        output_file: JSON输出文件路径
+        output_format: json 或 columnar
+        text_report: 是否输出文本报告
+    
+    Returns:
+        List[str]: 文件路径
+    """
+    if output_format == "columnar":
+        from columnar_store import store_files, store_path
+        files = store_files(store_path(output_file))
+    else:
+        files = [output_file]
+    if text_report:
+        files.append(text_output_path(output_file))
+    return files
+
+def save_results(merged_results: List[Dict], output_file: str, output_format: str = "json",
+                 text_report: bool = False) -> None:
+    """
+    保存合并结果
+    
+    Args:
+        merged_results: 合并后的结果，merged_sentences 为 MergedTurn 列表
+        output_file: 输出文件路径，columnar 格式时写入同名的 .cols 目录
+        output_format: json 或 columnar（columnar_store.py 的列式存储）
+        text_report: 是否同时输出文本报告
+    """
+    if output_format == "columnar":
+        from columnar_store import store_path, write_store
+        
+        write_store(store_path(output_file), merged_results)
+    else:
+        # 保存JSON格式，MergedTurn 在写出时才展开为字典
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(merged_results, f, ensure_ascii=False, indent=2, default=json_default)
+    
+    if text_report:
+        write_text_report(merged_results, text_output_path(output_file))
+
+def merge_turns(sentences: Sequence[Sentence], time_threshold: int = 2000) -> List[MergedTurn]:
+    """
+    合并连续的相同说话人的句子，每组只记录下标范围，文本只拼接一次
+    
+    Args:
+        sentences: 句子列表
+        time_threshold: 时间间隔阈值（毫秒）
+    
+    Returns:
+        turns: 合并后的发言
+    """
+    turns = []
+    first = 0
+    for i in range(1, len(sentences) + 1):
+        if (i == len(sentences) or
+            sentences[i].speaker != sentences[i - 1].speaker or
+            sentences[i].start_ms - sentences[i - 1].end_ms > time_threshold):
+            text = ' '.join([sentence.text for sentence in sentences[first:i]])
+            turns.append(MergedTurn(sentences, first, i, text))
+            first = i
+    return turns
+
+def process_file(input_file: str, output_file: str, logger: logging.Logger, columnar: bool = False,
+                 time_threshold: int = 2000, output_format: str = "json", text_report: bool = False,
+                 policies: Sequence[str] = ()) -> bool:
     """
     处理单个文件
     
     Args:
-        input_file: 输入文件路径
+        input_file: 输入文件路径（JSON文件或 to_json.py 输出的列式存储目录）
         output_file: 输出文件路径
         logger: 日志记录器
+        columnar: 是否使用列式向量化合并
+        time_threshold: 时间间隔阈值（毫秒）
+        output_format: json 或 columnar
+        text_report: 是否同时输出文本报告
+        policies: 合并策略描述（如 absorb:800），指定时使用列式合并
     
     Returns:
         bool: 处理是否成功
@@ -118,23 +242,46 @@ def process_file(input_file: str, output_file: str, logger: logging.Logger) -> b
         # 确保输出目录存在
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         
+        merge_policies = []
+        if policies:
+            from sentence_table import parse_policy
+            merge_policies = [parse_policy(spec) for spec in policies]
+        
+        if os.path.isdir(input_file):
+            from columnar_store import EpisodeStore, merge_items, merge_store, store_path
+            
+            store = EpisodeStore(input_file)
+            if output_format == "columnar" and not text_report:
+                # 列式输入、列式输出：只计算发言边界，不解码文本
+                merge_store(store, store_path(output_file), time_threshold, merge_policies)
+            else:
+                save_results(merge_items(store, time_threshold, merge_policies), output_file, output_format, text_report)
+            logger.info(f"文件处理成功: {input_file}")
+            return True
+        
         # 读取原始数据
         with open(input_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
+        if columnar or policies:
+            from sentence_table import SentenceTable, merge_table
+        
         merged_results = []
         for item in data:
             sentences = item.get('sentences', [])
-            merged_sentences = merge_sentences(sentences)
+            if columnar or policies:
+                turns = merge_table(SentenceTable.from_sentences(sentences), time_threshold, merge_policies).turns()
+            else:
+                turns = merge_turns([Sentence.from_dict(sentence) for sentence in sentences], time_threshold)
             
             merged_item = {
                 'key': item.get('key', ''),
                 'text': item.get('text', ''),
-                'merged_sentences': merged_sentences
+                'merged_sentences': turns
             }
             merged_results.append(merged_item)
         
-        save_results(merged_results, output_file)
+        save_results(merged_results, output_file, output_format, text_report)
         logger.info(f"文件处理成功: {input_file}")
         return True
         
@@ -142,27 +289,118 @@ def process_file(input_file: str, output_file: str, logger: logging.Logger) -> b
         logger.error(f"处理文件时发生错误: {e}")
         return False
 
+def process_episode(task: Tuple[str, str, bool, int, str, bool, List[str]]) -> Tuple[bool, float]:
+    """
+    在工作进程中处理单集文件
+    
+    Args:
+        task: (输入文件路径, 输出文件路径, 是否使用列式合并, 时间间隔阈值, 输出格式, 是否输出文本报告, 合并策略)
+    
+    Returns:
+        (success, elapsed): 是否成功以及耗时（秒）
+    """
+    input_file, output_file, columnar, time_threshold, output_format, text_report, policies = task
+    start_time = time.perf_counter()
+    success = process_file(input_file, output_file, logging.getLogger(__name__), columnar, time_threshold,
+                           output_format, text_report, policies)
+    return success, time.perf_counter() - start_time
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+    
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='合并连续的相同说话人的句子')
+    parser.add_argument('--input-prefix', '-i', type=str, default="data/parsed_results/parsed_asr_result",
+                      help='输入的JSON文件前缀 (默认: data/parsed_results/parsed_asr_result)')
+    parser.add_argument('--output-prefix', '-o', type=str, default="data/merge_results/merged_asr_result",
+                      help='输出的JSON文件前缀 (默认: data/merge_results/merged_asr_result)')
+    parser.add_argument('--start', '-s', type=int, default=1,
+                      help='起始文件编号 (默认: 1)')
+    parser.add_argument('--end', '-e', type=int, default=46,
+                      help='结束文件编号 (默认: 46)')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                      help='并行处理的进程数，1 表示串行 (默认: 1)')
+    parser.add_argument('--columnar', action='store_true',
+                      help='使用基于 NumPy 列式数组的向量化合并，结果与默认方式相同')
+    parser.add_argument('--format', type=str, choices=["json", "columnar"], default="json",
+                      help='输出格式，columnar 为 columnar_store.py 的列式存储 (默认: json)')
+    parser.add_argument('--text-report', action='store_true',
+                      help='同时输出文本格式的报告（默认不输出）')
+    parser.add_argument('--time-threshold', type=int, default=2000,
+                      help='合并说话人的时间间隔阈值，毫秒 (默认: 2000)')
+    parser.add_argument('--policy', type=str, action='append', default=None,
+                      help='按顺序应用的合并策略，可重复指定：absorb[:最长毫秒] 并入他人的短插话，'
+                           'overlap 并入与前后发言重叠的他人发言，cap[:最长毫秒] 切开过长的发言')
+    parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST,
+                      help=f'记录输入指纹的清单文件，输入和参数没有变化的集会被跳过 (默认: {DEFAULT_MANIFEST})')
+    parser.add_argument('--force', action='store_true',
+                      help='忽略清单，重新处理所有文件')
+    return parser.parse_args()
+
 def main():
     """主函数"""
+    args = parse_arguments()
     logger = setup_logging()
     
     success_count = 0
     failure_count = 0
+    manifest = Manifest(args.manifest)
+    params = {'time_threshold': args.time_threshold}
+    policies = args.policy or []
+    if policies:
+        from sentence_table import parse_policy
+        try:
+            for spec in policies:
+                parse_policy(spec)
+        except ValueError as e:
+            logger.error(f"合并策略错误: {e}")
+            return
+        params['policies'] = policies
     
-    for i in range(1, 47):
-        input_file = f"data/parsed_results/parsed_asr_result{i}.json"
-        output_file = f"data/merge_results/merged_asr_result{i}.json"
-        
-        logger.info(f"正在处理文件: {input_file}")
-        
-        if process_file(input_file, output_file, logger):
-            success_count += 1
-        else:
-            failure_count += 1
+    tasks = []
+    for i in range(args.start, args.end + 1):
+        input_file = input_path(f"{args.input_prefix}{i}.json")
+        output_file = f"{args.output_prefix}{i}.json"
+        # 输入内容和参数都没有变化的集直接跳过
+        if not args.force and manifest.is_fresh("merge_speaker", output_files(output_file, args.format, args.text_report),
+                                                input_files(input_file), params):
+            continue
+        tasks.append((input_file, output_file, args.columnar, args.time_threshold, args.format, args.text_report,
+                      policies))
+    if len(tasks) < args.end - args.start + 1:
+        logger.info(f"跳过 {args.end - args.start + 1 - len(tasks)} 个未变化的文件")
+    
+    batch_start = time.perf_counter()
+    if args.workers > 1:
+        logger.info(f"使用 {args.workers} 个进程并行处理 {len(tasks)} 个文件")
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        outcomes = executor.map(process_episode, tasks)
+    else:
+        executor = None
+        outcomes = map(process_episode, tasks)
+    
+    try:
+        # 按输入顺序汇总结果，日志和统计与并行度无关
+        for task, (success, elapsed) in zip(tasks, outcomes):
+            logger.info(f"文件 {task[0]} 处理{'成功' if success else '失败'}，耗时 {elapsed:.2f}s")
+            if success:
+                success_count += 1
+                input_file, output_file, _, _, output_format, text_report, _ = task
+                manifest.record("merge_speaker", output_files(output_file, output_format, text_report),
+                                input_files(input_file), params)
+            else:
+                failure_count += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        manifest.save()
     
-    logger.info(f"处理完成 - 成功: {success_count}, 失败: {failure_count}")
+    logger.info(f"处理完成 - 成功: {success_count}, 失败: {failure_count}, 总耗时 {time.perf_counter() - batch_start:.2f}s")
     if failure_count > 0:
         logger.error(f"有{failure_count}个文件处理失败")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
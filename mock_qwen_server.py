@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+from aiohttp import web
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+RESPONSE_SHAPES = ("fenced", "bare", "garbage")
+
+# 打包提示词中每条记录单独占一行，以 {"id": n 开头
+PACK_ITEM_PATTERN = re.compile(r'^\{"id": (\d+)', re.MULTILINE)
+
+def build_completion(model: str, content: str, finish_reason: str = "stop") -> dict:
+    """
+    构造 OpenAI 兼容的 chat completion 响应
+
+    Args:
+        model: 模型名称
+        content: 返回的内容
+        finish_reason: stop，或因 max_tokens 截断时为 length
+
+    Returns:
+        dict: 响应体
+    """
+    return {
+        "id": f"chatcmpl-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(content), "total_tokens": len(content)}
+    }
+
+def build_answer(prompt: str) -> object:
+    """
+    根据提示词生成结构正确的回答：皇上台词判定（api.py）或对话校验（qwenapi.py），单条或打包
+
+    Args:
+        prompt: 提示词
+
+    Returns:
+        object: 单条时为字典，打包时为带 id 的列表
+    """
+    if "is_emperor" in prompt:
+        answer = {"is_emperor": random.choice(["是", "不是"])}
+    else:
+        answer = {"result": random.choice(["是", "否"]), "input": "皇上，臣有本奏。", "output": "朕知道了。"}
+    ids = PACK_ITEM_PATTERN.findall(prompt)
+    if ids:
+        return [dict(answer, id=int(i)) for i in ids]
+    return answer
+
+def render_content(answer: object, shape: str) -> str:
+    """
+    按指定形态输出回答
+
+    Args:
+        answer: 回答数据
+        shape: fenced（```json 代码块）/ bare（纯 JSON）/ garbage（无法解析的文本）
+
+    Returns:
+        str: 模型返回的内容
+    """
+    text = json.dumps(answer, ensure_ascii=False, indent=1)
+    if shape == "fenced":
+        return f"```json\n{text}\n```"
+    if shape == "garbage":
+        return f"好的，下面是结果：{text[:len(text) // 2]}"
+    return text
+
+def truncate_to_tokens(content: str, max_tokens: int) -> str:
+    """
+    按非 ASCII 字符每字 1 个 token、ASCII 每 4 个字符 1 个 token 粗略模拟 max_tokens 截断
+
+    Args:
+        content: 完整内容
+        max_tokens: 最大生成长度
+
+    Returns:
+        str: 截断后的内容，未超出时原样返回
+    """
+    tokens = 0.0
+    for i, ch in enumerate(content):
+        tokens += 1.0 if ord(ch) > 127 else 0.25
+        if tokens > max_tokens:
+            return content[:i]
+    return content
+
+class MockBehavior:
+    """桩服务的延迟、错误和响应形态配置"""
+
+    def __init__(self, latency: float = 0.0, latency_dist: str = "fixed", latency_sigma: float = 0.5,
+                 error_rate: float = 0.0, burst_period: float = 0.0, burst_duration: float = 0.0,
+                 shapes: Optional[Dict[str, float]] = None, compress: bool = False):
+        """
+        初始化配置
+
+        Args:
+            latency: 平均延迟（秒）
+            latency_dist: 延迟分布，fixed / uniform（0~2倍平均）/ exponential / lognormal
+            latency_sigma: lognormal 分布的 sigma，越大长尾越明显
+            error_rate: 返回 HTTP 500 的概率
+            burst_period: 429 突发的周期（秒），0 表示不产生突发
+            burst_duration: 每个周期开始后持续返回 429 的时长（秒）
+            shapes: 响应形态及权重，默认全部为 fenced
+            compress: 客户端接受时是否压缩响应
+        """
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.burst_period = burst_period
+        self.burst_duration = burst_duration
+        self.shapes = shapes or {"fenced": 1.0}
+        self.compress = compress
+        self.start_time = time.monotonic()
+
+    def sample_latency(self) -> float:
+        """按配置的分布采样一次延迟"""
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_dist == "uniform":
+            return random.uniform(0, 2 * self.latency)
+        if self.latency_dist == "exponential":
+            return random.expovariate(1 / self.latency)
+        if self.latency_dist == "lognormal":
+            # 调整 mu 使均值等于 latency
+            mu = math.log(self.latency) - self.latency_sigma ** 2 / 2
+            return random.lognormvariate(mu, self.latency_sigma)
+        return self.latency
+
+    def in_burst(self) -> bool:
+        """当前是否处于 429 突发期"""
+        if self.burst_period <= 0:
+            return False
+        return (time.monotonic() - self.start_time) % self.burst_period < self.burst_duration
+
+    def sample_shape(self) -> str:
+        """按权重选择响应形态"""
+        shapes = list(self.shapes)
+        return random.choices(shapes, weights=[self.shapes[s] for s in shapes])[0]
+
+def parse_shapes(spec: str) -> Dict[str, float]:
+    """
+    解析响应形态权重，格式为 fenced=0.6,bare=0.3,garbage=0.1
+
+    Args:
+        spec: 形态权重字符串
+
+    Returns:
+        Dict[str, float]: 形态 -> 权重
+    """
+    shapes = {}
+    for part in spec.split(","):
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        if name not in RESPONSE_SHAPES:
+            raise ValueError(f"未知的响应形态: {name}")
+        shapes[name] = float(weight) if weight else 1.0
+    return shapes
+
+def create_app(behavior: Optional[MockBehavior] = None) -> web.Application:
+    """
+    创建本地桩服务
+
+    Args:
+        behavior: 延迟、错误和响应形态配置
+
+    Returns:
+        web.Application: aiohttp 应用
+    """
+    behavior = behavior or MockBehavior()
+
+    async def chat_completions(request: web.Request) -> web.Response:
+        payload = await request.json()
+        if behavior.in_burst():
+            return web.json_response({"error": {"message": "rate limited"}}, status=429)
+        delay = behavior.sample_latency()
+        if delay:
+            await asyncio.sleep(delay)
+        if behavior.error_rate and random.random() < behavior.error_rate:
+            return web.json_response({"error": {"message": "internal error"}}, status=500)
+        prompt = payload["messages"][-1]["content"]
+        # 带有输出 schema 的请求模拟约束解码，总是返回合法的纯 JSON
+        structured = "response_format" in payload or "guided_json" in payload
+        content = render_content(build_answer(prompt), "bare" if structured else behavior.sample_shape())
+        finish_reason = "stop"
+        if payload.get("max_tokens"):
+            truncated = truncate_to_tokens(content, payload["max_tokens"])
+            if len(truncated) < len(content):
+                content, finish_reason = truncated, "length"
+        response = web.json_response(build_completion(payload.get("model", ""), content, finish_reason))
+        if behavior.compress:
+            response.enable_compression()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+def add_behavior_arguments(parser) -> None:
+    """
+    添加桩服务行为相关的命令行参数
+
+    Args:
+        parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--latency', type=float, default=0.0, help='平均延迟（秒）')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='fixed', help='延迟分布')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='lognormal 分布的 sigma')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 HTTP 500 的概率')
+    parser.add_argument('--burst-period', type=float, default=0.0, help='429 突发周期（秒），0 表示不突发')
+    parser.add_argument('--burst-duration', type=float, default=0.0, help='每个周期内持续返回 429 的时长（秒）')
+    parser.add_argument('--shapes', default='fenced', help='响应形态及权重，如 fenced=0.6,bare=0.3,garbage=0.1')
+
+def behavior_arguments(args) -> List[str]:
+    """
+    把解析后的行为参数还原成命令行参数，用于启动子进程
+
+    Args:
+        args: 解析后的参数
+
+    Returns:
+        List[str]: 命令行参数
+    """
+    return ["--latency", str(args.latency), "--latency-dist", args.latency_dist,
+            "--latency-sigma", str(args.latency_sigma), "--error-rate", str(args.error_rate),
+            "--burst-period", str(args.burst_period), "--burst-duration", str(args.burst_duration),
+            "--shapes", args.shapes]
+
+def start_server(port: int, extra_args: Sequence[str] = (), host: str = "127.0.0.1",
+                 timeout: float = 10.0) -> subprocess.Popen:
+    """
+    在子进程中启动桩服务并等待端口可以连接
+
+    Args:
+        port: 监听端口
+        extra_args: 额外的命令行参数
+        host: 监听地址
+        timeout: 等待启动的超时（秒）
+
+    Returns:
+        subprocess.Popen: 服务进程
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--host", host, "--port", str(port), *extra_args]
+    server = subprocess.Popen(command)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+    server.terminate()
+    raise TimeoutError(f"桩服务 {host}:{port} 未能启动")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='OpenAI 兼容的本地桩服务，用于测量客户端开销和压测')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--unix-socket', default=None, help='同时监听的 unix socket 路径')
+    parser.add_argument('--gzip', action='store_true', help='客户端接受时压缩响应')
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    behavior = MockBehavior(latency=args.latency, latency_dist=args.latency_dist, latency_sigma=args.latency_sigma,
+                            error_rate=args.error_rate, burst_period=args.burst_period,
+                            burst_duration=args.burst_duration, shapes=parse_shapes(args.shapes),
+                            compress=args.gzip)
+    web.run_app(create_app(behavior), host=args.host, port=args.port, path=args.unix_socket,
+                access_log=None, print=None)
+
+if __name__ == "__main__":
+    main()
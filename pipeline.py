@@ -0,0 +1,161 @@
+import json
+import os
+import sys
+import argparse
+import logging
+from typing import Dict, Iterable, Iterator, Optional, TextIO
+
+from to_json import iter_asr_items, convert_sentence
+from merge_speaker import iter_merge_sentences
+from find_huang import extract_pairs
+
+def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_dir: 日志目录
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, "pipeline.log")
+
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def iter_jsonl(f: TextIO, logger: logging.Logger) -> Iterator[Dict]:
+    """
+    逐行读取JSONL，跳过空行和无法解析的行
+
+    Args:
+        f: 已打开的文本文件
+        logger: 日志记录器
+
+    Yields:
+        record: 每一行解析出的记录
+    """
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.warning(f"跳过无效的JSON行 {line_no}: {e}")
+
+def iter_asr_files(input_prefix: str, start: int, end: int, logger: logging.Logger) -> Iterator[Dict]:
+    """
+    按集数依次读取 ext_data.py 生成的ASR结果文件，一次只保留一集
+
+    Args:
+        input_prefix: 输入文件前缀
+        start: 起始集数
+        end: 结束集数
+        logger: 日志记录器
+
+    Yields:
+        record: 带有 episode 字段的ASR结果
+    """
+    for i in range(start, end + 1):
+        input_file = f"{input_prefix}{i}.json"
+        try:
+            with open(input_file, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"读取文件失败 {input_file}: {e}")
+            continue
+        record.setdefault('episode', i)
+        yield record
+
+def run_pipeline(records: Iterable[Dict], keyword: str = "朕", time_threshold: int = 2000,
+                 logger: Optional[logging.Logger] = None) -> Iterator[Dict]:
+    """
+    串联 解析 → 说话人合并 → 关键词对话提取，各阶段之间只传递生成器
+
+    Args:
+        records: ASR结果记录（每条对应 ext_data.py 的一次识别结果）
+        keyword: 触发关键词
+        time_threshold: 合并说话人的时间间隔阈值（毫秒）
+        logger: 日志记录器
+
+    Yields:
+        pair: 带有 episode / key 的对话对
+    """
+    logger = logger or logging.getLogger(__name__)
+    for index, record in enumerate(records, 1):
+        episode = record.get('episode', index)
+        try:
+            for header, raw_sentences in iter_asr_items(record):
+                sentences = (convert_sentence(sentence) for sentence in raw_sentences)
+                turns = iter_merge_sentences(sentences, time_threshold)
+                for pair in extract_pairs(turns, keyword):
+                    yield {'episode': episode, 'key': header['key'], **pair}
+        except (KeyError, SyntaxError, ValueError) as e:
+            logger.error(f"第 {episode} 集解析失败: {e}")
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='流式处理ASR结果：解析、合并说话人并提取对话对，JSONL输入输出')
+    parser.add_argument('--input', '-i', type=str, default=None,
+                      help='输入的JSONL文件，每行一条ASR结果；为 - 时读取标准输入')
+    parser.add_argument('--input-prefix', type=str, default="data/asr_result",
+                      help='未指定 --input 时按集读取的JSON文件前缀 (默认: data/asr_result)')
+    parser.add_argument('--start', '-s', type=int, default=1,
+                      help='起始文件编号 (默认: 1)')
+    parser.add_argument('--end', '-e', type=int, default=46,
+                      help='结束文件编号 (默认: 46)')
+    parser.add_argument('--output', '-o', type=str, default="data/conversion_result/conversion_result.jsonl",
+                      help='输出的JSONL文件 (默认: data/conversion_result/conversion_result.jsonl)')
+    parser.add_argument('--keyword', '-k', type=str, default="朕",
+                      help='触发关键词 (默认: 朕)')
+    parser.add_argument('--time-threshold', type=int, default=2000,
+                      help='合并说话人的时间间隔阈值，毫秒 (默认: 2000)')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logger = setup_logging()
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    input_f = None
+    try:
+        if args.input == '-':
+            records = iter_jsonl(sys.stdin, logger)
+        elif args.input:
+            input_f = open(args.input, 'r', encoding='utf-8')
+            records = iter_jsonl(input_f, logger)
+        else:
+            records = iter_asr_files(args.input_prefix, args.start, args.end, logger)
+
+        pair_count = 0
+        with open(args.output, 'w', encoding='utf-8') as out:
+            for pair in run_pipeline(records, args.keyword, args.time_threshold, logger):
+                out.write(json.dumps(pair, ensure_ascii=False) + "\n")
+                pair_count += 1
+    finally:
+        if input_f is not None:
+            input_f.close()
+
+    logger.info(f"处理完成 - 共输出 {pair_count} 条对话对: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+import json
+import os
+import argparse
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from qwenapi import iter_questions
+
+# 特征 -> 权重，总分为已知特征得分的加权平均
+DEFAULT_WEIGHTS = {
+    "speaker_change": 2.0,
+    "gap": 1.0,
+    "length": 1.0,
+    "trigger_position": 0.5,
+    "role": 3.0,
+}
+
+# 能够单独区分正负例的特征：直接通过时至少要有一个这样的特征且得分为 1，
+# 其余特征（说话人变化、间隔、长度、触发词位置）对正负例几乎没有区分度，只用于排序和丢弃
+STRONG_FEATURES = ("role",)
+
+def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_dir: 日志目录
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, "prefilter.log")
+
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+class PairScorer:
+    """
+    用本地特征给对话对打分，分数在 0~1 之间，越高越可能是皇上和他人的对话
+
+    输入缺少某个特征所需的字段（例如 find_huang.py 的输出没有说话人和时间）时，该特征不参与计算
+    """
+
+    def __init__(self, keywords: Sequence[str] = ("朕",), weights: Optional[Dict[str, float]] = None,
+                 max_gap_ms: int = 3000, min_length: int = 2, max_length: int = 80, target_role: str = "皇帝"):
+        """
+        初始化
+
+        Args:
+            keywords: 对话对没有 keywords 字段时使用的触发关键词
+            weights: 特征权重，默认为 DEFAULT_WEIGHTS
+            max_gap_ms: 两句间隔不超过该值时间隔得分为 1，超过 3 倍时为 0
+            min_length: 两句的最短长度
+            max_length: 触发句的最长长度，超过后长度得分减半
+            target_role: role_tagger.py 推断的目标角色
+        """
+        self.keywords = list(keywords)
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        self.max_gap_ms = max_gap_ms
+        self.min_length = min_length
+        self.max_length = max_length
+        self.target_role = target_role
+
+    def features(self, pair: Dict) -> Dict[str, float]:
+        """
+        计算对话对的各项特征得分
+
+        Args:
+            pair: 对话对，至少包含 orther / huang
+
+        Returns:
+            Dict[str, float]: 特征 -> 0~1 的得分，缺少字段的特征不出现
+        """
+        orther, huang = pair["orther"], pair["huang"]
+        features = {}
+        if "orther_speaker" in pair and "huang_speaker" in pair:
+            features["speaker_change"] = float(pair["orther_speaker"] != pair["huang_speaker"])
+        if "orther_end_ms" in pair and "huang_start_ms" in pair:
+            gap = pair["huang_start_ms"] - pair["orther_end_ms"]
+            features["gap"] = min(1.0, max(0.0, (3 * self.max_gap_ms - gap) / (2 * self.max_gap_ms)))
+        if min(len(orther.strip()), len(huang.strip())) < self.min_length:
+            features["length"] = 0.0
+        else:
+            features["length"] = 1.0 if len(huang) <= self.max_length else 0.5
+        positions = [huang.find(keyword) for keyword in pair.get("keywords") or self.keywords]
+        positions = [p for p in positions if p >= 0]
+        if positions:
+            # 触发词越靠前越可能是皇上自称开口
+            features["trigger_position"] = 1.0 - min(positions) / max(len(huang), 1)
+        else:
+            features["trigger_position"] = 0.0
+        if pair.get("huang_role") is not None:
+            features["role"] = float(pair["huang_role"] == self.target_role)
+        return features
+
+    def score(self, pair: Dict) -> float:
+        """
+        对话对的总分
+
+        Args:
+            pair: 对话对
+
+        Returns:
+            float: 已知特征得分的加权平均
+        """
+        return self.combine(self.features(pair))
+
+    def combine(self, features: Dict[str, float]) -> float:
+        """
+        特征得分的加权平均
+
+        Args:
+            features: features 的结果
+
+        Returns:
+            float: 总分
+        """
+        total = weight_sum = 0.0
+        for name, value in features.items():
+            weight = self.weights.get(name, 0.0)
+            total += weight * value
+            weight_sum += weight
+        return total / weight_sum if weight_sum else 0.5
+
+def has_strong_evidence(features: Dict[str, float]) -> bool:
+    """
+    是否有能单独确认正例的特征（见 STRONG_FEATURES）
+
+    Args:
+        features: 特征得分
+
+    Returns:
+        bool: 至少一个强特征得分为 1 时为 True
+    """
+    return any(features.get(name) == 1.0 for name in STRONG_FEATURES)
+
+def fast_track_record(pair: Dict, keep_fields: Sequence[str]) -> Dict:
+    """
+    跳过模型核实的对话对，转换为与 qwenapi.py 结果相同的格式（不做错别字修正）
+
+    Args:
+        pair: 对话对
+        keep_fields: 保留的字段
+
+    Returns:
+        Dict: 结果记录
+    """
+    record = {field: pair[field] for field in keep_fields if field in pair}
+    record.update({"result": "是", "input": pair["orther"], "output": pair["huang"],
+                   "prefilter_score": pair["prefilter_score"]})
+    return record
+
+def split_by_score(pairs: Iterable[Dict], scorer: PairScorer, drop_below: float,
+                   accept_above: float) -> Iterator[Tuple[str, Dict]]:
+    """
+    按分数把对话对分为丢弃、需要模型核实和直接通过三类
+
+    只有分数达到 accept_above 且有强特征（如 role_tagger.py 推断的角色为目标角色）时才直接通过；
+    只靠弱特征达到阈值的对话对仍交给模型核实，单独归为 weak
+
+    Args:
+        pairs: 对话对
+        scorer: 打分器
+        drop_below: 低于该分数直接丢弃
+        accept_above: 不低于该分数直接通过
+
+    Yields:
+        (category, pair): drop / qwen / weak / accept，以及带有 prefilter_score 的对话对
+    """
+    for pair in pairs:
+        features = scorer.features(pair)
+        score = scorer.combine(features)
+        pair = dict(pair, prefilter_score=round(score, 4))
+        if score < drop_below:
+            yield "drop", pair
+        elif score >= accept_above:
+            yield ("accept" if has_strong_evidence(features) else "weak"), pair
+        else:
+            yield "qwen", pair
+
+def calibration_report(scores: Sequence[float], labels: Sequence[bool], drop_below: float,
+                       accept_above: float, buckets: int = 10, strong: Optional[Sequence[bool]] = None) -> Dict:
+    """
+    用以往的模型判定结果评估分数和阈值
+
+    Args:
+        scores: 对话对的分数
+        labels: 对应的模型判定（result 为 是 时为 True）
+        drop_below: 丢弃阈值
+        accept_above: 直接通过阈值
+        buckets: 分数区间数
+        strong: 每条是否有强特征，为 None 时视为都有
+
+    Returns:
+        Dict: 各分数区间的数量和正例比例，当前阈值下误丢弃、误通过的数量和节省的请求比例，
+            以及只靠弱特征达到阈值（因此不直接通过）的数量和其中的负例数
+    """
+    if strong is None:
+        strong = [True] * len(scores)
+    rows = []
+    for b in range(buckets):
+        low, high = b / buckets, (b + 1) / buckets
+        in_bucket = [label for score, label in zip(scores, labels)
+                     if low <= score < high or (b == buckets - 1 and score == high)]
+        rows.append({"range": f"{low:.1f}-{high:.1f}", "count": len(in_bucket),
+                     "positive_rate": round(sum(in_bucket) / len(in_bucket), 4) if in_bucket else None})
+    dropped = [label for score, label in zip(scores, labels) if score < drop_below]
+    accepted = [label for score, label, s in zip(scores, labels, strong) if score >= accept_above and s]
+    weak_only = [label for score, label, s in zip(scores, labels, strong) if score >= accept_above and not s]
+    total = len(labels)
+    return {
+        "total": total,
+        "positives": sum(labels),
+        "buckets": rows,
+        "dropped": len(dropped),
+        "dropped_positives": sum(dropped),
+        "accepted": len(accepted),
+        "accepted_negatives": len(accepted) - sum(accepted),
+        "weak_only": len(weak_only),
+        "weak_only_negatives": len(weak_only) - sum(weak_only),
+        "saved_requests": round((len(dropped) + len(accepted)) / total, 4) if total else 0.0,
+    }
+
+def load_labels(results_file: str) -> Dict[int, bool]:
+    """
+    读取 qwenapi.py 的结果，按输入序号返回判定
+
+    Args:
+        results_file: 结果文件（JSONL，每条带有 index 和 result）
+
+    Returns:
+        Dict[int, bool]: 输入序号 -> 是否为 是
+    """
+    labels = {}
+    for record in iter_questions(results_file):
+        if "index" in record and record.get("result") in ("是", "否"):
+            labels[record["index"]] = record["result"] == "是"
+    return labels
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='在调用Qwen之前用本地特征给对话对打分，丢弃明显的负例并直接通过明显的正例')
+    parser.add_argument('input_file', help='对话对文件（find_huang.py / dialogue_index.py / role_tagger.py 的输出）')
+    parser.add_argument('--output-dir', '-o', type=str, default="data/prefilter",
+                      help='输出目录 (默认: data/prefilter)')
+    parser.add_argument('--keyword', '-k', type=str, action='append', default=None,
+                      help='对话对没有 keywords 字段时使用的触发关键词，可重复指定 (默认: 朕)')
+    parser.add_argument('--drop-below', type=float, default=0.3,
+                      help='分数低于该值的对话对直接丢弃 (默认: 0.3)')
+    parser.add_argument('--accept-above', type=float, default=1.01,
+                      help='分数不低于该值且有强特征（角色）的对话对跳过模型直接通过，大于 1 表示不直接通过；'
+                           '建议先用 --calibrate 确认误通过数量后再调低 (默认: 1.01)')
+    parser.add_argument('--max-gap-ms', type=int, default=3000,
+                      help='两句间隔不超过该值时间隔得分为满分 (默认: 3000)')
+    parser.add_argument('--weights', type=str, default=None,
+                      help='特征权重JSON，如 {"speaker_change": 2, "role": 3}，未给出的特征使用默认权重')
+    parser.add_argument('--keep-fields', default='episode,key',
+                      help='直接通过的记录中保留的输入字段，逗号分隔 (默认: episode,key)')
+    parser.add_argument('--calibrate', type=str, default=None,
+                      help='以往对同一输入文件运行 qwenapi.py 的结果文件，只输出校准报告')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logger = setup_logging()
+
+    weights = dict(DEFAULT_WEIGHTS)
+    if args.weights:
+        weights.update(json.loads(args.weights))
+    scorer = PairScorer(args.keyword or ["朕"], weights, max_gap_ms=args.max_gap_ms)
+
+    if args.calibrate:
+        labels = load_labels(args.calibrate)
+        scores: List[float] = []
+        known: List[bool] = []
+        strong: List[bool] = []
+        for index, pair in enumerate(iter_questions(args.input_file)):
+            if index in labels:
+                features = scorer.features(pair)
+                scores.append(scorer.combine(features))
+                strong.append(has_strong_evidence(features))
+                known.append(labels[index])
+        report = calibration_report(scores, known, args.drop_below, args.accept_above, strong=strong)
+        for row in report["buckets"]:
+            logger.info(f"分数 {row['range']}: {row['count']} 条, 正例比例 {row['positive_rate']}")
+        logger.info(f"共 {report['total']} 条已判定记录，正例 {report['positives']} 条")
+        logger.info(f"丢弃 {report['dropped']} 条（其中正例 {report['dropped_positives']}），"
+                    f"直接通过 {report['accepted']} 条（其中负例 {report['accepted_negatives']}），"
+                    f"可节省 {report['saved_requests']:.0%} 的请求")
+        logger.info(f"只靠弱特征达到通过阈值 {report['weak_only']} 条（其中负例 {report['weak_only_negatives']}），仍交给模型核实")
+        os.makedirs(args.output_dir, exist_ok=True)
+        with open(os.path.join(args.output_dir, "calibration.json"), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    keep_fields = [field.strip() for field in args.keep_fields.split(',') if field.strip()]
+    counts = {"drop": 0, "qwen": 0, "weak": 0, "accept": 0}
+    with open(os.path.join(args.output_dir, "to_qwen.jsonl"), 'w', encoding='utf-8') as to_qwen, \
+         open(os.path.join(args.output_dir, "fast_track.jsonl"), 'w', encoding='utf-8') as fast_track, \
+         open(os.path.join(args.output_dir, "dropped.jsonl"), 'w', encoding='utf-8') as dropped:
+        for category, pair in split_by_score(iter_questions(args.input_file), scorer,
+                                             args.drop_below, args.accept_above):
+            counts[category] += 1
+            if category == "accept":
+                fast_track.write(json.dumps(fast_track_record(pair, keep_fields), ensure_ascii=False) + "\n")
+            elif category == "drop":
+                dropped.write(json.dumps(pair, ensure_ascii=False) + "\n")
+            else:
+                to_qwen.write(json.dumps(pair, ensure_ascii=False) + "\n")
+
+    total = sum(counts.values())
+    logger.info(f"共 {total} 条对话对 - 丢弃: {counts['drop']}, 直接通过: {counts['accept']}, "
+                f"需要模型核实: {counts['qwen'] + counts['weak']}")
+    if counts["weak"]:
+        logger.info(f"其中 {counts['weak']} 条只靠弱特征（没有角色信息）达到通过阈值，未直接通过")
+
+if __name__ == "__main__":
+    main()
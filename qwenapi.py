@@ -5,9 +5,15 @@ import json
 from tqdm import tqdm
 from datetime import datetime
 import os
-from typing import Dict, List, Optional, Union
+import time
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 from pathlib import Path
 
+from concurrency import AdaptiveConcurrencyLimiter, ServerOverloadedError
+from json_response import ResponseParseError, parse_json_response, validate_schema
+from response_cache import ResponseCache
+from result_writer import CheckpointWriter, RecordIdAssigner
+
 def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
     """
     设置日志配置
@@ -33,172 +39,1073 @@ def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> log
     )
     return logging.getLogger(__name__)
 
-async def clean_json_response(response: str) -> Dict:
+DEFAULT_API_URL = "http://localhost:8001/v1/chat/completions"
+
+STRUCTURED_OUTPUT_MODES = ("response_format", "guided_json")
+
+# 对话校验结果的 JSON Schema
+DIALOGUE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "result": {"type": "string", "enum": ["是", "否"]},
+        "input": {"type": "string"},
+        "output": {"type": "string"},
+    },
+    "required": ["result", "input", "output"],
+    "additionalProperties": False,
+}
+
+class ConnectionSettings:
+    """
+    HTTP 连接配置
+    
+    连接池大小默认与并发上限一致，每个在途请求独占一条长连接；aiohttp 不支持 HTTP/1.1 pipelining，
+    用足够大的 keep-alive 连接池代替，同时避免队头阻塞
+    """
+    
+    def __init__(self, url: Optional[str] = None, token: Optional[str] = None,
+                 unix_socket: Optional[str] = None, connector_limit: Optional[int] = None,
+                 keepalive: bool = True, keepalive_timeout: float = 30.0, auto_decompress: bool = True,
+                 dns_cache_ttl: int = 300, connect_timeout: float = 10, total_timeout: float = 600):
+        """
+        初始化连接配置
+        
+        Args:
+            url: 接口地址，默认读取环境变量 QWEN_API_URL
+            token: 访问令牌，默认读取环境变量 QWEN_API_TOKEN
+            unix_socket: 本地推理服务的 unix socket 路径，设置后通过 socket 连接（url 中的主机名仅用于 Host 头）
+            connector_limit: 连接池大小，默认等于并发上限
+            keepalive: 是否复用连接，False 时每个请求后关闭连接
+            keepalive_timeout: 空闲连接保留时间（秒）
+            auto_decompress: 是否接受并自动解压 gzip/deflate 响应，False 时请求不压缩的响应
+            dns_cache_ttl: DNS 缓存时间（秒）
+            connect_timeout: 建立连接超时（秒）
+            total_timeout: 单个请求总超时（秒）
+        """
+        self.url = url or os.environ.get("QWEN_API_URL", DEFAULT_API_URL)
+        self.token = token or os.environ.get("QWEN_API_TOKEN", "YOUR_TOKEN")
+        self.unix_socket = unix_socket
+        self.connector_limit = connector_limit
+        self.keepalive = keepalive
+        self.keepalive_timeout = keepalive_timeout
+        self.auto_decompress = auto_decompress
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connect_timeout = connect_timeout
+        self.total_timeout = total_timeout
+    
+    def build_connector(self, max_concurrent: int) -> aiohttp.BaseConnector:
+        """
+        创建连接器
+        
+        Args:
+            max_concurrent: 并发上限
+            
+        Returns:
+            aiohttp.BaseConnector: TCP 或 unix socket 连接器
+        """
+        limit = self.connector_limit or max_concurrent
+        options = {"limit": limit, "limit_per_host": limit}
+        if self.keepalive:
+            options["keepalive_timeout"] = self.keepalive_timeout
+        else:
+            options["force_close"] = True
+        if self.unix_socket:
+            return aiohttp.UnixConnector(path=self.unix_socket, **options)
+        return aiohttp.TCPConnector(use_dns_cache=True, ttl_dns_cache=self.dns_cache_ttl, **options)
+    
+    def build_headers(self) -> Dict[str, str]:
+        """
+        生成请求头
+        
+        Returns:
+            Dict[str, str]: 请求头
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.token}"
+        }
+        if not self.auto_decompress:
+            headers["Accept-Encoding"] = "identity"
+        return headers
+
+class QwenAPIError(Exception):
+    """重试耗尽后仍然无法获得模型响应"""
+
+class RequestStats:
+    """
+    HTTP 请求级统计：每次往返的耗时、状态码分布、重试和最终失败次数
+    
+    通过 request_stats 参数传给 AsyncQwenCaller 后开始收集，用于压测；默认不收集
+    """
+    
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.status_counts: Dict[int, int] = {}
+        self.retries = 0
+        self.failures = 0
+    
+    def record(self, latency: float, status: int) -> None:
+        """
+        记录一次收到响应的请求
+        
+        Args:
+            latency: 往返耗时（秒）
+            status: HTTP 状态码
+        """
+        self.latencies.append(latency)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+    
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        按最近秩法计算耗时分位数
+        
+        Args:
+            p: 分位（0~100）
+            
+        Returns:
+            Optional[float]: 分位耗时（秒），没有数据时为 None
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        rank = max(1, -(-len(ordered) * p // 100))
+        return ordered[int(rank) - 1]
+
+def build_dialogue_prompt(question: Dict) -> str:
+    """
+    生成对话校验的提示词
+    
+    Args:
+        question: 包含 orther / huang 的对话对
+        
+    Returns:
+        str: 提示词
+    """
+    return f"""
+                     你现在来看一下这个内容，这个是orther说的{question["orther"]}，这是huang说的{question["huang"]}，
+                    ，理论上这是一个对话，
+                    ## 可能存在的错误
+                    - 可能有错别字，如果有错别字就给我修改，但是原意不要修改
+                    - 可能会有标点符号的错误，如果有，修改标点符号为正确的
+                    ## 返回结果
+                    - 这俩如果不是一个人和皇上的对话逻辑，那么就返回否
+                    - 返回标准的json格式，不要给出其他任何数据
+                     
+                     {{
+                     "result":"是"或者"否"//是否是皇上和orther的对话
+                     "input":"修改后的内容"//如果是的话，而且有错别字就修改，如果不是的话就是原话，这是orther说的，里边只能放说的话，不要放其他内容
+                     "output":"修改后的内容"//如果是的话，而且有错别字就修改，如果不是的话就是原话，这是huang说的，里边只能放说的话，不要放其他内容
+                     }}
+                     """
+
+def format_pack_items(items: Sequence[Dict]) -> str:
+    """
+    把打包的记录排成 JSON 数组，每条占一行
+    
+    Args:
+        items: 带有 id 的记录
+    
+    Returns:
+        str: JSON 数组文本
+    """
+    lines = ",\n".join(json.dumps(item, ensure_ascii=False) for item in items)
+    return f"[\n{lines}\n]"
+
+def build_dialogue_pack_prompt(questions: Sequence[Dict]) -> str:
+    """
+    生成多组对话一起校验的提示词
+    
+    Args:
+        questions: 包含 orther / huang 的对话对列表
+    
+    Returns:
+        str: 提示词
+    """
+    items = [{"id": i, "orther": q["orther"], "huang": q["huang"]} for i, q in enumerate(questions)]
+    return f"""
+下面是 {len(items)} 组对话，每组中 orther 是另一个人说的话，huang 是皇上说的话，理论上每组都是一个对话。
+请逐组处理：
+## 可能存在的错误
+- 可能有错别字，如果有错别字就给我修改，但是原意不要修改
+- 可能会有标点符号的错误，如果有，修改标点符号为正确的
+## 返回结果
+- 如果某组不是一个人和皇上的对话逻辑，那么这一组的 result 返回否
+- 返回标准的json数组，每组对应一个元素，id 与输入一致，不要给出其他任何数据
+- input 是修改后的 orther 说的话，output 是修改后的 huang 说的话；不是对话或没有错别字时保持原话，里边只能放说的话
+[{{"id": 0, "result": "是", "input": "修改后的内容", "output": "修改后的内容"}}]
+
+## 输入
+{format_pack_items(items)}
+""".strip()
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的 token 数：中文等非 ASCII 字符按每字 1 个，ASCII 按每 4 个字符 1 个
+    
+    Args:
+        text: 文本
+    
+    Returns:
+        int: 估计的 token 数
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+def pack_schema(schema: Dict) -> Dict:
     """
-    清理和解析API响应
+    由单条结果的 schema 生成打包响应的 schema：元素为带 id 的单条结果的数组
     
     Args:
-        response: API返回的原始响应
+        schema: 单条结果的 JSON Schema
         
     Returns:
-        Dict: 解析后的JSON数据
+        Dict: 打包响应的 JSON Schema
+    """
+    item = dict(schema)
+    item["properties"] = {"id": {"type": "integer"}, **schema.get("properties", {})}
+    item["required"] = ["id", *schema.get("required", ())]
+    return {"type": "array", "items": item}
+
+def split_pack_response(response: str, count: int, validate: Callable[[Dict], bool]) -> List[Optional[Dict]]:
     """
-    clean_response = response
+    把打包请求的响应拆分到各条记录
     
-    # 移除代码块标记
-    for prefix in ['```json', '```']:
-        if clean_response.startswith(prefix):
-            clean_response = clean_response[len(prefix):]
-    if clean_response.endswith('```'):
-        clean_response = clean_response[:-3]
+    响应应当是 JSON 数组，元素的 id 对应记录在包中的位置；缺失、重复、无法解析或未通过校验的条目为 None
     
+    Args:
+        response: 模型返回的内容
+        count: 包中的记录数
+        validate: 单条结果的校验函数（不含 id 字段）
+    
+    Returns:
+        List[Optional[Dict]]: 与记录一一对应的结果
+    """
+    items: List[Optional[Dict]] = [None] * count
     try:
-        return json.loads(clean_response)
-    except json.JSONDecodeError:
-        # 如果解析失败，尝试将整个响应作为字符串处理
-        return json.loads(json.dumps(clean_response, ensure_ascii=False))
+        parsed = parse_json_response(response, list)
+    except ResponseParseError:
+        return items
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        try:
+            position = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= position < count or items[position] is not None:
+            continue
+        result = {key: value for key, value in item.items() if key != "id"}
+        if validate(result):
+            items[position] = result
+    return items
 
 class AsyncQwenCaller:
     """异步调用Qwen API的类"""
     
-    def __init__(self, max_concurrent: int = 5, max_retries: int = 3):
+    # 是否把每条API响应写入日志
+    log_responses = True
+    
+    def __init__(self, max_concurrent: int = 5, max_retries: int = 3, min_concurrent: int = 1,
+                 initial_concurrent: Optional[int] = None, target_latency: Optional[float] = None,
+                 adaptive: bool = True, cache: Optional[ResponseCache] = None, bypass_cache: bool = False,
+                 cache_namespace: str = "", keep_fields: Sequence[str] = (),
+                 connection: Optional[ConnectionSettings] = None, pack_size: int = 1,
+                 pack_token_budget: Optional[int] = None, reject_writer: Optional[CheckpointWriter] = None,
+                 structured_output: Optional[str] = None, tight_max_tokens: bool = False,
+                 request_stats: Optional[RequestStats] = None):
         """
         初始化API调用器
         
         Args:
-            max_concurrent: 最大并发请求数
+            max_concurrent: 最大并发请求数（自适应模式下为窗口上限）
             max_retries: 最大重试次数
+            min_concurrent: 自适应模式下的窗口下限
+            initial_concurrent: 自适应模式下的初始窗口
+            target_latency: 目标响应时间（秒），为空时根据观测到的基线自动确定
+            adaptive: 是否根据响应时间、429/503 和超时自动调整并发窗口
+            cache: 响应缓存，为空时不使用缓存
+            bypass_cache: 跳过缓存的读写，用于需要重新采样的生成任务
+            cache_namespace: 缓存键的命名空间，多次采样时用批次号区分
+            keep_fields: 从输入记录原样复制到结果中的字段（如 episode / start_ms），便于与元数据关联
+            connection: HTTP 连接配置，默认连接 QWEN_API_URL 或本地 8001 端口
+            pack_size: 每个请求最多打包的记录数，1 表示逐条请求
+            pack_token_budget: 每个打包请求的估计 token 上限（输入+输出），为空时只按 pack_size 限制
+            reject_writer: 无法解析的响应写入的文件，为空时只记录日志
+            structured_output: 结构化输出方式，response_format 或 guided_json，设置后请求中附带
+                输出 schema，收到的响应按 schema 校验
+            tight_max_tokens: 按输入长度估计每个请求的 max_tokens，而不是固定使用 self.max_tokens
+            request_stats: 请求级统计，压测时传入，为空时不收集
         """
         self.max_concurrent = max_concurrent
         self.max_retries = max_retries
-        self.url = "http://localhost:8001/v1/chat/completions"
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer YOUR_TOKEN"
-        }
-        self._running_tasks = set()
+        self.limiter = AdaptiveConcurrencyLimiter(
+            max_limit=max_concurrent,
+            min_limit=min_concurrent,
+            initial=initial_concurrent,
+            target_latency=target_latency,
+            adaptive=adaptive
+        )
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.cache_namespace = cache_namespace
+        self.keep_fields = tuple(keep_fields)
+        self.pack_size = max(1, pack_size)
+        self.pack_token_budget = pack_token_budget
+        self.reject_writer = reject_writer
+        if structured_output is not None and structured_output not in STRUCTURED_OUTPUT_MODES:
+            raise ValueError(f"未知的结构化输出方式: {structured_output}")
+        self.structured_output = structured_output
+        self.tight_max_tokens = tight_max_tokens
+        self.request_stats = request_stats
+        self.model = "Qwen2.5"
+        self.temperature = 0.7
+        self.max_tokens = 4096 * 4
+        self.connection = connection or ConnectionSettings()
+        self.url = self.connection.url
+        self.headers = self.connection.build_headers()
         self.processed_count = 0
+        self.failed_count = 0
+        self.skipped_count = 0
+        self.pack_count = 0
+        self.pack_fallback_count = 0
+        self.reject_counts: Dict[str, int] = {}
         self.total_count = 0
         self.progress_bar = None
         self.results = []
 
     async def __aenter__(self):
         """异步上下文管理器入口"""
-        timeout = aiohttp.ClientTimeout(total=600, connect=10)
-        self.session = aiohttp.ClientSession(timeout=timeout)
+        timeout = aiohttp.ClientTimeout(total=self.connection.total_timeout,
+                                        connect=self.connection.connect_timeout)
+        self.session = aiohttp.ClientSession(
+            timeout=timeout,
+            connector=self.connection.build_connector(self.max_concurrent),
+            auto_decompress=self.connection.auto_decompress
+        )
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
         """异步上下文管理器退出"""
         await self.session.close()
+        logging.info(self.limiter.summary())
+        if self.cache is not None:
+            logging.info(self.cache.summary())
+
+    async def build_prompt(self, question: Dict) -> str:
+        """
+        生成发送给模型的提示词，子类可覆盖
+        
+        Args:
+            question: 问题数据
+            
+        Returns:
+            str: 提示词
+        """
+        return build_dialogue_prompt(question)
+
+    async def parse_response(self, response: str) -> Dict:
+        """
+        解析模型返回的内容，子类可覆盖
+        
+        Args:
+            response: API返回的原始响应
+            
+        Returns:
+            Dict: 解析后的数据
+            
+        Raises:
+            ResponseParseError: 响应无法解析
+        """
+        return parse_json_response(response)
+
+    async def build_pack_prompt(self, questions: Sequence[Dict]) -> str:
+        """
+        生成把多条记录打包在一起的提示词，要求模型返回带 id 的 JSON 数组，子类可覆盖
+        
+        Args:
+            questions: 问题数据列表
+        
+        Returns:
+            str: 提示词
+        """
+        return build_dialogue_pack_prompt(questions)
+
+    def validate_pack_item(self, item: Dict) -> bool:
+        """
+        校验打包响应中的单条结果，未通过的记录改为逐条请求，子类可覆盖
+        
+        Args:
+            item: 去掉 id 后的单条结果
+        
+        Returns:
+            bool: 是否有效
+        """
+        return (item.get("result") in ("是", "否")
+                and isinstance(item.get("input"), str) and isinstance(item.get("output"), str))
+
+    def response_schema(self) -> Dict:
+        """
+        单条结果的 JSON Schema，结构化输出时随请求发送并用于校验响应，子类可覆盖
+        
+        Returns:
+            Dict: JSON Schema
+        """
+        return DIALOGUE_SCHEMA
+
+    def output_tokens(self, question: Dict) -> int:
+        """
+        估计一条记录的结果占用的 token 数，子类可覆盖
+        
+        Args:
+            question: 问题数据
+        
+        Returns:
+            int: 估计的 token 数
+        """
+        text = f"{question.get('orther', '')}{question.get('huang', '')}"
+        # 修改后的内容会原样返回一遍，另加字段名等固定开销
+        return estimate_tokens(text) + 32
+
+    def record_tokens(self, question: Dict) -> int:
+        """
+        估计一条记录在打包请求中占用的 token 数（输入加输出），子类可覆盖
+        
+        Args:
+            question: 问题数据
+        
+        Returns:
+            int: 估计的 token 数
+        """
+        text = f"{question.get('orther', '')}{question.get('huang', '')}"
+        return estimate_tokens(text) + self.output_tokens(question)
+
+    def _request_options(self, questions: Sequence[Dict], pack: bool = False) -> Dict:
+        """
+        生成请求中随记录变化的参数：按输入估计的 max_tokens 和输出 schema
+        
+        Args:
+            questions: 本次请求包含的记录
+            pack: 是否为打包请求
+        
+        Returns:
+            Dict: 合并到请求体中的参数
+        """
+        options = {}
+        if self.tight_max_tokens:
+            # 估计值留出一半余量，避免正常的结果被截断
+            expected = sum(self.output_tokens(question) for question in questions)
+            options["max_tokens"] = min(self.max_tokens, int(expected * 1.5) + 16)
+        if self.structured_output:
+            schema = pack_schema(self.response_schema()) if pack else self.response_schema()
+            if self.structured_output == "guided_json":
+                options["guided_json"] = schema
+            else:
+                options["response_format"] = {"type": "json_schema",
+                                              "json_schema": {"name": "result", "schema": schema}}
+        return options
+
+    def _check_schema(self, result) -> None:
+        """
+        结构化输出模式下按 schema 校验解析后的结果
+        
+        Args:
+            result: 解析后的结果
+        
+        Raises:
+            ResponseParseError: 结果不符合 schema
+        """
+        if self.structured_output:
+            error = validate_schema(result, self.response_schema())
+            if error:
+                raise ResponseParseError("schema_mismatch", error)
+
+    def _validate_pack_item(self, item: Dict) -> bool:
+        """打包响应中单条结果的校验：validate_pack_item，结构化输出模式下再按 schema 校验"""
+        if not self.validate_pack_item(item):
+            return False
+        return not self.structured_output or validate_schema(item, self.response_schema()) is None
+
+    def _cache_key(self, prompt: str, namespace: Optional[str] = None,
+                   options: Optional[Dict] = None) -> Optional[str]:
+        """
+        计算单条提示词的缓存键，实际发送的请求参数不同时（如 --tight-max-tokens、结构化输出）不共用缓存
+        
+        Args:
+            prompt: 提示词
+            namespace: 缓存命名空间，为空时使用 self.cache_namespace
+            options: 该记录单独请求时的 _request_options
+        
+        Returns:
+            Optional[str]: 未启用缓存时为 None
+        """
+        if self.cache is None or self.bypass_cache:
+            return None
+        if namespace is None:
+            namespace = self.cache_namespace
+        return ResponseCache.make_key(self.model, prompt, self.temperature, self.max_tokens, namespace, options)
 
-    async def _call_api(self, question: Dict, retry_count: int = 0) -> Dict:
+    async def _call_api(self, question: Dict, retry_count: int = 0, namespace: Optional[str] = None) -> str:
         """
-        调用API的核心方法
+        调用API的核心方法，启用缓存时先查询缓存
         
         Args:
             question: 问题数据
             retry_count: 当前重试次数
+            namespace: 缓存命名空间，为空时使用 self.cache_namespace
+            
+        Returns:
+            str: 模型返回的内容
+            
+        Raises:
+            QwenAPIError: 重试耗尽
+        """
+        prompt = await self.build_prompt(question)
+        options = self._request_options([question])
+        cache_key = self._cache_key(prompt, namespace, options)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        response_data = await self._post_with_retry(prompt, retry_count, options)
+        if response_data is None:
+            raise QwenAPIError("重试次数耗尽")
+        if cache_key is not None and isinstance(response_data, str):
+            self.cache.put(cache_key, response_data)
+        return response_data
+
+    async def _post_with_retry(self, prompt: str, retry_count: int = 0,
+                               options: Optional[Dict] = None) -> Optional[str]:
+        """
+        发送请求，失败时指数退避重试
+        
+        Args:
+            prompt: 提示词
+            retry_count: 当前重试次数
+            options: 合并到请求体中的参数，如 max_tokens / response_format
             
         Returns:
-            Dict: API响应数据
+            Optional[str]: 模型返回的内容，重试耗尽时为 None
+            
+        Raises:
+            ResponseParseError: 生成达到 max_tokens 被截断（finish_reason 为 length）
         """
         try:
             data = {
-                "model": "Qwen2.5",
+                "model": self.model,
                 "messages": [
-                    {"role": "user", "content": f"""
-                     你现在来看一下这个内容，这个是orther说的{question["orther"]}，这是huang说的{question["huang"]}，
-                    ，理论上这是一个对话，
-                    ## 可能存在的错误
-                    - 可能有错别字，如果有错别字就给我修改，但是原意不要修改
-                    - 可能会有标点符号的错误，如果有，修改标点符号为正确的
-                    ## 返回结果
-                    - 这俩如果不是一个人和皇上的对话逻辑，那么就返回否
-                    - 返回标准的json格式，不要给出其他任何数据
-                     
-                     {{
-                     "result":"是"或者"否"//是否是皇上和orther的对话
-                     "input":"修改后的内容"//如果是的话，而且有错别字就修改，如果不是的话就是原话，这是orther说的，里边只能放说的话，不要放其他内容
-                     "output":"修改后的内容"//如果是的话，而且有错别字就修改，如果不是的话就是原话，这是huang说的，里边只能放说的话，不要放其他内容
-                     }}
-                     """}
+                    {"role": "user", "content": prompt}
                 ],
-                "temperature": 0.7,
-                "max_tokens": 4096 * 4
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens
             }
+            if options:
+                data.update(options)
 
-            async with self.session.post(self.url, headers=self.headers, json=data) as response:
-                response_json = await response.json()
-                response_data = response_json["choices"][0]["message"].get("content")
+            async with self.limiter.slot():
+                start_time = time.monotonic()
+                async with self.session.post(self.url, headers=self.headers, json=data) as response:
+                    if self.request_stats is not None:
+                        self.request_stats.record(time.monotonic() - start_time, response.status)
+                    if response.status in (429, 503):
+                        raise ServerOverloadedError(f"HTTP {response.status}")
+                    response_json = await response.json()
+            choice = response_json["choices"][0]
+            response_data = choice["message"].get("content")
+            finish_reason = choice.get("finish_reason")
+            if self.log_responses:
                 logging.info(f"API响应: {response_data}")
-                return response_data
 
         except Exception as e:
             if retry_count < self.max_retries:
                 wait_time = 2 ** retry_count  # 指数退避
                 logging.warning(f"请求失败，{wait_time}秒后重试... (错误: {str(e)})")
+                if self.request_stats is not None:
+                    self.request_stats.retries += 1
                 await asyncio.sleep(wait_time)
-                return await self._call_api(question, retry_count + 1)
+                return await self._post_with_retry(prompt, retry_count + 1, options)
             logging.error(f"处理问题时发生错误: {str(e)}")
-            return question
+            if self.request_stats is not None:
+                self.request_stats.failures += 1
+            return None
+        if finish_reason == "length":
+            # 被截断的输出即使碰巧能解析也不完整，不能写入缓存；相同参数重试也会被截断
+            raise ResponseParseError("truncated", "finish_reason=length")
+        return response_data
 
-    async def _execute_call(self, question: Dict, task_id: int) -> None:
+    async def _execute_call(self, question: Dict, index: int, record_id: str,
+                            writer: Optional[CheckpointWriter] = None,
+                            namespace: Optional[str] = None) -> None:
         """
-        执行单个API调用
+        执行单个API调用，完成后立即提交带有记录ID和输入序号的结果
+        
+        失败的记录不会写出，续跑时会重新处理
         
         Args:
             question: 问题数据
-            task_id: 任务ID
+            index: 输入序号（从0开始）
+            record_id: 记录ID
+            writer: 结果写入器，为空时结果保存在 self.results 中
+            namespace: 缓存命名空间
         """
+        record = None
+        response = None
         try:
-            result = await self._call_api(question)
-            result = await clean_json_response(result)
-            self.results.append(result)
-            if self.progress_bar:
-                self.progress_bar.update(1)
-                self.processed_count += 1
+            response = await self._call_api(question, namespace=namespace)
+            result = await self.parse_response(response)
+            self._check_schema(result)
+            record = self._make_record(question, index, record_id, result)
+        except ResponseParseError as e:
+            await self._reject(question, index, record_id, namespace, response, e)
         except Exception as e:
-            logging.error(f"任务 {task_id} 执行失败: {str(e)}")
-            if self.progress_bar:
-                self.progress_bar.update(1)
-                self.processed_count += 1
+            self.failed_count += 1
+            logging.error(f"记录 {record_id} 处理失败: {str(e)}")
+        finally:
+            await self._finish(index, record, writer)
+
+    async def _reject(self, question: Dict, index: int, record_id: str, namespace: Optional[str],
+                      response: str, error: ResponseParseError) -> None:
+        """
+        记录无法解析的响应：写入拒绝文件，并从缓存中删除，续跑时重新请求
+        
+        Args:
+            question: 问题数据
+            index: 输入序号
+            record_id: 记录ID
+            namespace: 缓存命名空间
+            response: 模型返回的内容
+            error: 解析错误
+        """
+        self.reject_counts[error.reason] = self.reject_counts.get(error.reason, 0) + 1
+        logging.warning(f"记录 {record_id} 的响应无法解析: {error}")
+        cache_key = self._cache_key(await self.build_prompt(question), namespace, self._request_options([question]))
+        if cache_key is not None:
+            self.cache.discard(cache_key)
+        if self.reject_writer is not None:
+            reject = self._make_record(question, index, record_id,
+                                       {"reason": error.reason, "error": str(error), "response": response})
+            if namespace:
+                reject["namespace"] = namespace
+            self.reject_writer.write(reject)
 
-    async def process_question(self, question: Dict, task_id: int) -> None:
+    def _make_record(self, question: Dict, index: int, record_id: str, result) -> Dict:
         """
-        处理单个问题
+        生成带有记录ID、输入序号和保留字段的结果记录
         
         Args:
             question: 问题数据
-            task_id: 任务ID
+            index: 输入序号
+            record_id: 记录ID
+            result: 解析后的模型结果
+        
+        Returns:
+            Dict: 结果记录
+        """
+        record = {"id": record_id, "index": index}
+        for field in self.keep_fields:
+            if field in question:
+                record[field] = question[field]
+        if isinstance(result, dict):
+            record.update(result)
+        else:
+            record["raw"] = result
+        return record
+
+    async def _finish(self, index: int, record: Optional[Dict], writer: Optional[CheckpointWriter]) -> None:
+        """
+        提交一条记录的结果并更新进度
+        
+        Args:
+            index: 输入序号
+            record: 结果记录，失败时为 None
+            writer: 结果写入器，为空时结果保存在 self.results 中
+        """
+        if writer is not None:
+            await writer.complete(index, record)
+        elif record is not None:
+            self.results.append(record)
+        self.processed_count += 1
+        if self.progress_bar is not None:
+            self.progress_bar.set_postfix(window=self.limiter.window, refresh=False)
+            self.progress_bar.update(1)
+
+    async def _fail(self, index: int, record_id: str, writer: Optional[CheckpointWriter], error: Exception) -> None:
+        """
+        记录一条处理失败的记录，与 _execute_call 中的失败处理相同，续跑时会重新处理
+        
+        Args:
+            index: 输入序号
+            record_id: 记录ID
+            writer: 结果写入器
+            error: 异常
+        """
+        self.failed_count += 1
+        logging.error(f"记录 {record_id} 处理失败: {str(error)}")
+        await self._finish(index, None, writer)
+
+    async def _execute_pack(self, jobs: List[Tuple]) -> None:
+        """
+        把多条记录打包成一个请求，响应按 id 拆分并逐条校验，未通过校验的记录改为逐条请求
+        
+        启用缓存时先按单条请求的缓存键查询，命中的记录不进入打包请求；打包得到的每条结果也按单条的
+        缓存键写入，之后无论是否打包都能复用
+        
+        Args:
+            jobs: 同一写入器、同一命名空间的任务列表
+        """
+        misses = []
+        for job in jobs:
+            index, record_id, question, writer, namespace, _ = job
+            # 与逐条请求一样，单条记录出错（如缺少字段）只记为失败，不影响同组的其他记录
+            try:
+                cache_key = self._cache_key(await self.build_prompt(question), namespace,
+                                            self._request_options([question]))
+                cached = self.cache.get(cache_key) if cache_key is not None else None
+                try:
+                    result = await self.parse_response(cached) if cached is not None else None
+                    if result is not None:
+                        self._check_schema(result)
+                except ResponseParseError:
+                    self.cache.discard(cache_key)
+                    result = None
+                record = self._make_record(question, index, record_id, result) if result is not None else None
+            except Exception as e:
+                await self._fail(index, record_id, writer, e)
+                continue
+            if record is None:
+                misses.append((job, cache_key))
+                continue
+            await self._finish(index, record, writer)
+
+        items: List[Optional[Dict]] = [None] * len(misses)
+        if len(misses) > 1:
+            questions = [job[2] for job, _ in misses]
+            try:
+                prompt = await self.build_pack_prompt(questions)
+                response = await self._post_with_retry(prompt, options=self._request_options(questions, pack=True))
+                if response is not None:
+                    items = split_pack_response(response, len(misses), self._validate_pack_item)
+            except Exception as e:
+                logging.warning(f"打包请求出错: {str(e)}")
+                response = None
+            if response is None:
+                logging.warning(f"打包请求失败，{len(misses)} 条记录改为逐条请求")
+            else:
+                self.pack_count += 1
+
+        fallback = []
+        for (job, cache_key), item in zip(misses, items):
+            index, record_id, question, writer, _, _ = job
+            if item is None:
+                fallback.append(job)
+                continue
+            try:
+                if cache_key is not None:
+                    self.cache.put(cache_key, json.dumps(item, ensure_ascii=False))
+                record = self._make_record(question, index, record_id, item)
+            except Exception as e:
+                await self._fail(index, record_id, writer, e)
+                continue
+            await self._finish(index, record, writer)
+        if len(misses) > 1 and fallback:
+            self.pack_fallback_count += len(fallback)
+            logging.info(f"打包响应中 {len(fallback)}/{len(misses)} 条无效，改为逐条请求")
+        await asyncio.gather(*(self._execute_call(question, index, record_id, writer, namespace)
+                               for index, record_id, question, writer, namespace, _ in fallback))
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        """
+        从队列中循环取任务执行，取到 None 时退出
+        
+        Args:
+            queue: 任务队列，元素为任务列表，每个任务为 (index, record_id, question, writer, namespace, pass_state)
+        """
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                try:
+                    if len(item) == 1:
+                        index, record_id, question, writer, namespace, _ = item[0]
+                        await self._execute_call(question, index, record_id, writer, namespace)
+                    else:
+                        await self._execute_pack(item)
+                finally:
+                    for job in item:
+                        if job[5] is not None:
+                            job[5].task_done()
+            finally:
+                queue.task_done()
+
+    async def _pack_jobs(self, jobs: AsyncIterator[Tuple]) -> AsyncIterator[List[Tuple]]:
+        """
+        把连续的任务按 pack_size 和 pack_token_budget 分组
+        
+        只有同一写入器、同一命名空间的任务会分到一组；写入器为 ordered 模式时组的大小小于重排窗口，
+        且组满时立即派发，不等待下一个任务，否则下一个任务会一直等待窗口而组无法派发。
+        续跑时跳过的记录也会推动窗口，未满的组同样可能挡住窗口，因此收到 None 时立即派发当前的组
+        
+        Args:
+            jobs: 任务迭代器，None 表示即将等待重排窗口
+        
+        Yields:
+            List[Tuple]: 一组任务
+        """
+        pack: List[Tuple] = []
+        tokens = 0
+        async for job in jobs:
+            if job is None:
+                if pack:
+                    yield pack
+                    pack, tokens = [], 0
+                continue
+            cost = self.record_tokens(job[2]) if self.pack_token_budget else 0
+            if pack and (job[3] is not pack[0][3] or job[4] != pack[0][4]
+                         or (self.pack_token_budget and tokens + cost > self.pack_token_budget)):
+                yield pack
+                pack, tokens = [], 0
+            pack.append(job)
+            tokens += cost
+            writer = job[3]
+            limit = self.pack_size
+            if writer is not None and writer.ordered:
+                limit = min(limit, writer.reorder_window)
+            if len(pack) >= limit:
+                yield pack
+                pack, tokens = [], 0
+        if pack:
+            yield pack
+
+    async def _iter_jobs(self, questions: Iterable[Dict], writer: Optional[CheckpointWriter],
+                         namespace: Optional[str] = None,
+                         pass_state: Optional["_PassState"] = None) -> AsyncIterator[Optional[Tuple]]:
+        """
+        为一轮输入生成任务，跳过写入器中已完成的记录；写入器为 ordered 模式时，派发前等待重排窗口
+        
+        Args:
+            questions: 问题迭代器
+            writer: 结果写入器
+            namespace: 缓存命名空间
+            pass_state: 多轮采样时本轮的完成状态
+            
+        Yields:
+            Optional[Tuple]: 放入任务队列的元素；None 表示接下来要等待重排窗口，已取出的任务应先派发
         """
-        while len(self._running_tasks) >= self.max_concurrent:
-            done, _ = await asyncio.wait(
-                self._running_tasks,
-                return_when=asyncio.FIRST_COMPLETED
-            )
-            self._running_tasks -= done
+        id_assigner = RecordIdAssigner()
+        for index, question in enumerate(questions):
+            record_id = id_assigner.assign(question)
+            if writer is not None:
+                if not writer.can_reserve(index):
+                    # 还在打包中的任务不派发就无法完成，窗口永远不会前进
+                    yield None
+                await writer.reserve(index)
+                if writer.is_done(record_id):
+                    self.skipped_count += 1
+                    await writer.complete(index, None)
+                    if self.progress_bar is not None:
+                        self.progress_bar.update(1)
+                    continue
+            if pass_state is not None:
+                pass_state.pending += 1
+            yield (index, record_id, question, writer, namespace, pass_state)
 
-        task = asyncio.create_task(self._execute_call(question, task_id))
-        self._running_tasks.add(task)
-        task.add_done_callback(self._running_tasks.discard)
+    async def _run_jobs(self, jobs: AsyncIterator[Tuple]) -> None:
+        """
+        用固定数量的 worker 执行任务
+        
+        任务从异步迭代器中按需读取并放入有界队列，内存和调度开销与数据集大小无关；
+        worker 数等于并发上限，实际在途请求数由自适应窗口控制；pack_size 大于 1 时每个 worker 一次处理一组任务
+        
+        Args:
+            jobs: 任务迭代器
+        """
+        queue = asyncio.Queue(maxsize=self.max_concurrent * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.max_concurrent)]
+        try:
+            async for pack in self._pack_jobs(jobs):
+                await self._put(queue, pack, workers)
+            for _ in workers:
+                await self._put(queue, None, workers)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        rejected = sum(self.reject_counts.values())
+        logging.info(f"处理完成 - 成功: {self.processed_count - self.failed_count - rejected}, "
+                     f"失败: {self.failed_count}, 无法解析: {rejected}, 跳过已完成: {self.skipped_count}")
+        if rejected:
+            logging.info(f"无法解析的原因: {self.reject_counts}")
+        if self.pack_size > 1:
+            logging.info(f"打包请求: {self.pack_count} 次, 改为逐条请求的记录: {self.pack_fallback_count}")
+
+    @staticmethod
+    async def _put(queue: asyncio.Queue, item, workers: List[asyncio.Task]) -> None:
+        """
+        把任务放入有界队列；等待期间有 worker 异常退出时抛出该异常，而不是在没有人消费的队列上一直等待
+        
+        Args:
+            queue: 任务队列
+            item: 任务组，None 表示结束
+            workers: worker 任务
+        
+        Raises:
+            Exception: worker 中未处理的异常
+        """
+        put = asyncio.ensure_future(queue.put(item))
+        try:
+            while True:
+                running = []
+                for worker in workers:
+                    if not worker.done():
+                        running.append(worker)
+                    elif not worker.cancelled() and worker.exception() is not None:
+                        raise worker.exception()
+                if put.done():
+                    return
+                if not running:
+                    raise RuntimeError("所有 worker 都已退出，任务无法派发")
+                await asyncio.wait([put, *running], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put.cancel()
+
+    async def run(self, questions: Iterable[Dict], writer: Optional[CheckpointWriter] = None) -> None:
+        """
+        处理所有问题
+        
+        Args:
+            questions: 问题迭代器
+            writer: 结果写入器
+        """
+        await self._run_jobs(self._iter_jobs(questions, writer))
+
+    async def run_passes(self, questions: Sequence[Dict], passes: int,
+                         open_writer: Callable[[int], CheckpointWriter]) -> None:
+        """
+        对同一批问题进行多轮采样
+        
+        所有轮次共用一个会话和 worker 池：上一轮的问题全部派发后立即开始派发下一轮，
+        服务端不会在轮次交界处空闲；每轮写入自己的文件，全部完成后关闭，缓存命名空间为 batch_{轮次}
+        
+        Args:
+            questions: 问题列表（只读取一次）
+            passes: 采样轮数
+            open_writer: 根据轮次（从0开始）打开写入器
+        """
+        states: List[_PassState] = []
+
+        async def jobs() -> AsyncIterator[Optional[Tuple]]:
+            for j in range(passes):
+                pass_state = _PassState(j, open_writer(j))
+                states.append(pass_state)
+                async for job in self._iter_jobs(questions, pass_state.writer, f"batch_{j+1}", pass_state):
+                    yield job
+                pass_state.mark_dispatched()
 
-    def set_progress_bar(self, total: int) -> None:
+        try:
+            await self._run_jobs(jobs())
+        finally:
+            # 出错或被取消时，仍在进行的轮次也要关闭写入器，已写入的记录留给 --resume
+            for pass_state in states:
+                pass_state.close()
+
+    def set_progress_bar(self, total: Optional[int]) -> None:
         """
         设置进度条
         
         Args:
-            total: 总任务数
+            total: 总任务数，未知时为 None
         """
         self.total_count = total
         self.progress_bar = tqdm(total=total, desc="处理问题", unit="个")
 
     def close_progress(self) -> None:
         """关闭进度条"""
-        if self.progress_bar:
+        if self.progress_bar is not None:
             self.progress_bar.close()
 
-async def process_file(input_file: str, output_file: str, max_concurrent: int = 5) -> None:
+class _PassState:
+    """多轮采样中单轮的完成状态，全部派发且全部完成后关闭写入器"""
+
+    def __init__(self, pass_index: int, writer: CheckpointWriter):
+        self.pass_index = pass_index
+        self.writer = writer
+        self.pending = 0
+        self.dispatched = False
+        self.closed = False
+
+    def task_done(self) -> None:
+        """一条任务完成"""
+        self.pending -= 1
+        self._maybe_close()
+
+    def mark_dispatched(self) -> None:
+        """本轮任务已全部派发"""
+        self.dispatched = True
+        self._maybe_close()
+
+    def _maybe_close(self) -> None:
+        if self.dispatched and self.pending == 0 and not self.closed:
+            self.close()
+            logging.info(f"第 {self.pass_index + 1} 轮完成，写入 {self.writer.written_count} 条: {self.writer.path}")
+
+    def close(self) -> None:
+        """关闭本轮的写入器，已关闭时不做任何事"""
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+def iter_questions(input_file: str) -> Iterator[Dict]:
+    """
+    按需读取问题记录
+    
+    JSONL 文件逐行读取；JSON 数组文件（find_huang.py 的输出）整体读取后逐条产出
+    
+    Args:
+        input_file: 输入文件路径
+        
+    Yields:
+        Dict: 问题数据
+    """
+    with open(input_file, "r", encoding="utf-8") as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == "[":
+            yield from json.load(f)
+            return
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"跳过无效的JSON行 {line_no}: {line[:50]}...")
+
+def default_rejects_file(output_file: str) -> str:
+    """
+    无法解析的响应默认保存的位置
+    
+    Args:
+        output_file: 结果文件路径
+        
+    Returns:
+        str: 与结果文件同目录、同名的 .rejects.jsonl 文件
+    """
+    return f"{os.path.splitext(output_file)[0]}.rejects.jsonl"
+
+async def process_file(input_file: str, output_file: str, max_concurrent: int = 5,
+                       min_concurrent: int = 1, target_latency: Optional[float] = None,
+                       adaptive: bool = True, cache_path: Optional[str] = None,
+                       cache_max_entries: Optional[int] = None, cache_max_age: Optional[float] = None,
+                       bypass_cache: bool = False, resume: bool = False, ordered: bool = False,
+                       reorder_window: int = 1024, keep_fields: Sequence[str] = (),
+                       connection: Optional[ConnectionSettings] = None, pack_size: int = 1,
+                       pack_token_budget: Optional[int] = None, rejects_file: Optional[str] = None,
+                       structured_output: Optional[str] = None, tight_max_tokens: bool = False,
+                       request_stats: Optional[RequestStats] = None) -> None:
     """
     处理单个文件
     
@@ -206,39 +1113,144 @@ async def process_file(input_file: str, output_file: str, max_concurrent: int =
         input_file: 输入文件路径
         output_file: 输出文件路径
         max_concurrent: 最大并发数
+        min_concurrent: 自适应并发窗口下限
+        target_latency: 目标响应时间（秒）
+        adaptive: 是否启用自适应并发
+        cache_path: 响应缓存数据库路径，为空时不使用缓存
+        cache_max_entries: 缓存最多保留的条目数
+        cache_max_age: 缓存条目最长存活时间（秒）
+        bypass_cache: 跳过缓存读写
+        resume: 在已有输出文件基础上续跑，跳过已完成的记录
+        ordered: 按输入顺序写出结果（默认按完成顺序写出并带输入序号 index）
+        reorder_window: ordered 模式下最多暂存的乱序结果数
+        keep_fields: 从输入复制到结果中的字段
+        connection: HTTP 连接配置
+        pack_size: 每个请求最多打包的记录数
+        pack_token_budget: 每个打包请求的估计 token 上限
+        rejects_file: 无法解析的响应写入的文件，默认为输出文件名加 .rejects.jsonl
+        structured_output: 结构化输出方式，response_format 或 guided_json
+        tight_max_tokens: 按输入长度估计每个请求的 max_tokens
+        request_stats: 请求级统计，压测时传入
     """
     # 确保输出目录存在
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
-    # 读取输入文件
-    with open(input_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        questions = list(data)
+    cache = None
+    if cache_path:
+        cache = ResponseCache(cache_path, max_entries=cache_max_entries, max_age=cache_max_age)
 
-    logging.info(f"共读取 {len(questions)} 条问题记录")
+    # 每条结果完成后立即追加写入并落盘
+    writer = CheckpointWriter(output_file, resume=resume, ordered=ordered, reorder_window=reorder_window)
+    # 无法解析的响应单独保存，不混入结果文件
+    rejects_file = rejects_file or default_rejects_file(output_file)
+    reject_writer = CheckpointWriter(rejects_file, resume=resume)
 
-    # 异步处理问题
-    async with AsyncQwenCaller(max_concurrent=max_concurrent) as caller:
-        caller.set_progress_bar(len(questions))
+    # 异步处理问题，输入按需读取
+    try:
+        async with AsyncQwenCaller(max_concurrent=max_concurrent, min_concurrent=min_concurrent,
+                                   target_latency=target_latency, adaptive=adaptive,
+                                   cache=cache, bypass_cache=bypass_cache,
+                                   keep_fields=keep_fields, connection=connection,
+                                   pack_size=pack_size, pack_token_budget=pack_token_budget,
+                                   reject_writer=reject_writer, structured_output=structured_output,
+                                   tight_max_tokens=tight_max_tokens, request_stats=request_stats) as caller:
+            caller.set_progress_bar(None)
+            await caller.run(iter_questions(input_file), writer)
+            caller.close_progress()
+    finally:
+        writer.close()
+        reject_writer.close()
+        if cache is not None:
+            cache.close()
+
+    logging.info(f"结果已保存到: {output_file}，本次写入 {writer.written_count} 条")
+    if reject_writer.written_count:
+        logging.info(f"无法解析的响应 {reject_writer.written_count} 条已保存到: {rejects_file}")
+
+def add_pack_arguments(parser) -> None:
+    """
+    添加请求打包相关的命令行参数
+    
+    Args:
+        parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--pack-size', type=int, default=1,
+                        help='每个请求最多打包的记录数，模型返回JSON数组后逐条拆分，默认1即逐条请求')
+    parser.add_argument('--pack-token-budget', type=int, default=None,
+                        help='每个打包请求的估计token上限（输入+输出），超出时提前结束当前包')
 
-        tasks = []
-        for i, question in enumerate(questions):
-            task = caller.process_question(question, i + 1)
-            tasks.append(task)
+def add_concurrency_arguments(parser) -> None:
+    """
+    添加自适应并发相关的命令行参数（--max-concurrent 的默认值各脚本不同，由调用方添加）
+    
+    Args:
+        parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--min-concurrent', type=int, default=1, help='自适应并发窗口下限')
+    parser.add_argument('--target-latency', type=float, default=None,
+                        help='目标响应时间（秒），默认根据观测到的基线自动确定')
+    parser.add_argument('--fixed-concurrency', action='store_true', help='关闭自适应并发，固定使用 --max-concurrent')
 
-        # 等待所有任务完成
-        await asyncio.gather(*tasks, return_exceptions=True)
-        if caller._running_tasks:
-            await asyncio.wait(caller._running_tasks)
+def add_cache_arguments(parser, default_path: str = 'data/cache/qwen_responses.sqlite') -> None:
+    """
+    添加响应缓存相关的命令行参数
+    
+    Args:
+        parser: argparse.ArgumentParser
+        default_path: --cache-db 的默认值，为空字符串时默认不使用缓存
+    """
+    parser.add_argument('--cache-db', default=default_path,
+                        help=f'响应缓存数据库路径，为空字符串时不使用缓存 (默认: {default_path or "不使用"})')
+    parser.add_argument('--cache-max-entries', type=int, default=None, help='缓存最多保留的条目数')
+    parser.add_argument('--cache-max-age', type=float, default=None, help='缓存条目最长存活时间（秒）')
+    parser.add_argument('--no-cache', action='store_true', help='跳过缓存读写，每条都重新请求模型')
 
-        caller.close_progress()
+def add_output_arguments(parser) -> None:
+    """
+    添加结构化输出相关的命令行参数
+    
+    Args:
+        parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--structured', choices=STRUCTURED_OUTPUT_MODES, default=None,
+                        help='随请求发送输出的JSON Schema（OpenAI response_format 或 vLLM guided_json），并按schema校验响应')
+    parser.add_argument('--tight-max-tokens', action='store_true',
+                        help='按输入长度估计每个请求的 max_tokens，而不是固定预留 16384')
 
-        # 保存结果
-        with open(output_file, "w", encoding="utf-8") as f:
-            for result in caller.results:
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+def add_connection_arguments(parser) -> None:
+    """
+    添加 HTTP 连接相关的命令行参数
+    
+    Args:
+        parser: argparse.ArgumentParser
+    """
+    parser.add_argument('--url', default=None, help=f'接口地址，默认读取 QWEN_API_URL 或 {DEFAULT_API_URL}')
+    parser.add_argument('--token', default=None, help='访问令牌，默认读取 QWEN_API_TOKEN')
+    parser.add_argument('--unix-socket', default=None, help='通过 unix socket 连接本地推理服务')
+    parser.add_argument('--connector-limit', type=int, default=None, help='连接池大小，默认等于 --max-concurrent')
+    parser.add_argument('--keepalive-timeout', type=float, default=30.0, help='空闲连接保留时间（秒）')
+    parser.add_argument('--no-keepalive', action='store_true', help='不复用连接，每个请求后关闭')
+    parser.add_argument('--no-decompress', action='store_true', help='请求不压缩的响应并关闭自动解压')
 
-        logging.info(f"结果已保存到: {output_file}")
+def connection_settings_from_args(args) -> ConnectionSettings:
+    """
+    根据命令行参数生成连接配置
+    
+    Args:
+        args: 解析后的参数
+        
+    Returns:
+        ConnectionSettings: 连接配置
+    """
+    return ConnectionSettings(
+        url=args.url,
+        token=args.token,
+        unix_socket=args.unix_socket,
+        connector_limit=args.connector_limit,
+        keepalive=not args.no_keepalive,
+        keepalive_timeout=args.keepalive_timeout,
+        auto_decompress=not args.no_decompress
+    )
 
 def main():
     """主函数"""
@@ -247,14 +1259,36 @@ def main():
     parser = argparse.ArgumentParser(description='使用Qwen API处理对话数据')
     parser.add_argument('input_file', help='输入文件路径')
     parser.add_argument('output_file', help='输出文件路径')
-    parser.add_argument('--max-concurrent', type=int, default=5, help='最大并发请求数')
+    parser.add_argument('--max-concurrent', type=int, default=5, help='最大并发请求数（自适应模式下为窗口上限）')
+    add_concurrency_arguments(parser)
+    add_cache_arguments(parser)
+    parser.add_argument('--resume', action='store_true', help='在已有输出文件基础上续跑，跳过已完成的记录')
+    parser.add_argument('--ordered', action='store_true', help='按输入顺序写出结果，默认按完成顺序写出并带输入序号')
+    parser.add_argument('--reorder-window', type=int, default=1024, help='--ordered 模式下最多暂存的乱序结果数')
+    parser.add_argument('--keep-fields', default='episode,key',
+                        help='从输入原样复制到结果中的字段，逗号分隔 (默认: episode,key)')
+    parser.add_argument('--rejects-file', default=None,
+                        help='无法解析的响应保存位置，默认为输出文件名加 .rejects.jsonl')
+    add_pack_arguments(parser)
+    add_output_arguments(parser)
+    add_connection_arguments(parser)
     args = parser.parse_args()
 
     # 设置日志
     logger = setup_logging()
     
     # 运行异步处理
-    asyncio.run(process_file(args.input_file, args.output_file, args.max_concurrent))
+    asyncio.run(process_file(args.input_file, args.output_file, args.max_concurrent,
+                             min_concurrent=args.min_concurrent, target_latency=args.target_latency,
+                             adaptive=not args.fixed_concurrency, cache_path=args.cache_db,
+                             cache_max_entries=args.cache_max_entries, cache_max_age=args.cache_max_age,
+                             bypass_cache=args.no_cache, resume=args.resume, ordered=args.ordered,
+                             reorder_window=args.reorder_window,
+                             keep_fields=[f for f in args.keep_fields.split(',') if f],
+                             connection=connection_settings_from_args(args),
+                             pack_size=args.pack_size, pack_token_budget=args.pack_token_budget,
+                             rejects_file=args.rejects_file, structured_output=args.structured,
+                             tight_max_tokens=args.tight_max_tokens))
 
 if __name__ == "__main__":
     main()
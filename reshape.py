@@ -5,7 +5,7 @@ base_dir = "data/qwenapi_result"
 data_list = []
 for file in os.listdir(base_dir):
     print(file)
-    if file=="qwenapi_result.json":
+    if file=="qwenapi_result.json" or file.endswith(".rejects.jsonl"):
         continue
     with open(os.path.join(base_dir, file), "r", encoding="utf-8") as f:
         for line in f:
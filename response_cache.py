@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    基于 SQLite 的模型响应缓存
+
+    以 (model, prompt, temperature, max_tokens) 的哈希为键，保存 API 返回的原始文本；
+    支持按条目数和存活时间淘汰，记录命中/未命中次数
+
+    写入按批提交：每 commit_every 次写入或距上次提交超过 commit_interval 秒时提交一次，close 时提交剩余部分，
+    避免事件循环中每条响应都同步等待一次 SQLite 提交。进程崩溃时最多丢失最近一批写入，续跑时重新请求即可。
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, max_age: Optional[float] = None,
+                 evict_every: int = 1000, commit_every: int = 100, commit_interval: float = 1.0):
+        """
+        打开（或创建）缓存数据库
+
+        Args:
+            path: 数据库文件路径
+            max_entries: 最多保留的条目数，超出时淘汰最久未访问的条目
+            max_age: 条目最长存活时间（秒），超过后视为未命中并在淘汰时删除
+            evict_every: 每写入多少条执行一次淘汰
+            commit_every: 每写入多少条提交一次
+            commit_interval: 距上次提交超过该时长（秒）时，下一次写入后立即提交
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.commit_every = max(1, commit_every)
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON responses(accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, temperature: float, max_tokens: int, namespace: str = "",
+                 options: Optional[Dict] = None) -> str:
+        """
+        计算缓存键
+
+        Args:
+            model: 模型名称
+            prompt: 提示词
+            temperature: 采样温度
+            max_tokens: 最大生成长度
+            namespace: 额外的区分标识，例如多次采样时的批次号，使同一提示词的不同采样互不覆盖
+            options: 请求中的其他参数（按记录估计的 max_tokens、输出 schema 等），为空时与旧的键相同
+
+        Returns:
+            str: sha256 十六进制摘要
+        """
+        key = [model, prompt, temperature, max_tokens, namespace]
+        if options:
+            key.append(options)
+        payload = json.dumps(key, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[str]: 命中时返回缓存的响应
+        """
+        row = self._conn.execute(
+            "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+            self.misses += 1
+            return None
+        self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            response: API返回的原始响应
+        """
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, response, now, now)
+        )
+        self.writes += 1
+        self._written()
+        if self.evict_every and self.writes % self.evict_every == 0:
+            self.evict()
+
+    def discard(self, key: str) -> None:
+        """
+        删除一条缓存，例如响应无法解析时，下次重新请求
+
+        Args:
+            key: 缓存键
+        """
+        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._written()
+
+    def _written(self) -> None:
+        """记录一次写入，达到批量或间隔时提交"""
+        self._pending += 1
+        if self._pending >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """提交尚未提交的写入"""
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def evict(self) -> int:
+        """
+        按存活时间和条目数淘汰缓存
+
+        Returns:
+            int: 删除的条目数
+        """
+        removed = 0
+        if self.max_age is not None:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,)
+            )
+            removed += cursor.rowcount
+        if self.max_entries is not None:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            removed += cursor.rowcount
+        self.flush()
+        if removed:
+            logger.info(f"响应缓存淘汰 {removed} 条")
+        return removed
+
+    def summary(self) -> str:
+        """返回便于写入日志的统计信息"""
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"响应缓存: 命中 {self.hits}, 未命中 {self.misses}, 命中率 {rate:.1%}, 写入 {self.writes}"
+
+    def close(self) -> None:
+        """提交未保存的写入和访问时间并关闭数据库"""
+        self.flush()
+        self._conn.close()
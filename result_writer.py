@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+def content_id(question: Dict) -> str:
+    """
+    计算问题记录的内容指纹
+
+    Args:
+        question: 问题数据
+
+    Returns:
+        str: 16位十六进制摘要
+    """
+    payload = json.dumps(question, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+class RecordIdAssigner:
+    """
+    为输入记录分配稳定的ID
+
+    优先使用记录自带的 id 字段，否则使用内容指纹；内容完全相同的记录按出现次数加后缀区分，
+    输入文件不变时每次运行得到的ID相同
+    """
+
+    def __init__(self):
+        self._seen: Dict[str, int] = {}
+
+    def assign(self, question: Dict) -> str:
+        """
+        分配记录ID
+
+        Args:
+            question: 问题数据
+
+        Returns:
+            str: 记录ID
+        """
+        if isinstance(question, dict) and question.get("id") is not None:
+            base = str(question["id"])
+        else:
+            base = content_id(question)
+        count = self._seen.get(base, 0)
+        self._seen[base] = count + 1
+        return base if count == 0 else f"{base}#{count}"
+
+class CheckpointWriter:
+    """
+    逐条追加写入结果的JSONL文件，每条写入后 fsync，进程崩溃时已完成的记录不会丢失
+
+    - resume 模式下读取已有文件中的记录ID，调用方据此跳过已完成的记录
+    - 默认按完成顺序写出，每条记录带有输入序号 index，可据此与输入关联
+    - ordered 模式下按输入顺序写出：乱序完成的结果暂存在大小为 reorder_window 的窗口中，
+      窗口占满时 reserve() 会阻塞生产者，内存占用与数据集大小无关
+    """
+
+    def __init__(self, path: str, resume: bool = False, fsync: bool = True,
+                 ordered: bool = False, reorder_window: int = 1024):
+        """
+        打开输出文件
+
+        Args:
+            path: 输出文件路径
+            resume: 是否在已有文件基础上续写
+            fsync: 每条写入后是否 fsync
+            ordered: 是否按输入顺序写出
+            reorder_window: ordered 模式下最多暂存的结果数
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.fsync = fsync
+        self.ordered = ordered
+        self.reorder_window = max(1, reorder_window)
+        self.done_ids: Set[str] = set()
+        self.written_count = 0
+        self._next_index = 0
+        self._pending: Dict[int, Optional[Dict]] = {}
+        self._condition: Optional[asyncio.Condition] = None
+        if resume and os.path.exists(path):
+            self._load_done_ids()
+            self._file = open(path, "a", encoding="utf-8")
+            logger.info(f"续跑 {path}: 已完成 {len(self.done_ids)} 条")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+    def _load_done_ids(self) -> None:
+        """读取已完成的记录ID，并截掉崩溃时可能残留的半行"""
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                valid_size += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record, dict) and "id" in record:
+                    self.done_ids.add(str(record["id"]))
+        if valid_size != os.path.getsize(self.path):
+            logger.warning(f"{self.path} 末尾存在不完整的记录，已截断")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+
+    def _get_condition(self) -> asyncio.Condition:
+        """在事件循环内惰性创建条件变量"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def is_done(self, record_id: str) -> bool:
+        """记录是否已经在输出文件中"""
+        return record_id in self.done_ids
+
+    def can_reserve(self, index: int) -> bool:
+        """
+        reserve(index) 是否会立即返回而不等待
+
+        Args:
+            index: 输入序号
+
+        Returns:
+            bool: 非 ordered 模式或已在重排窗口内时为 True
+        """
+        return not self.ordered or index < self._next_index + self.reorder_window
+
+    async def reserve(self, index: int) -> None:
+        """
+        派发第 index 条输入前调用；ordered 模式下等待它进入重排窗口
+
+        Args:
+            index: 输入序号
+        """
+        if not self.ordered:
+            return
+        condition = self._get_condition()
+        async with condition:
+            while index >= self._next_index + self.reorder_window:
+                await condition.wait()
+
+    async def complete(self, index: int, record: Optional[Dict]) -> None:
+        """
+        提交第 index 条输入的结果
+
+        跳过或失败的输入也必须以 record=None 提交，ordered 模式才能继续向后写出
+
+        Args:
+            index: 输入序号
+            record: 结果记录，为 None 时不写出
+        """
+        if not self.ordered:
+            if record is not None:
+                self.write(record)
+            return
+        condition = self._get_condition()
+        async with condition:
+            self._pending[index] = record
+            while self._next_index in self._pending:
+                ready = self._pending.pop(self._next_index)
+                if ready is not None:
+                    self.write(ready)
+                self._next_index += 1
+            condition.notify_all()
+
+    def write(self, record: Dict) -> None:
+        """
+        追加一条记录并落盘
+
+        Args:
+            record: 带有 id 字段的结果记录
+        """
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.written_count += 1
+
+    def close(self) -> None:
+        """关闭输出文件"""
+        if self._pending:
+            logger.warning(f"{self.path} 有 {len(self._pending)} 条结果因前序结果缺失未能按序写出")
+        self._file.close()
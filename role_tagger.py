@@ -0,0 +1,302 @@
+import json
+import os
+import argparse
+import logging
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dialogue_index import DialogueIndex, load_or_build_index
+from manifest import DEFAULT_MANIFEST
+
+EMPEROR_ROLE = "皇帝"
+# 只能说明说话人不是皇帝、但说不清具体身份的角色
+SUBJECT_ROLE = "臣下"
+
+# 角色 -> 说话人自称或称呼对方时使用的标记词
+ROLE_MARKERS = {
+    EMPEROR_ROLE: ["朕", "寡人"],
+    "妃嫔": ["本宫", "臣妾", "嫔妾"],
+    "大臣": ["臣", "微臣", "老臣", "末将"],
+    "奴婢": ["奴婢", "奴才", "老奴"],
+    # 称呼皇帝的人一定不是皇帝本人
+    SUBJECT_ROLE: ["皇上", "万岁", "陛下", "圣上"],
+}
+
+def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_dir: 日志目录
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, "role_tagger.log")
+
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+class AhoCorasick:
+    """
+    Aho–Corasick 多模式匹配
+
+    所有模式建成一个自动机，一次扫描文本就能找出全部模式，耗时与文本长度成正比，和模式数量无关
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        """
+        构建自动机
+
+        Args:
+            patterns: 模式串，不能为空串
+        """
+        self.patterns = list(patterns)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态结束的所有模式编号（已沿失败链合并）
+        self._out: List[List[int]] = [[]]
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                raise ValueError("模式串不能为空")
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append(index)
+        # 按层 BFS 计算失败指针
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int]]:
+        """
+        扫描文本，产出所有（可能重叠的）匹配
+
+        Args:
+            text: 文本
+
+        Yields:
+            (end, index): 匹配结束位置（不含）和模式编号
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                yield i + 1, index
+
+    def find_all(self, text: str) -> List[int]:
+        """
+        按最左最长原则取互不重叠的匹配，例如 "臣妾" 不会再算作 "臣"
+
+        Args:
+            text: 文本
+
+        Returns:
+            List[int]: 按出现位置排列的模式编号
+        """
+        matches = sorted((end - len(self.patterns[index]), -len(self.patterns[index]), index)
+                         for end, index in self.iter_matches(text))
+        result = []
+        last_end = 0
+        for start, negative_length, index in matches:
+            if start >= last_end:
+                result.append(index)
+                last_end = start - negative_length
+        return result
+
+class RoleTagger:
+    """按标记词给发言打角色标签"""
+
+    def __init__(self, role_markers: Optional[Dict[str, List[str]]] = None):
+        """
+        初始化
+
+        Args:
+            role_markers: 角色 -> 标记词，默认为 ROLE_MARKERS
+        """
+        role_markers = role_markers or ROLE_MARKERS
+        self._roles: List[str] = []
+        patterns: List[str] = []
+        for role, markers in role_markers.items():
+            for marker in markers:
+                patterns.append(marker)
+                self._roles.append(role)
+        self.matcher = AhoCorasick(patterns)
+
+    def tag(self, text: str) -> frozenset:
+        """
+        一句发言命中的角色集合
+
+        Args:
+            text: 发言文本
+
+        Returns:
+            frozenset: 角色集合，没有命中时为空
+        """
+        return frozenset(self._roles[index] for index in self.matcher.find_all(text))
+
+def vote_roles(index: DialogueIndex, tags: Sequence[frozenset], min_votes: int = 2,
+               min_share: float = 0.7) -> Dict[int, Dict[str, Dict]]:
+    """
+    每集中每个说话人（Speaker_N）按其发言的角色标签投票，得票足够集中时确定角色
+
+    每句发言对命中的每个角色各投一票。臣下票只说明不是皇帝，计入得票最多的非皇帝具体角色；
+    没有具体角色的票时角色为臣下
+
+    Args:
+        index: 对话索引
+        tags: 与 index 中发言一一对应的角色集合
+        min_votes: 确定角色所需的最少票数
+        min_share: 确定角色所需的最低得票占比
+
+    Returns:
+        Dict[int, Dict[str, Dict]]: 集数 -> 说话人 -> {"role": 角色或 None, "votes": 各角色票数}
+    """
+    votes: Dict[Tuple[int, str], Counter] = {}
+    for turn_id, roles in enumerate(tags):
+        counter = votes.setdefault((index.episodes[turn_id], index.speakers[turn_id]), Counter())
+        counter.update(roles)
+    result: Dict[int, Dict[str, Dict]] = {}
+    for (episode, speaker), counter in votes.items():
+        role = None
+        total = sum(counter.values())
+        subject_votes = counter[SUBJECT_ROLE]
+        specific = Counter({r: v for r, v in counter.items() if r != SUBJECT_ROLE and v})
+        if specific:
+            top_role, support = specific.most_common(1)[0]
+            if top_role != EMPEROR_ROLE:
+                support += subject_votes
+        else:
+            top_role, support = SUBJECT_ROLE, subject_votes
+        if total and support >= min_votes and support / total >= min_share:
+            role = top_role
+        result.setdefault(episode, {})[speaker] = {"role": role, "votes": dict(counter)}
+    return result
+
+def split_pairs(pairs: Iterable[Dict], speaker_roles: Dict[int, Dict[str, Dict]],
+                target_role: str = EMPEROR_ROLE) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """
+    按触发发言说话人的角色把对话对分为确定、排除和需要模型核实三类
+
+    Args:
+        pairs: DialogueIndex.query 产出的对话对
+        speaker_roles: vote_roles 的结果
+        target_role: 目标角色
+
+    Returns:
+        (confirmed, rejected, ambiguous): 说话人已确定为目标角色 / 已确定为其他角色 / 角色不确定
+    """
+    confirmed, rejected, ambiguous = [], [], []
+    for pair in pairs:
+        info = speaker_roles.get(pair['episode'], {}).get(pair['huang_speaker'])
+        role = info["role"] if info else None
+        pair = dict(pair, huang_role=role)
+        if role is None or (role == SUBJECT_ROLE and target_role != EMPEROR_ROLE):
+            ambiguous.append(pair)
+        elif role == target_role:
+            confirmed.append(pair)
+        else:
+            rejected.append(pair)
+    return confirmed, rejected, ambiguous
+
+def write_jsonl(records: Iterable[Dict], output_file: str) -> None:
+    """
+    写出JSONL文件
+
+    Args:
+        records: 记录
+        output_file: 输出文件路径
+    """
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='用标记词投票推断每集说话人的角色，只把角色不确定的对话对交给Qwen核实')
+    parser.add_argument('--input-prefix', '-i', type=str, default="data/merge_results/merged_asr_result",
+                      help='merge_speaker.py 输出的JSON文件前缀 (默认: data/merge_results/merged_asr_result)')
+    parser.add_argument('--start', '-s', type=int, default=1,
+                      help='起始文件编号 (默认: 1)')
+    parser.add_argument('--end', '-e', type=int, default=46,
+                      help='结束文件编号 (默认: 46)')
+    parser.add_argument('--index', type=str, default="data/dialogue_index/dialogue_index.json",
+                      help='dialogue_index.py 的索引文件，不存在或输入有变化时重新建立 '
+                           '(默认: data/dialogue_index/dialogue_index.json)')
+    parser.add_argument('--rebuild', action='store_true',
+                      help='忽略已有索引，重新读取所有文件')
+    parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST,
+                      help=f'缓存输入文件指纹的清单文件 (默认: {DEFAULT_MANIFEST})')
+    parser.add_argument('--keyword', '-k', type=str, action='append', default=None,
+                      help='触发关键词，可重复指定 (默认: 朕)')
+    parser.add_argument('--role', type=str, default=EMPEROR_ROLE,
+                      help='目标角色 (默认: 皇帝)')
+    parser.add_argument('--min-votes', type=int, default=2,
+                      help='确定说话人角色所需的最少票数 (默认: 2)')
+    parser.add_argument('--min-share', type=float, default=0.7,
+                      help='确定说话人角色所需的最低得票占比 (默认: 0.7)')
+    parser.add_argument('--output-dir', '-o', type=str, default="data/role_tagging",
+                      help='输出目录 (默认: data/role_tagging)')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logger = setup_logging()
+
+    index = load_or_build_index(args.index, args.input_prefix, args.start, args.end, logger, args.rebuild,
+                                args.manifest)
+
+    tagger = RoleTagger()
+    tags = [tagger.tag(text) for text in index.texts]
+    speaker_roles = vote_roles(index, tags, args.min_votes, args.min_share)
+
+    keywords = args.keyword or ["朕"]
+    confirmed, rejected, ambiguous = split_pairs(index.query(keywords), speaker_roles, args.role)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "speaker_roles.json"), 'w', encoding='utf-8') as f:
+        json.dump(speaker_roles, f, ensure_ascii=False, indent=2)
+    write_jsonl(confirmed, os.path.join(args.output_dir, "confirmed.jsonl"))
+    write_jsonl(rejected, os.path.join(args.output_dir, "rejected.jsonl"))
+    write_jsonl(ambiguous, os.path.join(args.output_dir, "ambiguous.jsonl"))
+
+    resolved = sum(1 for speakers in speaker_roles.values() for info in speakers.values() if info["role"])
+    total = sum(len(speakers) for speakers in speaker_roles.values())
+    logger.info(f"{len(index)} 句发言，{resolved}/{total} 个说话人确定了角色")
+    logger.info(f"对话对 - 确定: {len(confirmed)}, 排除: {len(rejected)}, 需要核实: {len(ambiguous)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import sys
+from typing import Dict, Iterator, Sequence
+
+# spk 编号 -> 驻留的说话人标签，同一说话人的所有句子共用一个字符串对象
+_SPEAKER_LABELS: Dict[object, str] = {}
+
+def speaker_label(spk) -> str:
+    """
+    ASR 的 spk 编号对应的说话人标签（Speaker_{spk}），同一编号总是返回同一个字符串对象
+
+    Args:
+        spk: 说话人编号
+
+    Returns:
+        str: 说话人标签
+    """
+    label = _SPEAKER_LABELS.get(spk)
+    if label is None:
+        label = _SPEAKER_LABELS[spk] = sys.intern(f"Speaker_{spk}")
+    return label
+
+class Sentence:
+    """一句话：说话人、文本和起止时间（毫秒）"""
+
+    __slots__ = ("speaker", "text", "start_ms", "end_ms")
+
+    def __init__(self, speaker: str, text: str, start_ms: int, end_ms: int):
+        self.speaker = speaker
+        self.text = text
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+
+    @classmethod
+    def from_asr(cls, sentence: Dict) -> "Sentence":
+        """
+        从 sentence_info 条目构建
+
+        Args:
+            sentence: 包含 spk / text / start / end 的原始句子
+
+        Returns:
+            Sentence: 句子
+        """
+        return cls(speaker_label(sentence['spk']), sentence['text'], sentence['start'], sentence['end'])
+
+    @classmethod
+    def from_dict(cls, sentence: Dict) -> "Sentence":
+        """
+        从 to_json 输出的字典构建，说话人标签会被驻留
+
+        Args:
+            sentence: 包含 speaker / text / start_ms / end_ms 的句子
+
+        Returns:
+            Sentence: 句子
+        """
+        return cls(sys.intern(sentence['speaker']), sentence['text'], sentence['start_ms'], sentence['end_ms'])
+
+    def to_dict(self) -> Dict:
+        """转换为 to_json 输出的字典"""
+        return {'speaker': self.speaker, 'text': self.text, 'start_ms': self.start_ms, 'end_ms': self.end_ms}
+
+class MergedTurn:
+    """
+    合并后的一轮发言
+
+    不复制句子，只记录它在句子序列中的下标范围 [first, last)。
+    sentences 可以是 Sentence 列表，也可以是按下标返回 Sentence 的句子表（sentence_table.SentenceTable）。
+    """
+
+    __slots__ = ("sentences", "first", "last", "text")
+
+    def __init__(self, sentences: Sequence[Sentence], first: int, last: int, text: str):
+        self.sentences = sentences
+        self.first = first
+        self.last = last
+        self.text = text
+
+    @property
+    def speaker(self) -> str:
+        return self.sentences[self.first].speaker
+
+    @property
+    def start_ms(self) -> int:
+        return self.sentences[self.first].start_ms
+
+    @property
+    def end_ms(self) -> int:
+        return self.sentences[self.last - 1].end_ms
+
+    def segments(self) -> Iterator[Sentence]:
+        """逐句产出这一轮包含的句子"""
+        for i in range(self.first, self.last):
+            yield self.sentences[i]
+
+    def to_dict(self) -> Dict:
+        """转换为 merge_speaker 输出的字典，segments 在这里才展开"""
+        sentences = list(self.segments())
+        segments = [{'text': s.text, 'start_ms': s.start_ms, 'end_ms': s.end_ms} for s in sentences]
+        return {
+            'speaker': sentences[0].speaker,
+            'text': self.text,
+            'start_ms': segments[0]['start_ms'],
+            'end_ms': segments[-1]['end_ms'],
+            'segments': segments
+        }
+
+def json_default(obj) -> Dict:
+    """
+    json.dump 的 default 参数，在写出时才把 Sentence / MergedTurn 转换为字典
+
+    Args:
+        obj: json 无法直接序列化的对象
+
+    Returns:
+        Dict: 对应的字典
+    """
+    if isinstance(obj, (Sentence, MergedTurn)):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
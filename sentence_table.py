@@ -0,0 +1,298 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+from sentence import MergedTurn, Sentence
+
+# 句子之间的分隔符，合并后的文本用它连接
+TEXT_SEPARATOR = " "
+
+class SentenceTable:
+    """
+    列式存储的句子表
+
+    说话人保存为整数编号（speakers 为编号 -> 标签），起止时间为 int64 数组，
+    文本按顺序拼接成一个缓冲区，每句后跟一个分隔符，第 i 句为 text_buffer[text_offsets[i]:text_offsets[i + 1] - 1]。
+    这样连续若干句的合并文本就是缓冲区中的一个切片。
+    """
+
+    __slots__ = ("speakers", "speaker_ids", "start_ms", "end_ms", "text_offsets", "text_buffer")
+
+    def __init__(self, speakers: List[str], speaker_ids: np.ndarray, start_ms: np.ndarray, end_ms: np.ndarray,
+                 text_offsets: np.ndarray, text_buffer: str):
+        self.speakers = speakers
+        self.speaker_ids = speaker_ids
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.text_offsets = text_offsets
+        self.text_buffer = text_buffer
+
+    @classmethod
+    def from_sentences(cls, sentences: Iterable[Dict]) -> "SentenceTable":
+        """
+        从 to_json 输出的句子字典构建句子表
+
+        Args:
+            sentences: 包含 speaker / text / start_ms / end_ms 的句子（可以是生成器）
+
+        Returns:
+            SentenceTable: 句子表
+        """
+        speaker_index: Dict[str, int] = {}
+        speaker_ids: List[int] = []
+        starts: List[int] = []
+        ends: List[int] = []
+        lengths: List[int] = [0]
+        texts: List[str] = []
+        for sentence in sentences:
+            speaker_ids.append(speaker_index.setdefault(sentence['speaker'], len(speaker_index)))
+            starts.append(sentence['start_ms'])
+            ends.append(sentence['end_ms'])
+            texts.append(sentence['text'])
+            lengths.append(len(sentence['text']) + len(TEXT_SEPARATOR))
+        texts.append("")
+        return cls(
+            speakers=list(speaker_index),
+            speaker_ids=np.array(speaker_ids, dtype=np.int32),
+            start_ms=np.array(starts, dtype=np.int64),
+            end_ms=np.array(ends, dtype=np.int64),
+            text_offsets=np.cumsum(lengths, dtype=np.int64),
+            text_buffer=TEXT_SEPARATOR.join(texts),
+        )
+
+    def __len__(self) -> int:
+        return len(self.speaker_ids)
+
+    def text_span(self, first: int, last: int) -> str:
+        """
+        第 first 到 last - 1 句用分隔符连接后的文本
+
+        Args:
+            first: 起始句下标
+            last: 结束句下标（不含）
+
+        Returns:
+            str: 文本
+        """
+        return self.text_buffer[self.text_offsets[first]:self.text_offsets[last] - len(TEXT_SEPARATOR)]
+
+    def __getitem__(self, i: int) -> Sentence:
+        """第 i 句，每次访问时才构建 Sentence"""
+        return Sentence(self.speakers[self.speaker_ids[i]], self.text_span(i, i + 1),
+                        int(self.start_ms[i]), int(self.end_ms[i]))
+
+def group_bounds(table: SentenceTable, time_threshold: int = 2000) -> np.ndarray:
+    """
+    向量化计算合并分组：说话人变化或与上一句的间隔超过阈值时开始新组
+
+    Args:
+        table: 句子表
+        time_threshold: 时间间隔阈值（毫秒）
+
+    Returns:
+        np.ndarray: 长度为组数 + 1 的下标数组，第 g 组为 [bounds[g], bounds[g + 1]) 中的句子
+    """
+    n = len(table)
+    if n == 0:
+        return np.zeros(1, dtype=np.int64)
+    breaks = (table.speaker_ids[1:] != table.speaker_ids[:-1]) | (table.start_ms[1:] - table.end_ms[:-1] > time_threshold)
+    return np.concatenate(([0], np.flatnonzero(breaks) + 1, [n])).astype(np.int64)
+
+class AbsorbPolicy(ABC):
+    """
+    合并策略的基类：被同一说话人前后夹住、满足 should_absorb 条件的他人发言组并入前后两组
+
+    并入的句子仍保留自己的说话人标签，整组的说话人为第一句的说话人。
+    相邻的两组不会都作为被夹住的组并入：A B A B 中只并入第一个 B，结果为 [A B A] [B]，而不是整体并成 A 的一组。
+    """
+
+    def __init__(self, max_gap_ms: int = 2000):
+        """
+        Args:
+            max_gap_ms: 被夹住的组与前后两组的间隔都不超过该值时才并入（毫秒）
+        """
+        self.max_gap_ms = max_gap_ms
+
+    @abstractmethod
+    def should_absorb(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        判断每个中间组是否并入
+
+        Args:
+            starts: 各组起始时间
+            ends: 各组结束时间
+
+        Returns:
+            np.ndarray: 长度为组数 - 2 的布尔数组，对应第 1 到倒数第 2 组
+        """
+
+    def __call__(self, table: SentenceTable, bounds: np.ndarray) -> np.ndarray:
+        first, last = bounds[:-1], bounds[1:]
+        if len(first) < 3:
+            return bounds
+        speakers = table.speaker_ids[first]
+        starts, ends = table.start_ms[first], table.end_ms[last - 1]
+        candidates = ((speakers[:-2] == speakers[2:]) &
+                      (starts[1:-1] - ends[:-2] <= self.max_gap_ms) &
+                      (starts[2:] - ends[1:-1] <= self.max_gap_ms) &
+                      self.should_absorb(starts, ends))
+        absorbed = []
+        for g in (np.flatnonzero(candidates) + 1).tolist():
+            if not absorbed or absorbed[-1] != g - 1:
+                absorbed.append(g)
+        keep = np.ones(len(bounds), dtype=bool)
+        keep[absorbed] = False
+        keep[np.array(absorbed, dtype=np.int64) + 1] = False
+        return bounds[keep]
+
+class AbsorbInterjections(AbsorbPolicy):
+    """并入插话：时长不超过 max_ms 的他人短句（如“嗯”“是”）不打断当前说话人的发言"""
+
+    def __init__(self, max_ms: int = 1000, max_gap_ms: int = 2000):
+        super().__init__(max_gap_ms)
+        self.max_ms = max_ms
+
+    def should_absorb(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        return ends[1:-1] - starts[1:-1] <= self.max_ms
+
+class MergeOverlaps(AbsorbPolicy):
+    """跨重叠语音合并：与前后发言在时间上重叠的他人发言（抢话、同时说话）不打断当前说话人的发言"""
+
+    def should_absorb(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        return (starts[1:-1] < ends[:-2]) | (ends[1:-1] > starts[2:])
+
+class CapTurnLength:
+    """限制每组的时长：超过 max_ms 的组在句子边界处切开，每段都不超过 max_ms（单句超长时单独成组）"""
+
+    def __init__(self, max_ms: int = 60000):
+        self.max_ms = max_ms
+
+    def __call__(self, table: SentenceTable, bounds: np.ndarray) -> np.ndarray:
+        first, last = bounds[:-1], bounds[1:]
+        long_groups = np.flatnonzero(table.end_ms[last - 1] - table.start_ms[first] > self.max_ms)
+        if len(long_groups) == 0:
+            return bounds
+        splits = []
+        for g in long_groups.tolist():
+            start = int(table.start_ms[bounds[g]])
+            for i in range(int(bounds[g]) + 1, int(bounds[g + 1])):
+                if table.end_ms[i] - start > self.max_ms:
+                    splits.append(i)
+                    start = int(table.start_ms[i])
+        return np.union1d(bounds, np.array(splits, dtype=np.int64))
+
+# 可用的合并策略，--policy 名称:参数 按这里的名称查找，新策略注册到这里即可
+MERGE_POLICIES = {
+    "absorb": AbsorbInterjections,
+    "overlap": MergeOverlaps,
+    "cap": CapTurnLength,
+}
+
+def parse_policy(spec: str):
+    """
+    由 名称[:参数,...] 创建合并策略，如 absorb:800、overlap、cap:30000
+
+    Args:
+        spec: 策略描述
+
+    Returns:
+        合并策略
+
+    Raises:
+        ValueError: 未知的策略名称或参数
+    """
+    name, _, arguments = spec.partition(":")
+    if name not in MERGE_POLICIES:
+        raise ValueError(f"未知的合并策略: {name}（可用: {', '.join(MERGE_POLICIES)}）")
+    return MERGE_POLICIES[name](*[int(a) for a in arguments.split(",") if a])
+
+def merge_bounds(table: SentenceTable, time_threshold: int = 2000, policies: Sequence = ()) -> np.ndarray:
+    """
+    计算合并分组：先按 group_bounds 分组，再依次应用合并策略
+
+    Args:
+        table: 句子表（或有 speaker_ids / start_ms / end_ms 三列的视图）
+        time_threshold: 时间间隔阈值（毫秒）
+        policies: 合并策略，每个都是 (table, bounds) -> bounds 的可调用对象
+
+    Returns:
+        np.ndarray: 分组边界
+    """
+    bounds = group_bounds(table, time_threshold)
+    for policy in policies:
+        bounds = policy(table, bounds)
+    return bounds
+
+class MergedTable:
+    """按 group_bounds 合并后的句子组，各列与 SentenceTable 一致，另外保存每组的文本"""
+
+    __slots__ = ("table", "bounds", "speaker_ids", "start_ms", "end_ms", "texts")
+
+    def __init__(self, table: SentenceTable, bounds: np.ndarray):
+        first, last = bounds[:-1], bounds[1:]
+        self.table = table
+        self.bounds = bounds
+        self.speaker_ids = table.speaker_ids[first]
+        self.start_ms = table.start_ms[first]
+        self.end_ms = table.end_ms[last - 1]
+        # 每组只切一次缓冲区
+        offsets = table.text_offsets.tolist()
+        buffer, sep = table.text_buffer, len(TEXT_SEPARATOR)
+        self.texts = [buffer[offsets[a]:offsets[b] - sep] for a, b in zip(first.tolist(), last.tolist())]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def turns(self) -> List[MergedTurn]:
+        """
+        每组转换为 MergedTurn，segments 为句子表中的下标范围
+
+        Returns:
+            List[MergedTurn]: 合并后的发言
+        """
+        bounds = self.bounds.tolist()
+        return [MergedTurn(self.table, bounds[g], bounds[g + 1], text) for g, text in enumerate(self.texts)]
+
+    def to_dicts(self) -> List[Dict]:
+        """
+        转换为 merge_speaker.merge_sentences 的输出格式
+
+        Returns:
+            List[Dict]: 合并后的句子列表，每组带有 segments
+        """
+        table = self.table
+        speakers = table.speakers
+        offsets = table.text_offsets.tolist()
+        buffer, sep = table.text_buffer, len(TEXT_SEPARATOR)
+        starts, ends = table.start_ms.tolist(), table.end_ms.tolist()
+        bounds = self.bounds.tolist()
+        groups = []
+        for g, (speaker_id, start_ms, end_ms) in enumerate(zip(self.speaker_ids.tolist(), self.start_ms.tolist(),
+                                                                self.end_ms.tolist())):
+            groups.append({
+                'speaker': speakers[speaker_id],
+                'text': self.texts[g],
+                'start_ms': start_ms,
+                'end_ms': end_ms,
+                'segments': [{
+                    'text': buffer[offsets[i]:offsets[i + 1] - sep],
+                    'start_ms': starts[i],
+                    'end_ms': ends[i]
+                } for i in range(bounds[g], bounds[g + 1])]
+            })
+        return groups
+
+def merge_table(table: SentenceTable, time_threshold: int = 2000, policies: Sequence = ()) -> MergedTable:
+    """
+    合并连续的相同说话人的句子（列式版本的 merge_speaker.merge_sentences）
+
+    Args:
+        table: 句子表
+        time_threshold: 时间间隔阈值（毫秒）
+        policies: 合并策略（见 MERGE_POLICIES）
+
+    Returns:
+        MergedTable: 合并结果
+    """
+    return MergedTable(table, merge_bounds(table, time_threshold, policies))
@@ -0,0 +1,380 @@
+import json
+import os
+import argparse
+import logging
+import subprocess
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from columnar_store import EpisodeStore, episode_path, is_store
+from dialogue_index import load_or_build_index
+from ext_data import SAMPLE_RATE, decode_command
+
+# 声纹模型：输入若干段 float32 波形，返回每段一行的嵌入矩阵
+Embedder = Callable[[List[np.ndarray]], np.ndarray]
+
+SPEAKER_MODEL = "iic/speech_campplus_sv_zh-cn_16k-common"
+
+def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
+    """
+    设置日志配置
+
+    Args:
+        log_dir: 日志目录
+        log_level: 日志级别
+
+    Returns:
+        logger: 日志记录器
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, "speaker_index.log")
+
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    按行做 L2 归一化，归一化后的点积即为余弦相似度
+
+    Args:
+        matrix: 矩阵
+
+    Returns:
+        np.ndarray: float32 矩阵
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+class SpeakerIndex:
+    """
+    说话人嵌入索引：每集每个聚类（Speaker_N）一行
+
+    目录结构：
+        embeddings.npy   float32 矩阵，每行一个 L2 归一化的嵌入，加载时用 mmap 只读映射
+        clusters.json    与矩阵各行对应的 {episode, speaker, seconds, global_id}
+        characters.json  全局编号 -> 角色名
+    """
+
+    def __init__(self, index_dir: str):
+        """
+        加载索引，目录不存在时为空
+
+        Args:
+            index_dir: 索引目录
+        """
+        self.index_dir = index_dir
+        self.embeddings: Optional[np.ndarray] = None
+        self.clusters: List[Dict] = []
+        self.characters: Dict[str, str] = {}
+        embeddings_path = os.path.join(index_dir, "embeddings.npy")
+        if os.path.exists(embeddings_path):
+            self.embeddings = np.load(embeddings_path, mmap_mode="r")
+            with open(os.path.join(index_dir, "clusters.json"), "r", encoding="utf-8") as f:
+                self.clusters = json.load(f)
+        characters_path = os.path.join(index_dir, "characters.json")
+        if os.path.exists(characters_path):
+            with open(characters_path, "r", encoding="utf-8") as f:
+                self.characters = json.load(f)
+
+    def episodes(self) -> Set[int]:
+        """已经建立索引的集数"""
+        return {cluster["episode"] for cluster in self.clusters}
+
+    def add_episode(self, episode: int, clusters: Sequence[Tuple[str, float, np.ndarray]]) -> None:
+        """
+        加入（或替换）一集的聚类嵌入，尚未链接到全局编号
+
+        Args:
+            episode: 集数
+            clusters: (说话人标签, 有效语音时长秒数, 嵌入向量)
+        """
+        keep = [i for i, cluster in enumerate(self.clusters) if cluster["episode"] != episode]
+        rows = [np.asarray(self.embeddings[keep])] if self.embeddings is not None and keep else []
+        if clusters:
+            rows.append(normalize_rows(np.stack([embedding for _, _, embedding in clusters])))
+        self.clusters = [self.clusters[i] for i in keep] + [
+            {"episode": episode, "speaker": speaker, "seconds": round(seconds, 1), "global_id": None}
+            for speaker, seconds, _ in clusters]
+        self.embeddings = np.concatenate(rows) if rows else None
+
+    def link(self, threshold: float = 0.6, relink: bool = False) -> int:
+        """
+        把还没有全局编号的聚类链接到已有的全局角色，相似度都不够时建立新角色
+
+        每个全局角色的中心为其所有聚类嵌入的平均；同一集中的不同聚类不会链接到同一个角色。
+        已有的编号保持不变，角色名因此不会失效。
+
+        Args:
+            threshold: 余弦相似度阈值
+            relink: 清空所有编号后重新链接（角色名会被清空）
+
+        Returns:
+            int: 新链接的聚类数
+        """
+        if self.embeddings is None:
+            return 0
+        if relink:
+            for cluster in self.clusters:
+                cluster["global_id"] = None
+            self.characters = {}
+        embeddings = np.asarray(self.embeddings, dtype=np.float32)
+        ids = np.array([-1 if c["global_id"] is None else c["global_id"] for c in self.clusters], dtype=np.int64)
+        next_id = int(ids.max()) + 1 if len(ids) and ids.max() >= 0 else 0
+        sums = np.zeros((next_id, embeddings.shape[1]), dtype=np.float32)
+        assigned = ids >= 0
+        np.add.at(sums, ids[assigned], embeddings[assigned])
+
+        linked = 0
+        pending_episodes = sorted({self.clusters[i]["episode"] for i in np.flatnonzero(~assigned)})
+        episodes = np.array([c["episode"] for c in self.clusters])
+        for episode in pending_episodes:
+            rows = np.flatnonzero((episodes == episode) & (ids < 0))
+            taken = set(ids[(episodes == episode) & (ids >= 0)].tolist())
+            if len(sums):
+                # 一次算出本集所有聚类与所有角色中心的余弦相似度
+                similarity = embeddings[rows] @ normalize_rows(sums).T
+                order = np.dstack(np.unravel_index(np.argsort(-similarity, axis=None), similarity.shape))[0]
+                for r, g in order:
+                    if similarity[r, g] < threshold:
+                        break
+                    if ids[rows[r]] < 0 and g not in taken:
+                        ids[rows[r]] = g
+                        taken.add(int(g))
+            for row in rows:
+                if ids[row] < 0:
+                    ids[row] = next_id
+                    next_id += 1
+                    sums = np.vstack([sums, np.zeros((1, embeddings.shape[1]), dtype=np.float32)])
+                sums[ids[row]] += embeddings[row]
+                linked += 1
+        for cluster, global_id in zip(self.clusters, ids.tolist()):
+            cluster["global_id"] = global_id
+        return linked
+
+    def speakers_of(self, name: str) -> Dict[int, Set[str]]:
+        """
+        按角色名查出各集中对应的说话人标签
+
+        Args:
+            name: 角色名，也可以直接是全局编号
+
+        Returns:
+            Dict[int, Set[str]]: 集数 -> 说话人标签
+        """
+        global_ids = {int(g) for g, n in self.characters.items() if n == name}
+        if name.isdigit():
+            global_ids.add(int(name))
+        result: Dict[int, Set[str]] = {}
+        for cluster in self.clusters:
+            if cluster["global_id"] in global_ids:
+                result.setdefault(cluster["episode"], set()).add(cluster["speaker"])
+        return result
+
+    def save(self) -> None:
+        """写入索引目录，每个文件都先写临时文件再替换"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        if self.embeddings is not None:
+            embeddings = np.asarray(self.embeddings, dtype=np.float32)
+            tmp_path = os.path.join(self.index_dir, "embeddings.tmp.npy")
+            np.save(tmp_path, embeddings)
+            # 先释放 mmap，再替换文件
+            self.embeddings = None
+            os.replace(tmp_path, os.path.join(self.index_dir, "embeddings.npy"))
+            self.embeddings = np.load(os.path.join(self.index_dir, "embeddings.npy"), mmap_mode="r")
+        for filename, data in (("clusters.json", self.clusters), ("characters.json", self.characters)):
+            tmp_path = os.path.join(self.index_dir, filename + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, os.path.join(self.index_dir, filename))
+
+def load_embedder(device: str = "cpu") -> Embedder:
+    """
+    加载声纹模型（CAM++）
+
+    Args:
+        device: 推理设备
+
+    Returns:
+        Embedder: 嵌入函数
+    """
+    from funasr import AutoModel
+
+    model = AutoModel(model=SPEAKER_MODEL, device=device, disable_update=True)
+
+    def embed(waveforms: List[np.ndarray]) -> np.ndarray:
+        rows = []
+        for waveform in waveforms:
+            embedding = model.generate(input=waveform)[0]["spk_embedding"]
+            if hasattr(embedding, "cpu"):
+                embedding = embedding.cpu().numpy()
+            rows.append(np.asarray(embedding, dtype=np.float32).reshape(-1))
+        return np.stack(rows)
+
+    return embed
+
+def load_sentences(parsed_file: str) -> List[Dict]:
+    """
+    读取 to_json 输出的一集的所有句子
+
+    Args:
+        parsed_file: JSON 文件或列式存储目录
+
+    Returns:
+        List[Dict]: 句子（speaker / text / start_ms / end_ms）
+    """
+    if is_store(parsed_file):
+        store = EpisodeStore(parsed_file)
+        return [store[i].to_dict() for i in range(len(store))]
+    with open(parsed_file, "r", encoding="utf-8") as f:
+        return [s for item in json.load(f) for s in item.get("sentences", [])]
+
+def decode_audio(audio_file: str) -> np.ndarray:
+    """
+    用 ffmpeg 解码整集音轨为 16kHz int16 波形
+
+    Args:
+        audio_file: 音视频文件路径
+
+    Returns:
+        np.ndarray: int16 波形
+    """
+    result = subprocess.run(decode_command(audio_file, SAMPLE_RATE), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+def cluster_embeddings(audio: np.ndarray, sentences: Sequence[Dict], embed: Embedder, max_seconds: float = 60.0,
+                       min_segment_seconds: float = 1.0) -> List[Tuple[str, float, np.ndarray]]:
+    """
+    为一集中每个说话人计算一个嵌入：取该说话人最长的若干句，按时长加权平均各句的嵌入
+
+    Args:
+        audio: 整集 int16 波形
+        sentences: to_json 输出的句子（speaker / start_ms / end_ms）
+        embed: 嵌入函数
+        max_seconds: 每个说话人最多使用的语音时长（秒）
+        min_segment_seconds: 短于该时长的句子不使用
+
+    Returns:
+        List[Tuple[str, float, np.ndarray]]: (说话人标签, 使用的语音时长, 嵌入)
+    """
+    by_speaker: Dict[str, List[Tuple[int, int]]] = {}
+    for sentence in sentences:
+        by_speaker.setdefault(sentence["speaker"], []).append((sentence["start_ms"], sentence["end_ms"]))
+    clusters = []
+    for speaker, segments in by_speaker.items():
+        segments = sorted((s for s in segments if (s[1] - s[0]) / 1000 >= min_segment_seconds),
+                          key=lambda s: s[0] - s[1])
+        chosen, total = [], 0.0
+        for start_ms, end_ms in segments:
+            if total >= max_seconds:
+                break
+            chosen.append((start_ms, end_ms))
+            total += (end_ms - start_ms) / 1000
+        if not chosen:
+            continue
+        waveforms = [audio[start * SAMPLE_RATE // 1000:end * SAMPLE_RATE // 1000].astype(np.float32) / 32768.0
+                     for start, end in chosen]
+        weights = np.array([end - start for start, end in chosen], dtype=np.float32)
+        embedding = (normalize_rows(embed(waveforms)) * weights[:, None]).sum(axis=0)
+        clusters.append((speaker, total, embedding))
+    return clusters
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='为每集的说话人聚类建立声纹索引，并跨集链接为统一的角色')
+    parser.add_argument('--index-dir', type=str, default="data/speaker_index",
+                      help='索引目录 (默认: data/speaker_index)')
+    parser.add_argument('--build', action='store_true',
+                      help='为尚未建立索引的集计算声纹嵌入')
+    parser.add_argument('--rebuild', action='store_true',
+                      help='重新计算所有集的声纹嵌入')
+    parser.add_argument('--parsed-prefix', type=str, default="data/parsed_results/parsed_asr_result",
+                      help='to_json.py 输出的文件前缀，JSON 或列式存储 (默认: data/parsed_results/parsed_asr_result)')
+    parser.add_argument('--audio-dir', type=str, default="/mnt/g/download/mv",
+                      help='视频文件目录 (默认: /mnt/g/download/mv)')
+    parser.add_argument('--pattern', type=str, default="{episode:02d}.4K.H265.AAC-YYDS.mp4",
+                      help='视频文件名模板 (默认: {episode:02d}.4K.H265.AAC-YYDS.mp4)')
+    parser.add_argument('--start', '-s', type=int, default=1,
+                      help='起始集数 (默认: 1)')
+    parser.add_argument('--end', '-e', type=int, default=46,
+                      help='结束集数 (默认: 46)')
+    parser.add_argument('--device', type=str, default="cpu",
+                      help='声纹模型的推理设备 (默认: cpu)')
+    parser.add_argument('--threshold', type=float, default=0.6,
+                      help='链接到已有角色所需的余弦相似度 (默认: 0.6)')
+    parser.add_argument('--relink', action='store_true',
+                      help='清空全局编号和角色名后重新链接')
+    parser.add_argument('--name', type=str, action='append', default=None,
+                      help='为全局编号命名，如 --name 3=皇帝，可重复指定')
+    parser.add_argument('--character', type=str, default=None,
+                      help='输出该角色（名字或全局编号）的所有发言及其上一句组成的对话对')
+    parser.add_argument('--dialogue-index', type=str, default="data/dialogue_index/dialogue_index.json",
+                      help='dialogue_index.py 的索引文件 (默认: data/dialogue_index/dialogue_index.json)')
+    parser.add_argument('--merge-prefix', type=str, default="data/merge_results/merged_asr_result",
+                      help='对话索引不存在时读取的合并结果前缀 (默认: data/merge_results/merged_asr_result)')
+    parser.add_argument('--output', '-o', type=str, default="data/conversion_result/character_pairs.jsonl",
+                      help='--character 的输出文件 (默认: data/conversion_result/character_pairs.jsonl)')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logger = setup_logging()
+    index = SpeakerIndex(args.index_dir)
+
+    if args.build or args.rebuild:
+        embed = load_embedder(args.device)
+        done = set() if args.rebuild else index.episodes()
+        for i in range(args.start, args.end + 1):
+            if i in done:
+                continue
+            parsed_file = episode_path(f"{args.parsed_prefix}{i}.json")
+            audio_file = os.path.join(args.audio_dir, args.pattern.format(episode=i))
+            try:
+                sentences = load_sentences(parsed_file)
+                audio = decode_audio(audio_file)
+            except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                logger.error(f"第 {i} 集读取失败: {e}")
+                continue
+            clusters = cluster_embeddings(audio, sentences, embed)
+            index.add_episode(i, clusters)
+            index.save()
+            logger.info(f"第 {i} 集: {len(clusters)} 个说话人")
+
+    linked = index.link(args.threshold, args.relink)
+    for spec in args.name or []:
+        global_id, _, name = spec.partition("=")
+        index.characters[str(int(global_id))] = name
+    index.save()
+    roles = len({c["global_id"] for c in index.clusters})
+    logger.info(f"共 {len(index.clusters)} 个说话人聚类，新链接 {linked} 个，对应 {roles} 个全局角色")
+
+    if args.character:
+        episode_speakers = index.speakers_of(args.character)
+        dialogue_index = load_or_build_index(args.dialogue_index, args.merge_prefix, args.start, args.end, logger)
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        pair_count = 0
+        with open(args.output, "w", encoding="utf-8") as out:
+            for pair in dialogue_index.speaker_pairs(episode_speakers):
+                out.write(json.dumps(pair, ensure_ascii=False) + "\n")
+                pair_count += 1
+        logger.info(f"角色 {args.character} 出现在 {len(episode_speakers)} 集中，共输出 {pair_count} 条对话对: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 import json
 import ast
 import os
+import re
 import argparse
 import logging
-from typing import Dict, List, Optional, Union
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from manifest import DEFAULT_MANIFEST, Manifest
+from sentence import Sentence, json_default, speaker_label
 
 def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> logging.Logger:
     """
@@ -29,66 +35,374 @@ def setup_logging(log_dir: str = "./logs", log_level: int = logging.INFO) -> log
     )
     return logging.getLogger(__name__)
 
-def parse_asr_data(data: Dict) -> List[Dict]:
+# 旧版 ext_data.py 用 str(rec_result) 保存识别结果，下面的词法规则用于增量解析这种 Python repr 文本
+_WS_RE = re.compile(r'\s*')
+_NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_STRING_RE = re.compile(r"'(?:[^'\\\n]|\\.)*'|\"(?:[^\"\\\n]|\\.)*\"", re.S)
+_NAME_RE = re.compile(r'[A-Za-z_][\w.]*')
+_SKIP_RE = re.compile(r"[\[\](){}'\"]")
+_CONSTANTS = {'True': True, 'False': False, 'None': None, 'inf': float('inf'), 'nan': float('nan')}
+
+# 句子中只有这些字段会被用到，其余字段（主要是逐字的 timestamp 列表）直接跳过不构建对象
+SENTENCE_FIELDS = ('spk', 'text', 'start', 'end')
+
+class ReprDecoder:
     """
-    解析ASR数据
-    
+    ASR结果 repr 文本的增量解码器
+
+    只处理 str(rec_result) 会产生的字面量（字符串、数字、列表、元组、字典、True/False/None
+    以及 np.int64(3) 这类包装），按需逐个产出 sentence_info 条目，不构建整个AST
+    """
+
+    def __init__(self, text: str, max_depth: int = 32):
+        """
+        初始化解码器
+
+        Args:
+            text: repr 文本
+            max_depth: 允许的最大嵌套深度
+        """
+        self.text = text
+        self.pos = 0
+        self.max_depth = max_depth
+
+    def _error(self, message: str) -> ValueError:
+        """构造带位置信息的解码错误"""
+        return ValueError(f"{message} (位置 {self.pos})")
+
+    def _peek(self) -> str:
+        """跳过空白并返回下一个字符，结尾时返回空串"""
+        self.pos = _WS_RE.match(self.text, self.pos).end()
+        return self.text[self.pos:self.pos + 1]
+
+    def _expect(self, char: str) -> None:
+        """读取一个指定字符"""
+        if self._peek() != char:
+            raise self._error(f"期望 '{char}'")
+        self.pos += 1
+
+    def _next_item(self, closer: str, first: bool) -> bool:
+        """
+        定位容器中的下一个元素
+
+        Returns:
+            bool: 还有元素时返回 True，遇到结束符时消费它并返回 False
+        """
+        char = self._peek()
+        if char == closer:
+            self.pos += 1
+            return False
+        if not first:
+            if char != ',':
+                raise self._error(f"期望 ',' 或 '{closer}'")
+            self.pos += 1
+            if self._peek() == closer:
+                self.pos += 1
+                return False
+        return True
+
+    def _string(self) -> str:
+        """读取一个字符串字面量"""
+        match = _STRING_RE.match(self.text, self.pos)
+        if match is None:
+            raise self._error("字符串未闭合")
+        self.pos = match.end()
+        token = match.group()
+        if '\\' in token:
+            return ast.literal_eval(token)
+        return token[1:-1]
+
+    def value(self, depth: int = 0):
+        """
+        读取一个完整的值
+
+        Args:
+            depth: 当前嵌套深度
+
+        Returns:
+            解码后的 Python 对象
+        """
+        if depth > self.max_depth:
+            raise self._error("嵌套层数过深")
+        char = self._peek()
+        if char in ("'", '"'):
+            return self._string()
+        if char in ('[', '('):
+            closer = ']' if char == '[' else ')'
+            self.pos += 1
+            items = []
+            first = True
+            while self._next_item(closer, first):
+                items.append(self.value(depth + 1))
+                first = False
+            return items
+        if char == '{':
+            self.pos += 1
+            result = {}
+            first = True
+            while self._next_item('}', first):
+                key = self.value(depth + 1)
+                self._expect(':')
+                result[key] = self.value(depth + 1)
+                first = False
+            return result
+        match = _NUMBER_RE.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            token = match.group()
+            if any(c in token for c in '.eE'):
+                return float(token)
+            return int(token)
+        match = _NAME_RE.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            name = match.group()
+            if self._peek() == '(':
+                # np.int64(3) / np.float32(0.5) 之类的包装，只取里面的值
+                self.pos += 1
+                inner = self.value(depth + 1)
+                self._expect(')')
+                return inner
+            if name in _CONSTANTS:
+                return _CONSTANTS[name]
+            raise self._error(f"无法识别的标识符 {name}")
+        raise self._error("无法识别的字符")
+
+    def skip_value(self) -> None:
+        """跳过一个值而不构建对象，用于逐字 timestamp 之类的大列表"""
+        char = self._peek()
+        if char in ("'", '"'):
+            self._string()
+            return
+        if char not in ('[', '(', '{'):
+            self.value()
+            return
+        depth = 0
+        while True:
+            match = _SKIP_RE.search(self.text, self.pos)
+            if match is None:
+                raise self._error("容器未闭合")
+            char = match.group()
+            if char in ("'", '"'):
+                self.pos = match.start()
+                self._string()
+                continue
+            self.pos = match.end()
+            if char in '[({':
+                depth += 1
+                if depth > self.max_depth:
+                    raise self._error("嵌套层数过深")
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _sentence(self) -> Dict:
+        """读取一条 sentence_info，只构建需要的字段"""
+        self._expect('{')
+        sentence = {}
+        first = True
+        while self._next_item('}', first):
+            key = self.value(1)
+            self._expect(':')
+            if key in SENTENCE_FIELDS:
+                sentence[key] = self.value(1)
+            else:
+                self.skip_value()
+            first = False
+        return sentence
+
+    def iter_sentences(self) -> Iterator[Dict]:
+        """逐条产出当前位置的 sentence_info 列表"""
+        self._expect('[')
+        first = True
+        while self._next_item(']', first):
+            yield self._sentence()
+            first = False
+
+    def iter_items(self) -> Iterator[Tuple[Dict, Iterator[Dict]]]:
+        """
+        逐个产出识别结果条目
+
+        Yields:
+            (header, sentences): 条目中 sentence_info 之前的标量字段，以及按需解析的句子迭代器
+        """
+        top = self._peek()
+        if top == '{':
+            single = True
+        else:
+            self._expect('[')
+            single = False
+        first = True
+        while single or self._next_item(']', first):
+            first = False
+            self._expect('{')
+            header = {}
+            sentences = None
+            item_first = True
+            while self._next_item('}', item_first):
+                item_first = False
+                key = self.value(1)
+                self._expect(':')
+                if key == 'sentence_info' and sentences is None:
+                    if 'key' in header and 'text' in header:
+                        sentences = self.iter_sentences()
+                        yield header, sentences
+                        # 调用方可能没有读完，先把剩余的句子消费掉再继续
+                        for _ in sentences:
+                            pass
+                    else:
+                        sentences = list(self.iter_sentences())
+                elif key in ('key', 'text'):
+                    header[key] = self.value(1)
+                else:
+                    self.skip_value()
+            if isinstance(sentences, list):
+                yield header, iter(sentences)
+            elif sentences is None:
+                yield header, iter(())
+            if single:
+                break
+        if self._peek():
+            raise self._error("结尾存在多余内容")
+
+def iter_asr_items(data: Dict) -> Iterator[Tuple[Dict, Iterator[Dict]]]:
+    """
+    解码 ext_data.py 保存的ASR结果，兼容结构化格式和旧版 repr 文本
+
     Args:
         data: 原始ASR数据
-        
+
+    Yields:
+        (header, sentences): 条目的 key/text，以及逐条产出 sentence_info 的迭代器
+    """
+    if isinstance(data.get('results'), list):
+        for item in data['results']:
+            yield ({'key': item.get('key', ''), 'text': item.get('text', '')},
+                   iter(item.get('sentence_info', [])))
+    elif 'sentence_info' in data:
+        yield ({'key': data.get('key', ''), 'text': data.get('text', '')},
+               iter(data['sentence_info']))
+    else:
+        yield from ReprDecoder(data['text']).iter_items()
+
+def convert_sentence(sentence: Dict) -> Dict:
+    """
+    将 sentence_info 条目转换为统一的句子格式
+
+    Args:
+        sentence: 原始句子
+
     Returns:
-        results: 解析后的数据列表
+        Dict: 包含 speaker / text / start_ms / end_ms 的句子
+    """
+    return {
+        'speaker': speaker_label(sentence['spk']),
+        'text': sentence['text'],
+        'start_ms': sentence['start'],
+        'end_ms': sentence['end']
+    }
+
+def iter_parse_asr_data(data: Dict) -> Iterator[Dict]:
     """
-    text_data = ast.literal_eval(data['text'])
-    results = []
+    逐条解析ASR数据，每次产出一个文件条目
     
-    for item in text_data:
+    Args:
+        data: 原始ASR数据
+        
+    Yields:
+        item_result: 解析后的单个条目，sentences 为 Sentence 列表
+    """
+    for header, sentences in iter_asr_items(data):
         item_result = {
-            'key': item['key'],
-            'text': item['text'],
-            'sentences': []
+            'key': header['key'],
+            'text': header['text'],
+            'sentences': [Sentence.from_asr(sentence) for sentence in sentences]
         }
         
-        for sentence in item['sentence_info']:
-            item_result['sentences'].append({
-                'speaker': f"Speaker_{sentence['spk']}",
-                'text': sentence['text'],
-                'start_ms': sentence['start'],
-                'end_ms': sentence['end']
-            })
-        
-        results.append(item_result)
+        yield item_result
+
+def parse_asr_data(data: Dict) -> List[Dict]:
+    """
+    解析ASR数据
     
-    return results
+    Args:
+        data: 原始ASR数据
+        
+    Returns:
+        results: 解析后的数据列表
+    """
+    return list(iter_parse_asr_data(data))
 
-def save_results(results: List[Dict], output_dir: str, json_filename: str, txt_filename: str) -> None:
+def write_text_report(results: List[Dict], text_output_file: str) -> None:
     """
-    保存解析结果
+    写出文本格式的报告（每个条目的前5句）
     
     Args:
         results: 解析后的数据
-        output_dir: 输出目录
-        json_filename: JSON文件名
-        txt_filename: 文本文件名
+        text_output_file: 文本文件路径
     """
-    # 保存JSON格式
-    output_file = os.path.join(output_dir, json_filename)
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-    
-    # 保存文本格式
-    text_output_file = os.path.join(output_dir, txt_filename)
     with open(text_output_file, 'w', encoding='utf-8') as f:
         for result in results:
             f.write(f"\n=== 文件: {result['key']} ===\n")
             f.write(f"完整文本: {result['text'][:100]}...\n\n")
             
             for sent in result['sentences'][:5]:
-                f.write(f"说话人: {sent['speaker']}\n")
-                f.write(f"时间段: {sent['start_ms']}-{sent['end_ms']}ms\n")
-                f.write(f"内容: {sent['text']}\n\n")
+                f.write(f"说话人: {sent.speaker}\n")
+                f.write(f"时间段: {sent.start_ms}-{sent.end_ms}ms\n")
+                f.write(f"内容: {sent.text}\n\n")
+
+def output_files(output_dir: str, json_filename: str, txt_filename: Optional[str], output_format: str = "json") -> List[str]:
+    """
+    一集的所有输出文件，用于清单记录
+    
+    Args:
+        output_dir: 输出目录
+        json_filename: JSON文件名
+        txt_filename: 文本文件名，为 None 时不输出文本报告
+        output_format: json 或 columnar
+    
+    Returns:
+        List[str]: 文件路径
+    """
+    json_path = os.path.join(output_dir, json_filename)
+    if output_format == "columnar":
+        from columnar_store import store_files, store_path
+        files = store_files(store_path(json_path))
+    else:
+        files = [json_path]
+    if txt_filename:
+        files.append(os.path.join(output_dir, txt_filename))
+    return files
+
+def save_results(results: List[Dict], output_dir: str, json_filename: str, txt_filename: Optional[str] = None,
+                 output_format: str = "json") -> None:
+    """
+    保存解析结果
+    
+    Args:
+        results: 解析后的数据
+        output_dir: 输出目录
+        json_filename: JSON文件名，columnar 格式时写入同名的 .cols 目录
+        txt_filename: 文本文件名，为 None 时不输出文本报告
+        output_format: json 或 columnar（columnar_store.py 的列式存储）
+    """
+    output_file = os.path.join(output_dir, json_filename)
+    if output_format == "columnar":
+        from columnar_store import store_path, write_store
+        
+        write_store(store_path(output_file), results)
+    else:
+        # 保存JSON格式，Sentence 在写出时才转换为字典
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, default=json_default)
+    
+    # 文本报告按需输出
+    if txt_filename:
+        write_text_report(results, os.path.join(output_dir, txt_filename))
 
-def process_asr_file(input_file: str, output_dir: str, json_filename: str, txt_filename: str, logger: logging.Logger) -> bool:
+def process_asr_file(input_file: str, output_dir: str, json_filename: str, txt_filename: Optional[str],
+                     logger: logging.Logger, output_format: str = "json") -> bool:
     """
     处理单个ASR文件
     
@@ -96,8 +410,9 @@ def process_asr_file(input_file: str, output_dir: str, json_filename: str, txt_f
         input_file: 输入文件路径
         output_dir: 输出目录
         json_filename: JSON文件名
-        txt_filename: 文本文件名
+        txt_filename: 文本文件名，为 None 时不输出文本报告
         logger: 日志记录器
+        output_format: json 或 columnar
         
     Returns:
         bool: 处理是否成功
@@ -109,7 +424,7 @@ def process_asr_file(input_file: str, output_dir: str, json_filename: str, txt_f
             data = json.load(f)
         
         results = parse_asr_data(data)
-        save_results(results, output_dir, json_filename, txt_filename)
+        save_results(results, output_dir, json_filename, txt_filename, output_format)
         
         logger.info(f"文件处理成功: {input_file}")
         return True
@@ -117,12 +432,28 @@ def process_asr_file(input_file: str, output_dir: str, json_filename: str, txt_f
     except json.JSONDecodeError as e:
         logger.error(f"JSON解析错误: {e}")
     except (SyntaxError, ValueError) as e:
-        logger.error(f"AST解析错误: {e}")
+        logger.error(f"ASR结果解码错误: {e}")
     except Exception as e:
         logger.error(f"处理文件时发生错误: {e}")
     
     return False
 
+def process_episode(task: Tuple[str, str, str, Optional[str], str]) -> Tuple[bool, float]:
+    """
+    在工作进程中处理单集ASR文件
+
+    Args:
+        task: (输入文件路径, 输出目录, JSON文件名, 文本文件名, 输出格式)
+
+    Returns:
+        (success, elapsed): 是否成功以及耗时（秒）
+    """
+    input_file, output_dir, json_filename, txt_filename, output_format = task
+    start_time = time.perf_counter()
+    success = process_asr_file(input_file, output_dir, json_filename, txt_filename, logging.getLogger(__name__),
+                               output_format)
+    return success, time.perf_counter() - start_time
+
 def parse_arguments() -> argparse.Namespace:
     """
     解析命令行参数
@@ -143,6 +474,16 @@ def parse_arguments() -> argparse.Namespace:
                       help='输出的JSON文件后缀 (默认: .json)')
     parser.add_argument('--txt-suffix', '-t', type=str, default=".txt",
                       help='输出的文本文件后缀 (默认: .txt)')
+    parser.add_argument('--text-report', action='store_true',
+                      help='同时输出文本格式的报告（默认不输出）')
+    parser.add_argument('--format', type=str, choices=["json", "columnar"], default="json",
+                      help='输出格式，columnar 为 columnar_store.py 的列式存储 (默认: json)')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                      help='并行处理的进程数，1 表示串行 (默认: 1)')
+    parser.add_argument('--manifest', type=str, default=DEFAULT_MANIFEST,
+                      help=f'记录输入指纹的清单文件，输入没有变化的集会被跳过 (默认: {DEFAULT_MANIFEST})')
+    parser.add_argument('--force', action='store_true',
+                      help='忽略清单，重新处理所有文件')
     return parser.parse_args()
 
 def main():
@@ -152,20 +493,47 @@ def main():
     
     success_count = 0
     failure_count = 0
+    manifest = Manifest(args.manifest)
     
+    tasks = []
     for i in range(args.start, args.end + 1):
         input_file = f"{args.input_prefix}{i}.json"
         json_filename = f"parsed_asr_result{i}{args.json_suffix}"
-        txt_filename = f"parsed_asr_result{i}{args.txt_suffix}"
-        
-        logger.info(f"正在处理文件: {input_file}")
-        
-        if process_asr_file(input_file, args.output, json_filename, txt_filename, logger):
-            success_count += 1
-        else:
-            failure_count += 1
+        txt_filename = f"parsed_asr_result{i}{args.txt_suffix}" if args.text_report else None
+        outputs = output_files(args.output, json_filename, txt_filename, args.format)
+        # 输入内容没有变化的集直接跳过
+        if not args.force and manifest.is_fresh("to_json", outputs, [input_file], {}):
+            continue
+        tasks.append((input_file, args.output, json_filename, txt_filename, args.format))
+    if len(tasks) < args.end - args.start + 1:
+        logger.info(f"跳过 {args.end - args.start + 1 - len(tasks)} 个未变化的文件")
+    
+    batch_start = time.perf_counter()
+    if args.workers > 1:
+        logger.info(f"使用 {args.workers} 个进程并行处理 {len(tasks)} 个文件")
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        outcomes = executor.map(process_episode, tasks)
+    else:
+        executor = None
+        outcomes = map(process_episode, tasks)
+    
+    try:
+        # 按输入顺序汇总结果，日志和统计与并行度无关
+        for task, (success, elapsed) in zip(tasks, outcomes):
+            logger.info(f"文件 {task[0]} 处理{'成功' if success else '失败'}，耗时 {elapsed:.2f}s")
+            if success:
+                success_count += 1
+                input_file, output_dir, json_filename, txt_filename, output_format = task
+                manifest.record("to_json", output_files(output_dir, json_filename, txt_filename, output_format),
+                                [input_file], {})
+            else:
+                failure_count += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        manifest.save()
     
-    logger.info(f"处理完成 - 成功: {success_count}, 失败: {failure_count}")
+    logger.info(f"处理完成 - 成功: {success_count}, 失败: {failure_count}, 总耗时 {time.perf_counter() - batch_start:.2f}s")
     if failure_count > 0:
         logger.error(f"有{failure_count}个文件处理失败")
 
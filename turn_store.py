@@ -0,0 +1,244 @@
+import json
+import sys
+import argparse
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from sentence_table import MergedTable
+
+class IntervalIndex:
+    """
+    静态区间树：区间按起点排序，在其上建立一棵保存子树最大终点的完全二叉树（数组存储）
+
+    查询与 [low, high) 重叠的区间时，起点不小于 high 的部分用二分直接排除，
+    最大终点不超过 low 的子树整棵跳过，耗时为 O(log n + k)（k 为结果数）。
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray):
+        """
+        Args:
+            starts: 各区间起点
+            ends: 各区间终点（不含）
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        self.order = np.argsort(starts, kind="stable")
+        self.starts = starts[self.order]
+        size = 1
+        while size < len(starts):
+            size *= 2
+        tree = np.full(2 * size, np.iinfo(np.int64).min, dtype=np.int64)
+        tree[size:size + len(starts)] = np.asarray(ends, dtype=np.int64)[self.order]
+        # 自底向上逐层计算，节点 k 的子节点为 2k 和 2k + 1
+        level = size
+        while level > 1:
+            tree[level // 2:level] = np.maximum(tree[level:2 * level:2], tree[level + 1:2 * level:2])
+            level //= 2
+        self.size = size
+        self.tree = tree
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def overlapping(self, low: int, high: int) -> np.ndarray:
+        """
+        与 [low, high) 重叠的区间
+
+        Args:
+            low: 查询起点
+            high: 查询终点（不含）
+
+        Returns:
+            np.ndarray: 区间编号（升序）
+        """
+        limit = int(np.searchsorted(self.starts, high, side="left"))
+        found = []
+        stack = [(1, 0, self.size)]
+        while stack:
+            node, left, right = stack.pop()
+            if left >= limit or self.tree[node] <= low:
+                continue
+            if node >= self.size:
+                found.append(left)
+                continue
+            middle = (left + right) // 2
+            stack.append((2 * node + 1, middle, right))
+            stack.append((2 * node, left, middle))
+        return np.sort(self.order[found])
+
+class TurnStore:
+    """
+    一个条目中合并后的发言，按时间建立区间索引
+
+    回答“t1 到 t2 之间说了什么”“时刻 t 正在说的发言”以及“某句发言之前最近的另一说话人的发言”，
+    用于按时间截取对话上下文。
+    """
+
+    def __init__(self, speakers: Sequence[str], start_ms: np.ndarray, end_ms: np.ndarray, texts: Sequence[str],
+                 key: str = ""):
+        """
+        Args:
+            speakers: 每轮发言的说话人标签
+            start_ms: 每轮发言的起始时间
+            end_ms: 每轮发言的结束时间
+            texts: 每轮发言的文本
+            key: 条目 key
+        """
+        self.key = key
+        self.speakers = list(speakers)
+        self.start_ms = np.asarray(start_ms, dtype=np.int64)
+        self.end_ms = np.asarray(end_ms, dtype=np.int64)
+        self.texts = texts
+        self.index = IntervalIndex(self.start_ms, self.end_ms)
+        # 连续同一说话人的发言共用同一个上一句：该段之前的最后一句
+        labels: Dict[str, int] = {}
+        speaker_ids = np.array([labels.setdefault(s, len(labels)) for s in self.speakers], dtype=np.int64)
+        change = np.ones(len(speaker_ids), dtype=bool)
+        change[1:] = speaker_ids[1:] != speaker_ids[:-1]
+        self.previous = np.maximum.accumulate(np.where(change, np.arange(len(speaker_ids)), 0)) - 1
+
+    @classmethod
+    def from_merged_table(cls, merged: MergedTable, key: str = "") -> "TurnStore":
+        """由 sentence_table.merge_table 的结果构建"""
+        speakers = merged.table.speakers
+        return cls([speakers[s] for s in merged.speaker_ids.tolist()], merged.start_ms, merged.end_ms,
+                   merged.texts, key)
+
+    @classmethod
+    def from_turns(cls, turns: Iterable[Dict], key: str = "") -> "TurnStore":
+        """由 merge_speaker 输出的 merged_sentences 构建"""
+        turns = list(turns)
+        return cls([t['speaker'] for t in turns], [t['start_ms'] for t in turns], [t['end_ms'] for t in turns],
+                   [t['text'] for t in turns], key)
+
+    def __len__(self) -> int:
+        return len(self.speakers)
+
+    def turn(self, i: int) -> Dict:
+        """第 i 轮发言"""
+        return {
+            'index': i,
+            'speaker': self.speakers[i],
+            'text': self.texts[i],
+            'start_ms': int(self.start_ms[i]),
+            'end_ms': int(self.end_ms[i])
+        }
+
+    def between(self, start_ms: int, end_ms: int) -> List[int]:
+        """
+        与 [start_ms, end_ms) 有重叠的发言
+
+        Args:
+            start_ms: 起始时间
+            end_ms: 结束时间
+
+        Returns:
+            List[int]: 发言编号（按顺序）
+        """
+        return self.index.overlapping(start_ms, end_ms).tolist()
+
+    def at(self, time_ms: int) -> Optional[int]:
+        """
+        时刻 time_ms 正在进行的发言，有多轮重叠时取开始最晚的一轮
+
+        Args:
+            time_ms: 时刻（毫秒）
+
+        Returns:
+            Optional[int]: 发言编号，没有时为 None
+        """
+        found = self.index.overlapping(time_ms, time_ms + 1)
+        if len(found) == 0:
+            return None
+        return int(found[np.argmax(self.start_ms[found])])
+
+    def previous_other(self, i: int) -> Optional[int]:
+        """
+        第 i 轮之前最近的另一说话人的发言
+
+        Args:
+            i: 发言编号
+
+        Returns:
+            Optional[int]: 发言编号，没有时为 None
+        """
+        previous = int(self.previous[i])
+        return previous if previous >= 0 else None
+
+    def window(self, i: int, before_ms: int, after_ms: int) -> List[int]:
+        """
+        第 i 轮发言前后一段时间内的所有发言，用作上下文
+
+        Args:
+            i: 发言编号
+            before_ms: 向前扩展的时长
+            after_ms: 向后扩展的时长
+
+        Returns:
+            List[int]: 发言编号（按顺序）
+        """
+        return self.between(int(self.start_ms[i]) - before_ms, int(self.end_ms[i]) + after_ms)
+
+def load_turn_stores(path: str) -> List[TurnStore]:
+    """
+    读取 merge_speaker 输出的一集，每个条目一个 TurnStore
+
+    Args:
+        path: JSON 文件或列式存储目录
+
+    Returns:
+        List[TurnStore]: 各条目的发言
+    """
+    from columnar_store import EpisodeStore, is_store
+
+    if is_store(path):
+        store = EpisodeStore(path)
+        return [TurnStore.from_turns(store.turn_dicts(item), key) for item, key in enumerate(store.keys)]
+    with open(path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    return [TurnStore.from_turns(item.get('merged_sentences', []), item.get('key', '')) for item in items]
+
+def parse_arguments() -> argparse.Namespace:
+    """
+    解析命令行参数
+
+    Returns:
+        args: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description='按时间查询合并后的发言')
+    parser.add_argument('input', type=str,
+                      help='merge_speaker.py 的输出（JSON 文件或 .cols 目录）')
+    parser.add_argument('--item', type=int, default=0,
+                      help='条目下标 (默认: 0)')
+    parser.add_argument('--between', type=int, nargs=2, metavar=('START_MS', 'END_MS'), default=None,
+                      help='输出与该时间段重叠的发言')
+    parser.add_argument('--at', type=int, default=None,
+                      help='输出该时刻正在进行的发言及其之前另一说话人的发言')
+    parser.add_argument('--context-ms', type=int, default=0,
+                      help='与 --at 一起使用，同时输出前后该时长内的发言 (默认: 0)')
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = load_turn_stores(args.input)[args.item]
+    logging.info(f"{args.input} 条目 {store.key}: {len(store)} 轮发言")
+
+    if args.between:
+        for i in store.between(*args.between):
+            sys.stdout.write(json.dumps(store.turn(i), ensure_ascii=False) + "\n")
+    if args.at is not None:
+        i = store.at(args.at)
+        if i is None:
+            logging.info(f"{args.at}ms 没有正在进行的发言")
+            return
+        previous = store.previous_other(i)
+        record = {'turn': store.turn(i), 'previous': store.turn(previous) if previous is not None else None}
+        if args.context_ms:
+            record['context'] = [store.turn(j) for j in store.window(i, args.context_ms, args.context_ms)]
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+if __name__ == "__main__":
+    main()